@@ -1,14 +1,35 @@
 import os
+import sys
+import time
 import uuid
 import json
 import re
 import sqlite3
-from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
-import pandas as pd
+import hashlib
+import threading
+import zipfile
+import gzip
+import zlib
+import codecs
+import tempfile
+import shutil
+from datetime import datetime, date
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, Response, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.sansio.multipart import MultipartDecoder, NEED_DATA, Field, File, Data, Epilogue
 import io
 import traceback
 from collections import Counter
+from concurrent.futures import Future
+
+
+from worker_pool import IsolatedWorkerPool, report_progress
+from single_flight import SingleFlight
+
+try:
+    import brotli
+except ImportError:  # compressão brotli é opcional; gzip sempre disponível
+    brotli = None
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
@@ -18,14 +39,40 @@ UPLOAD_FOLDER = 'uploads'
 RESULTS_FOLDER = 'results'
 DATABASE_PATH = 'financial_reports.db'
 
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(RESULTS_FOLDER, exist_ok=True)
+# Tempo de espera por locks do SQLite quando vários workers escrevem ao mesmo tempo
+DB_BUSY_TIMEOUT_SECONDS = 30
+
+storage_lock = threading.Lock()
+storage_initialized = False
+
+def connect_db():
+    """Abre uma conexão com o banco esperando por locks em vez de falhar com 'database is locked'"""
+    return sqlite3.connect(DATABASE_PATH, timeout=DB_BUSY_TIMEOUT_SECONDS)
+
+def init_storage():
+    """Cria as pastas e inicializa o banco uma vez por processo"""
+    global storage_initialized
+    with storage_lock:
+        if not storage_initialized:
+            os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+            os.makedirs(RESULTS_FOLDER, exist_ok=True)
+            init_database()
+            storage_initialized = True
 
 def init_database():
-    """Inicializa o banco de dados"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    """Inicializa o banco de dados
+
+    Idempotente e seguro quando vários workers sobem juntos: a criação e as
+    migrações rodam numa única transação BEGIN IMMEDIATE, então um processo
+    espera o outro terminar e depois só encontra as tabelas prontas.
+    """
+    conn = connect_db()
     cursor = conn.cursor()
     
+    # WAL: leituras não bloqueiam a escrita de outro worker (persistente no arquivo)
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('BEGIN IMMEDIATE')
+    
     # Tabela de sessões
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS sessions (
@@ -55,18 +102,359 @@ def init_database():
             year_ref INTEGER,
             success BOOLEAN,
             error_message TEXT,
-            warnings TEXT,
+            warnings TEXT,  -- legado (JSON); os avisos ficam em file_warnings
             data_quality TEXT,
             processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (session_id) REFERENCES sessions (id)
         )
     ''')
     
+    # Colunas adicionadas depois da criação original da tabela
+    ensure_column(cursor, 'processed_files', 'file_hash', 'TEXT')
+    ensure_column(cursor, 'processed_files', 'file_size', 'INTEGER')
+    # Linha copiada por duplicate_session: id da linha original (fica fora do histórico por período)
+    duplicated_from_added = ensure_column(cursor, 'processed_files', 'duplicated_from', 'INTEGER')
+    
+    # Contagem de referências por arquivo físico
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_processed_files_filename ON processed_files (filename)')
+    # Consultas por sessão (carregamento, validação de ETag da API)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_processed_files_session ON processed_files (session_id)')
+    # Cópias de cada linha (promoção quando a original é excluída)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_processed_files_duplicated_from ON processed_files (duplicated_from)')
+    
+    # Layouts de planilha conhecidos (via rápida de extração)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS layout_templates (
+            fingerprint TEXT PRIMARY KEY,
+            sheet_name TEXT NOT NULL,
+            total_cell TEXT NOT NULL,
+            emission_cell TEXT,
+            due_cell TEXT,
+            confirmations INTEGER DEFAULT 0,
+            conflicts INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Layouts aprendidos antes da comparação exata do total (exact_total = 0)
+    # podem apontar para uma célula vizinha; ficam fora da via rápida até serem reaprendidos
+    ensure_column(cursor, 'layout_templates', 'exact_total', 'INTEGER NOT NULL DEFAULT 0')
+    
+    # Estatísticas pré-computadas por período (mês/ano), mantidas por triggers
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'period_statistics'")
+    period_statistics_exists = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS period_statistics (
+            year_ref INTEGER NOT NULL,
+            month_ref INTEGER NOT NULL,
+            file_count INTEGER NOT NULL DEFAULT 0,
+            total REAL NOT NULL DEFAULT 0,
+            total_sq REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (year_ref, month_ref)
+        ) WITHOUT ROWID
+    ''')
+    if duplicated_from_added:
+        # Triggers antigos contavam as cópias: recria com a condição atual
+        for suffix in ('insert', 'delete', 'update_old', 'update_new'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS trg_period_statistics_{suffix}')
+    create_period_statistics_triggers(cursor)
+    # Idempotente: os triggers ajustam period_statistics para as cópias encontradas
+    mark_existing_duplicates(cursor)
+    if not period_statistics_exists or duplicated_from_added:
+        rebuild_period_statistics(cursor)
+    
+    # Totais mensais por sessão (base das séries do gráfico), mantidos por triggers
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'session_period_totals'")
+    session_period_totals_exists = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS session_period_totals (
+            session_id TEXT NOT NULL,
+            year_ref INTEGER NOT NULL,
+            month_ref INTEGER NOT NULL,
+            file_count INTEGER NOT NULL DEFAULT 0,
+            total REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (session_id, year_ref, month_ref)
+        ) WITHOUT ROWID
+    ''')
+    create_session_period_totals_triggers(cursor)
+    if not session_period_totals_exists:
+        rebuild_session_period_totals(cursor)
+    
+    # Avisos normalizados: cada texto distinto vira um código (warning_codes)
+    # e file_warnings liga arquivo -> códigos, na ordem em que foram gerados
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'file_warnings'")
+    file_warnings_exists = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS warning_codes (
+            code INTEGER PRIMARY KEY,
+            message TEXT NOT NULL UNIQUE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS file_warnings (
+            file_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            code INTEGER NOT NULL,
+            PRIMARY KEY (file_id, position)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_file_warnings_code ON file_warnings (code)')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS processed_files_delete_warnings
+        AFTER DELETE ON processed_files
+        BEGIN DELETE FROM file_warnings WHERE file_id = old.id; END
+    ''')
+    if not file_warnings_exists:
+        migrate_file_warnings(cursor)
+    
+    # Telemetria de processamento por arquivo (tamanho da aba, engine, tempos e memória)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS file_telemetry (
+            file_id INTEGER PRIMARY KEY,
+            engine TEXT,
+            sheet_rows INTEGER,
+            sheet_cols INTEGER,
+            total_ms REAL,
+            peak_rss_kb INTEGER,
+            rss_growth_kb INTEGER
+        )
+    ''')
+    # Arquivos que falharam também têm telemetria: última etapa alcançada e tipo da falha
+    ensure_column(cursor, 'file_telemetry', 'last_stage', 'TEXT')
+    ensure_column(cursor, 'file_telemetry', 'failure', 'TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_file_telemetry_total_ms ON file_telemetry (total_ms)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS file_stage_timings (
+            file_id INTEGER NOT NULL,
+            stage TEXT NOT NULL,
+            duration_ms REAL NOT NULL,
+            PRIMARY KEY (file_id, stage)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS processed_files_delete_telemetry
+        AFTER DELETE ON processed_files
+        BEGIN
+            DELETE FROM file_telemetry WHERE file_id = old.id;
+            DELETE FROM file_stage_timings WHERE file_id = old.id;
+        END
+    ''')
+    
+    # Fila persistente de arquivos candidatos à remoção
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS file_gc_queue (
+            filename TEXT PRIMARY KEY,
+            queued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
     conn.commit()
     conn.close()
 
-# Inicializa o banco na primeira execução
-init_database()
+def ensure_column(cursor, table, column, column_type):
+    """Adiciona a coluna à tabela caso ainda não exista (migração de bancos antigos)
+
+    Retorna True quando a coluna foi criada agora.
+    """
+    cursor.execute(f'PRAGMA table_info({table})')
+    existing = [row[1] for row in cursor.fetchall()]
+    if column not in existing:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+        return True
+    return False
+
+def mark_existing_duplicates(cursor):
+    """Preenche duplicated_from nas cópias feitas antes da coluna existir
+
+    Cada upload grava um arquivo com nome único, então só uma cópia de sessão
+    compartilha o arquivo armazenado e a aba com outra linha; a original é a de
+    menor id. O título da sessão não é usado (cópias podem ter sido renomeadas).
+    """
+    cursor.execute('''
+        UPDATE processed_files SET duplicated_from = (
+            SELECT MIN(original.id) FROM processed_files original
+            WHERE original.filename = processed_files.filename
+              AND original.sheet_name IS processed_files.sheet_name
+              AND original.id < processed_files.id
+        )
+        WHERE duplicated_from IS NULL AND filename != ''
+          AND EXISTS (
+            SELECT 1 FROM processed_files original
+            WHERE original.filename = processed_files.filename
+              AND original.sheet_name IS processed_files.sheet_name
+              AND original.id < processed_files.id
+          )
+    ''')
+
+# Condição para uma linha de processed_files entrar nos totais por período
+PERIOD_TOTALS_CONDITION = "{row}.success = 1 AND {row}.total_value > 0 AND {row}.year_ref IS NOT NULL AND {row}.month_ref IS NOT NULL"
+# O histórico global (period_statistics) conta cada arquivo uma vez: cópias de sessão ficam fora
+PERIOD_STATISTICS_CONDITION = PERIOD_TOTALS_CONDITION + " AND {row}.duplicated_from IS NULL"
+
+def create_period_statistics_triggers(cursor):
+    """Cria os triggers que mantêm period_statistics em sincronia com processed_files"""
+    add_row = '''
+        INSERT INTO period_statistics (year_ref, month_ref, file_count, total, total_sq)
+        VALUES (NEW.year_ref, NEW.month_ref, 1, NEW.total_value, NEW.total_value * NEW.total_value)
+        ON CONFLICT (year_ref, month_ref) DO UPDATE SET
+            file_count = file_count + 1,
+            total = total + excluded.total,
+            total_sq = total_sq + excluded.total_sq;
+    '''
+    remove_row = '''
+        UPDATE period_statistics SET
+            file_count = file_count - 1,
+            total = total - OLD.total_value,
+            total_sq = total_sq - OLD.total_value * OLD.total_value
+        WHERE year_ref = OLD.year_ref AND month_ref = OLD.month_ref;
+    '''
+    new_condition = PERIOD_STATISTICS_CONDITION.format(row='NEW')
+    old_condition = PERIOD_STATISTICS_CONDITION.format(row='OLD')
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_period_statistics_insert
+        AFTER INSERT ON processed_files WHEN {new_condition}
+        BEGIN {add_row} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_period_statistics_delete
+        AFTER DELETE ON processed_files WHEN {old_condition}
+        BEGIN {remove_row} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_period_statistics_update_old
+        AFTER UPDATE OF success, total_value, year_ref, month_ref, duplicated_from ON processed_files WHEN {old_condition}
+        BEGIN {remove_row} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_period_statistics_update_new
+        AFTER UPDATE OF success, total_value, year_ref, month_ref, duplicated_from ON processed_files WHEN {new_condition}
+        BEGIN {add_row} END
+    ''')
+    # Excluída a linha original, a cópia mais antiga passa a representar o arquivo
+    # no histórico (e as demais cópias passam a apontar para ela)
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_processed_files_promote_copy
+        AFTER DELETE ON processed_files WHEN OLD.duplicated_from IS NULL
+        BEGIN
+            UPDATE processed_files
+            SET duplicated_from = (SELECT MIN(id) FROM processed_files WHERE duplicated_from = OLD.id)
+            WHERE duplicated_from = OLD.id
+              AND id > (SELECT MIN(id) FROM processed_files WHERE duplicated_from = OLD.id);
+            UPDATE processed_files SET duplicated_from = NULL WHERE duplicated_from = OLD.id;
+        END
+    ''')
+
+def rebuild_period_statistics(cursor):
+    """Recalcula period_statistics do zero a partir de processed_files"""
+    cursor.execute('DELETE FROM period_statistics')
+    cursor.execute(f'''
+        INSERT INTO period_statistics (year_ref, month_ref, file_count, total, total_sq)
+        SELECT year_ref, month_ref, COUNT(*), SUM(total_value), SUM(total_value * total_value)
+        FROM processed_files pf
+        WHERE {PERIOD_STATISTICS_CONDITION.format(row='pf')}
+        GROUP BY year_ref, month_ref
+    ''')
+
+def create_session_period_totals_triggers(cursor):
+    """Cria os triggers que mantêm session_period_totals em sincronia com processed_files"""
+    add_row = '''
+        INSERT INTO session_period_totals (session_id, year_ref, month_ref, file_count, total)
+        VALUES (NEW.session_id, NEW.year_ref, NEW.month_ref, 1, NEW.total_value)
+        ON CONFLICT (session_id, year_ref, month_ref) DO UPDATE SET
+            file_count = file_count + 1,
+            total = total + excluded.total;
+    '''
+    remove_row = '''
+        UPDATE session_period_totals SET
+            file_count = file_count - 1,
+            total = total - OLD.total_value
+        WHERE session_id = OLD.session_id AND year_ref = OLD.year_ref AND month_ref = OLD.month_ref;
+    '''
+    new_condition = PERIOD_TOTALS_CONDITION.format(row='NEW')
+    old_condition = PERIOD_TOTALS_CONDITION.format(row='OLD')
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_session_period_totals_insert
+        AFTER INSERT ON processed_files WHEN {new_condition}
+        BEGIN {add_row} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_session_period_totals_delete
+        AFTER DELETE ON processed_files WHEN {old_condition}
+        BEGIN {remove_row} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_session_period_totals_update_old
+        AFTER UPDATE OF session_id, success, total_value, year_ref, month_ref ON processed_files WHEN {old_condition}
+        BEGIN {remove_row} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_session_period_totals_update_new
+        AFTER UPDATE OF session_id, success, total_value, year_ref, month_ref ON processed_files WHEN {new_condition}
+        BEGIN {add_row} END
+    ''')
+
+def rebuild_session_period_totals(cursor):
+    """Recalcula session_period_totals do zero a partir de processed_files"""
+    cursor.execute('DELETE FROM session_period_totals')
+    cursor.execute(f'''
+        INSERT INTO session_period_totals (session_id, year_ref, month_ref, file_count, total)
+        SELECT session_id, year_ref, month_ref, COUNT(*), SUM(total_value)
+        FROM processed_files pf
+        WHERE {PERIOD_TOTALS_CONDITION.format(row='pf')}
+        GROUP BY session_id, year_ref, month_ref
+    ''')
+
+def store_file_warnings(cursor, file_id, warnings):
+    """Grava os avisos de um arquivo, criando os códigos que ainda não existem"""
+    if not warnings:
+        return
+    cursor.executemany('INSERT OR IGNORE INTO warning_codes (message) VALUES (?)',
+                       [(message,) for message in warnings])
+    cursor.executemany('''
+        INSERT OR REPLACE INTO file_warnings (file_id, position, code)
+        SELECT ?, ?, code FROM warning_codes WHERE message = ?
+    ''', [(file_id, position, message) for position, message in enumerate(warnings)])
+
+def migrate_file_warnings(cursor):
+    """Copia os avisos gravados como JSON em processed_files.warnings (bancos antigos)"""
+    cursor.execute("SELECT id, warnings FROM processed_files WHERE warnings IS NOT NULL AND warnings NOT IN ('', '[]')")
+    for file_id, warnings_json in cursor.fetchall():
+        try:
+            warnings = json.loads(warnings_json)
+        except ValueError:
+            continue
+        store_file_warnings(cursor, file_id, [str(w) for w in warnings])
+
+def store_file_telemetry(cursor, file_id, telemetry):
+    """Grava a telemetria de processamento de um arquivo (ver run_extraction_pipeline)"""
+    if not telemetry:
+        return
+    cursor.execute('''
+        INSERT OR REPLACE INTO file_telemetry (file_id, engine, sheet_rows, sheet_cols, total_ms, peak_rss_kb, rss_growth_kb,
+                                               last_stage, failure)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (file_id, telemetry.get('engine'), telemetry.get('sheet_rows'), telemetry.get('sheet_cols'),
+          telemetry.get('total_ms'), telemetry.get('peak_rss_kb'), telemetry.get('rss_growth_kb'),
+          telemetry.get('last_stage'), telemetry.get('failure')))
+    cursor.executemany('INSERT OR REPLACE INTO file_stage_timings (file_id, stage, duration_ms) VALUES (?, ?, ?)',
+                       [(file_id, stage, duration) for stage, duration in (telemetry.get('stages') or {}).items()])
+
+def load_file_warnings(cursor, session_id):
+    """Avisos de todos os arquivos da sessão em uma consulta: {file_id: [mensagens]}"""
+    cursor.execute('''
+        SELECT fw.file_id, wc.message
+        FROM processed_files pf
+        JOIN file_warnings fw ON fw.file_id = pf.id
+        JOIN warning_codes wc ON wc.code = fw.code
+        WHERE pf.session_id = ?
+        ORDER BY fw.file_id, fw.position
+    ''', (session_id,))
+    warnings_by_file = {}
+    for file_id, message in cursor.fetchall():
+        warnings_by_file.setdefault(file_id, []).append(message)
+    return warnings_by_file
 
 def format_currency_br(value):
     """Formata valor para padrão brasileiro: R$ 1.234.567,89"""
@@ -80,7 +468,7 @@ def format_currency_br(value):
 def format_date_br(date_str):
     """Formata data para padrão brasileiro: dd/mm/aaaa"""
     try:
-        if not date_str or date_str == '-' or pd.isna(date_str):
+        if not date_str or date_str == '-' or date_str != date_str:  # NaN/NaT
             return "-"
         
         # Se já está no formato brasileiro
@@ -164,7 +552,7 @@ def home():
     try:
         print("🏠 Carregando página inicial...")
         
-        conn = sqlite3.connect(DATABASE_PATH)
+        conn = connect_db()
         cursor = conn.cursor()
         
         # Query corrigida para buscar sessões ativas
@@ -232,119 +620,544 @@ def new_session():
     """Cria nova sessão e redireciona para upload"""
     return redirect(url_for('upload_page'))
 
+# Limites e parâmetros do upload em streaming
+ALLOWED_EXTENSIONS = ('.xlsx', '.xls', '.csv')
+ARCHIVE_EXTENSIONS = ('.zip',)
+UPLOAD_CHUNK_SIZE = 64 * 1024  # 64 KB por leitura/escrita
+MAX_UPLOAD_FILE_SIZE = 50 * 1024 * 1024  # 50 MB por arquivo
+MAX_UPLOAD_ARCHIVE_SIZE = 200 * 1024 * 1024  # 200 MB por arquivo ZIP
+MAX_ARCHIVE_MEMBERS = 1000  # planilhas por arquivo ZIP
+MAX_UPLOAD_REQUEST_SIZE = 500 * 1024 * 1024  # 500 MB por requisição
+MAX_UPLOAD_FILES = 200  # arquivos por requisição
+UPLOAD_PARSE_WORKERS = 4
+
+# Limites de cada arquivo no processamento isolado (ajustáveis por variável de ambiente)
+PARSE_TIMEOUT_SECONDS = int(os.environ.get('PARSE_TIMEOUT_SECONDS', 120))
+PARSE_MEMORY_LIMIT_MB = int(os.environ.get('PARSE_MEMORY_LIMIT_MB', 1024))  # além do que o worker usa após o preload
+PARSE_WORKER_MAX_TASKS = int(os.environ.get('PARSE_WORKER_MAX_TASKS', 50))  # reciclagem do processo
+
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_REQUEST_SIZE
+
+def preload_parsing_modules():
+    """Importa as bibliotecas de leitura ao iniciar cada worker (fora do tempo do primeiro arquivo)"""
+    import pandas  # noqa: F401
+    import openpyxl  # noqa: F401
+    load_pyarrow_csv()
+
+# Pool compartilhado de processos isolados: o processamento começa assim que
+# cada arquivo termina de chegar, e um arquivo que estoura tempo ou memória
+# volta como resultado de erro sem afetar o servidor
+upload_executor = IsolatedWorkerPool(
+    max_workers=UPLOAD_PARSE_WORKERS,
+    timeout=PARSE_TIMEOUT_SECONDS,
+    memory_limit_mb=PARSE_MEMORY_LIMIT_MB,
+    max_tasks_per_worker=PARSE_WORKER_MAX_TASKS,
+    initializer=preload_parsing_modules,
+    preload_modules=('app', 'pandas', 'openpyxl')
+)
+
+# Uploads simultâneos do mesmo arquivo (mesmo conteúdo e nome) compartilham um
+# único processamento; o nome entra na chave porque define o período de referência
+parse_flight = SingleFlight()
+
+def submit_parse(upload_info, multi_sheet=False):
+    """Envia o arquivo ao pool ou reaproveita o processamento idêntico já em andamento"""
+    key = (upload_info['file_hash'], upload_info['filename'], bool(multi_sheet))
+    return parse_flight.submit(key, lambda: upload_executor.submit(
+        process_upload, upload_info['filepath'], upload_info['filename'], multi_sheet))
+
+def stream_multipart_uploads(stream, boundary):
+    """Lê o corpo multipart em blocos de tamanho fixo, gravando cada arquivo em disco
+    enquanto calcula seu hash SHA-256.
+
+    Gera eventos assim que cada parte termina de chegar:
+      ('field', {'name', 'value'})
+      ('file', {'filename', 'stored_filename', 'filepath', 'file_hash', 'file_size'})
+      ('rejected', {'filename', 'reason'})
+    """
+    decoder = MultipartDecoder(boundary.encode('latin-1'), max_form_memory_size=UPLOAD_CHUNK_SIZE * 16)
+    current = None
+    file_count = 0
+    stream_finished = False
+
+    try:
+        while True:
+            event = decoder.next_event()
+
+            if event is NEED_DATA:
+                if stream_finished:
+                    raise ValueError('Corpo da requisição terminou antes do fim do multipart')
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    stream_finished = True
+                    decoder.receive_data(None)
+                else:
+                    decoder.receive_data(chunk)
+
+            elif isinstance(event, File):
+                filename = (event.filename or '').strip()
+                if not filename:
+                    current = {'kind': 'skip'}
+                elif not filename.lower().endswith(ALLOWED_EXTENSIONS + ARCHIVE_EXTENSIONS):
+                    current = {'kind': 'rejected', 'filename': filename,
+                               'reason': 'tem formato não suportado'}
+                elif file_count >= MAX_UPLOAD_FILES:
+                    current = {'kind': 'rejected', 'filename': filename,
+                               'reason': f'excede o limite de {MAX_UPLOAD_FILES} arquivos por envio'}
+                else:
+                    file_count += 1
+                    unique_filename = f"{uuid.uuid4()}{os.path.splitext(filename)[1]}"
+                    filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
+                    current = {
+                        'kind': 'file',
+                        'filename': filename,
+                        'stored_filename': unique_filename,
+                        'filepath': filepath,
+                        'handle': open(filepath, 'wb'),
+                        'hasher': hashlib.sha256(),
+                        'size': 0,
+                        'max_size': MAX_UPLOAD_ARCHIVE_SIZE if filename.lower().endswith(ARCHIVE_EXTENSIONS) else MAX_UPLOAD_FILE_SIZE
+                    }
+
+            elif isinstance(event, Field):
+                current = {'kind': 'field', 'name': event.name, 'buffer': bytearray()}
+
+            elif isinstance(event, Data):
+                if current is None:
+                    continue
+
+                if current['kind'] == 'field':
+                    current['buffer'].extend(event.data)
+                elif current['kind'] == 'file':
+                    current['size'] += len(event.data)
+                    if current['size'] > current['max_size']:
+                        # Descarta o arquivo parcial e ignora o restante da parte
+                        current['handle'].close()
+                        os.remove(current['filepath'])
+                        current = {'kind': 'rejected', 'filename': current['filename'],
+                                   'reason': f"excede o limite de {current['max_size'] // (1024 * 1024)} MB por arquivo"}
+                    else:
+                        current['handle'].write(event.data)
+                        current['hasher'].update(event.data)
+
+                if event.more_data:
+                    continue
+
+                # Parte concluída
+                if current['kind'] == 'field':
+                    yield 'field', {'name': current['name'], 'value': current['buffer'].decode('utf-8', 'replace')}
+                elif current['kind'] == 'file':
+                    current['handle'].close()
+                    yield 'file', {
+                        'filename': current['filename'],
+                        'stored_filename': current['stored_filename'],
+                        'filepath': current['filepath'],
+                        'file_hash': current['hasher'].hexdigest(),
+                        'file_size': current['size']
+                    }
+                elif current['kind'] == 'rejected':
+                    yield 'rejected', {'filename': current['filename'], 'reason': current['reason']}
+                current = None
+
+            elif isinstance(event, Epilogue):
+                break
+
+    finally:
+        # Conexão interrompida no meio de um arquivo: remove o arquivo parcial
+        if current is not None and current.get('kind') == 'file' and not current['handle'].closed:
+            current['handle'].close()
+            if os.path.exists(current['filepath']):
+                os.remove(current['filepath'])
+
+def store_local_file(source_path, filename=None):
+    """Copia um arquivo local para uploads/ em blocos, calculando o hash (ingestão fora do HTTP)
+
+    Retorna os mesmos dados de um arquivo recebido por stream_multipart_uploads.
+    """
+    filename = filename or os.path.basename(source_path)
+    unique_filename = f"{uuid.uuid4()}{os.path.splitext(filename)[1].lower()}"
+    filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
+    hasher = hashlib.sha256()
+    size = 0
+
+    with open(source_path, 'rb') as source, open(filepath, 'wb') as target:
+        while True:
+            chunk = source.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            target.write(chunk)
+            hasher.update(chunk)
+
+    return {
+        'filename': filename,
+        'stored_filename': unique_filename,
+        'filepath': filepath,
+        'file_hash': hasher.hexdigest(),
+        'file_size': size
+    }
+
+def new_upload_budget():
+    """Contadores de um envio: arquivos enviados (um ZIP conta como um) e bytes
+    gravados, inclusive os extraídos de ZIPs"""
+    return {'files': 0, 'bytes': 0}
+
+def upload_bytes_exceeded(budget):
+    """Motivo da recusa quando o envio já gravou MAX_UPLOAD_REQUEST_SIZE bytes"""
+    if budget['bytes'] >= MAX_UPLOAD_REQUEST_SIZE:
+        return f'excede o limite de {MAX_UPLOAD_REQUEST_SIZE // (1024 * 1024)} MB por envio'
+    return None
+
+def upload_budget_exceeded(budget):
+    """Motivo da recusa quando o envio já atingiu MAX_UPLOAD_FILES ou MAX_UPLOAD_REQUEST_SIZE"""
+    if budget['files'] >= MAX_UPLOAD_FILES:
+        return f'excede o limite de {MAX_UPLOAD_FILES} arquivos por envio'
+    return upload_bytes_exceeded(budget)
+
+# Falhas de leitura de um membro do ZIP: senha (RuntimeError), compressão não
+# suportada, conteúdo corrompido ou truncado
+ARCHIVE_MEMBER_ERRORS = (RuntimeError, NotImplementedError, EOFError, zipfile.BadZipFile, zlib.error)
+
+def expand_archive_upload(archive_info, budget=None):
+    """Extrai as planilhas de um ZIP recebido, uma a uma, em streaming
+
+    Cada membro é descompactado em blocos direto para uploads/ (com hash e
+    limite de tamanho) e gerado assim que termina, para que o processamento
+    comece enquanto os demais membros ainda estão sendo extraídos. Cada ZIP
+    tem seu próprio limite de MAX_ARCHIVE_MEMBERS planilhas; só os bytes
+    descompactados contam no `budget` do envio, e ao atingir o limite de
+    bytes a extração para. O ZIP é removido no final. Gera os eventos de
+    stream_multipart_uploads ('file' e 'rejected') e ('failed', {..., 'error'})
+    para membros que não puderam ser extraídos.
+    """
+    if budget is None:
+        budget = new_upload_budget()
+    archive_path = archive_info['filepath']
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            members = [
+                info for info in archive.infolist()
+                if not info.is_dir() and not os.path.basename(info.filename).startswith(('.', '~$'))
+                and '__MACOSX' not in info.filename
+            ]
+            extracted = 0
+            for index, info in enumerate(members):
+                member_name = info.filename
+                if not member_name.lower().endswith(ALLOWED_EXTENSIONS):
+                    yield 'rejected', {'filename': member_name, 'reason': 'tem formato não suportado'}
+                    continue
+                if extracted >= MAX_ARCHIVE_MEMBERS:
+                    reason = f'excede o limite de {MAX_ARCHIVE_MEMBERS} arquivos por ZIP'
+                else:
+                    reason = upload_bytes_exceeded(budget)
+                if reason:
+                    remaining = len(members) - index
+                    yield 'rejected', {'filename': f"{archive_info['filename']} ({remaining} item(ns) restante(s))",
+                                       'reason': reason}
+                    break
+                if info.file_size > MAX_UPLOAD_FILE_SIZE:
+                    yield 'rejected', {'filename': member_name,
+                                       'reason': f'excede o limite de {MAX_UPLOAD_FILE_SIZE // (1024 * 1024)} MB por arquivo'}
+                    continue
+
+                unique_filename = f"{uuid.uuid4()}{os.path.splitext(member_name)[1].lower()}"
+                filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
+                hasher = hashlib.sha256()
+                size = 0
+                # Não confia no tamanho declarado no ZIP: o limite vale para os bytes descompactados
+                size_limit = min(MAX_UPLOAD_FILE_SIZE, MAX_UPLOAD_REQUEST_SIZE - budget['bytes'])
+                try:
+                    with archive.open(info) as source, open(filepath, 'wb') as target:
+                        while True:
+                            chunk = source.read(UPLOAD_CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            size += len(chunk)
+                            if size > size_limit:
+                                break
+                            target.write(chunk)
+                            hasher.update(chunk)
+                except ARCHIVE_MEMBER_ERRORS as e:
+                    if os.path.exists(filepath):
+                        os.remove(filepath)
+                    print(f"❌ Não foi possível extrair {member_name}: {e}")
+                    yield 'failed', {
+                        'filename': member_name,
+                        'stored_filename': '',
+                        'filepath': None,
+                        'file_hash': None,
+                        'file_size': 0,
+                        'error': 'não foi possível extrair do ZIP: ' + (
+                            'arquivo protegido por senha' if 'encrypted' in str(e) else f'arquivo corrompido ou não suportado ({e})')
+                    }
+                    continue
+
+                if size > size_limit:
+                    os.remove(filepath)
+                    if size_limit < MAX_UPLOAD_FILE_SIZE:
+                        budget['bytes'] = MAX_UPLOAD_REQUEST_SIZE
+                        yield 'rejected', {'filename': member_name,
+                                           'reason': f'excede o limite de {MAX_UPLOAD_REQUEST_SIZE // (1024 * 1024)} MB por envio'}
+                        continue
+                    yield 'rejected', {'filename': member_name,
+                                       'reason': f'excede o limite de {MAX_UPLOAD_FILE_SIZE // (1024 * 1024)} MB por arquivo'}
+                    continue
+
+                extracted += 1
+                budget['bytes'] += size
+                yield 'file', {
+                    'filename': member_name,
+                    'stored_filename': unique_filename,
+                    'filepath': filepath,
+                    'file_hash': hasher.hexdigest(),
+                    'file_size': size
+                }
+    except zipfile.BadZipFile:
+        yield 'rejected', {'filename': archive_info['filename'], 'reason': 'não é um arquivo ZIP válido'}
+    finally:
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+
+def failed_upload_future(message):
+    """Future já concluído com erro, para arquivos que falharam antes do processamento"""
+    future = Future()
+    future.set_exception(ValueError(message))
+    return future
+
+def build_error_result(filename, message):
+    """Monta o resultado padrão de um arquivo que falhou no processamento"""
+    return {
+        'filename': filename,
+        'error': message,
+        'success': False,
+        'total_value': 0.0,
+        'month': None,
+        'year': None,
+        'emission_date': None,
+        'due_date': None,
+        'warnings': [message],
+        'data_quality': 'error'
+    }
+
+def process_upload(filepath, filename, multi_sheet=False):
+    """Processa um arquivo recebido; retorna sempre uma lista de resultados (uma por aba no modo multiabas)"""
+    if multi_sheet:
+        return process_workbook(filepath, filename)
+    return [process_file(filepath, filename)]
+
+def collect_upload_results(session_id, pending):
+    """Aguarda o processamento de cada arquivo (na ordem de chegada) e salva os resultados
+
+    `pending` é uma lista de (upload_info, future) em que o future devolve a
+    lista de resultados de process_upload. Retorna (resultados, sucessos, valor_total).
+    """
+    # Histórico das sessões anteriores (uma leitura por upload)
+    period_history = load_period_history()
+
+    results = []
+    successful_files = 0
+    total_value = 0
+
+    for i, (upload_info, future) in enumerate(pending):
+        filename = upload_info['filename']
+        try:
+            print(f"📊 Aguardando arquivo {i+1}/{len(pending)}: {filename}")
+            # Cópias: o mesmo resultado pode ter sido compartilhado com outro upload
+            file_results = [dict(result) for result in future.result()]
+            stored_filename = upload_info['stored_filename']
+        except Exception as e:
+            print(f"❌ Erro ao processar {filename}: {str(e)}")
+            traceback.print_exc()
+            error_result = build_error_result(filename, f'Erro no processamento: {str(e)}')
+            if getattr(e, 'elapsed_ms', None) is not None:
+                # Tempo limite, memória ou queda do worker: o que o supervisor mediu
+                error_result['telemetry'] = {'total_ms': e.elapsed_ms, 'last_stage': e.last_stage,
+                                             'failure': type(e).__name__}
+            file_results = [error_result]
+            stored_filename = ''
+
+        for result in file_results:
+            result = validate_against_history(result, period_history)
+            result['file_hash'] = upload_info['file_hash']
+            result['file_size'] = upload_info['file_size']
+            results.append(result)
+
+            if result.get('success', False):
+                successful_files += 1
+                total_value += result.get('total_value', 0)
+
+            # Salva no banco (arquivo mantido para possível reprocessamento)
+            save_processed_file(session_id, result, stored_filename)
+        print(f"🔄 Arquivo processado: {filename}")
+
+    return results, successful_files, total_value
+
+def receive_uploads(boundary):
+    """Recebe o multipart em streaming e envia cada planilha ao pool assim que termina de chegar
+
+    Retorna (campos do formulário, [(upload_info, future)] na ordem de chegada);
+    arquivos recusados viram mensagens flash.
+    """
+    form = {}
+    pending = []
+    budget = new_upload_budget()
+
+    for kind, payload in stream_multipart_uploads(request.stream, boundary):
+        if kind == 'field':
+            form[payload['name']] = payload['value']
+        elif kind == 'rejected':
+            flash(f"Arquivo {payload['filename']} {payload['reason']}.", 'warning')
+        elif kind == 'file':
+            print(f"✅ Arquivo salvo: {payload['filepath']} ({payload['file_size']} bytes)")
+            # O modo multiabas vem em um campo enviado antes dos arquivos (ou na query string)
+            multi_sheet = (form.get('multi_sheet') or request.args.get('multi_sheet')) in ('1', 'true', 'on')
+
+            reason = upload_budget_exceeded(budget)
+            if reason:
+                os.remove(payload['filepath'])
+                flash(f"Arquivo {payload['filename']} {reason}.", 'warning')
+                continue
+            budget['files'] += 1
+
+            if payload['filename'].lower().endswith(ARCHIVE_EXTENSIONS):
+                # ZIP: cada planilha segue para o processamento assim que é extraída
+                skipped = []
+                for member_kind, member in expand_archive_upload(payload, budget):
+                    if member_kind == 'rejected':
+                        skipped.append(member)
+                        print(f"⚠️ {member['filename']} {member['reason']}")
+                        continue
+                    if member_kind == 'failed':
+                        pending.append((member, failed_upload_future(member['error'])))
+                        continue
+                    future = submit_parse(member, multi_sheet)
+                    pending.append((member, future))
+                if len(skipped) <= 3:
+                    for member in skipped:
+                        flash(f"Arquivo {member['filename']} {member['reason']}.", 'warning')
+                else:
+                    flash(f"{len(skipped)} item(ns) de {payload['filename']} foram ignorados (formato ou tamanho não suportado).", 'warning')
+                continue
+
+            budget['bytes'] += payload['file_size']
+
+            future = submit_parse(payload, multi_sheet)
+            pending.append((payload, future))
+
+    return form, pending
+
+def flash_upload_summary(successful_files, total_results):
+    """Feedback do processamento (no modo multiabas cada aba conta como um arquivo)"""
+    if successful_files == total_results:
+        flash(f'✅ Todos os {successful_files} arquivo(s) foram processados com sucesso!', 'success')
+    elif successful_files > 0:
+        flash(f'⚠️ {successful_files} de {total_results} arquivo(s) processados com sucesso.', 'warning')
+    else:
+        flash(f'❌ Nenhum arquivo foi processado com sucesso.', 'error')
+
 @app.route('/upload', methods=['POST'])
 def upload():
-    """Upload corrigido com melhor tratamento de arquivos"""
+    """Upload em streaming: grava cada arquivo em blocos, com limites de tamanho,
+    e inicia o processamento assim que cada arquivo termina de chegar"""
     try:
         print("📤 Iniciando upload...")
-        
-        # Pega dados do formulário
-        session_title = request.form.get('session_title', '').strip()
-        session_description = request.form.get('session_description', '').strip()
-        
-        # Corrige a obtenção dos arquivos
-        files = []
-        if 'files[]' in request.files:
-            files = request.files.getlist('files[]')
-        elif 'files' in request.files:
-            files = [request.files['files']]
-        
-        # Filtra arquivos válidos
-        valid_files = []
-        for file in files:
-            if file and file.filename and file.filename.strip():
-                if file.filename.endswith(('.xlsx', '.xls', '.csv')):
-                    valid_files.append(file)
-                else:
-                    flash(f'Arquivo {file.filename} tem formato não suportado.', 'warning')
-        
-        if not valid_files:
+
+        boundary = request.mimetype_params.get('boundary')
+        if request.mimetype != 'multipart/form-data' or not boundary:
             flash('Nenhum arquivo válido foi selecionado.', 'warning')
             return redirect(url_for('upload_page'))
-        
+
+        form, pending = receive_uploads(boundary)
+
+        if not pending:
+            flash('Nenhum arquivo válido foi selecionado.', 'warning')
+            return redirect(url_for('upload_page'))
+
+        # Pega dados do formulário
+        session_title = form.get('session_title', '').strip()
+        session_description = form.get('session_description', '').strip()
+
         # Gera título automático se não fornecido
         if not session_title:
             session_title = f"Relatório {datetime.now().strftime('%d/%m/%Y %H:%M')}"
-        
-        print(f"📁 {len(valid_files)} arquivo(s) válido(s) recebido(s) para sessão: {session_title}")
-        
+
+        print(f"📁 {len(pending)} arquivo(s) válido(s) recebido(s) para sessão: {session_title}")
+
         # Cria nova sessão
         session_id = str(uuid.uuid4())
-        
-        # Processa arquivos
-        results = []
-        successful_files = 0
-        total_value = 0
-        
-        for i, file in enumerate(valid_files):
-            try:
-                print(f"📊 Processando arquivo {i+1}/{len(valid_files)}: {file.filename}")
-                
-                # Gera nome único para o arquivo
-                file_extension = os.path.splitext(file.filename)[1]
-                unique_filename = f"{uuid.uuid4()}{file_extension}"
-                filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
-                
-                # Salva arquivo
-                file.save(filepath)
-                print(f"✅ Arquivo salvo: {filepath}")
-                
-                # Processa arquivo
-                result = process_file(filepath, file.filename)
-                results.append(result)
-                
-                if result.get('success', False):
-                    successful_files += 1
-                    total_value += result.get('total_value', 0)
-                
-                # Salva no banco
-                save_processed_file(session_id, result, unique_filename)
-                
-                # Mantém arquivo salvo para possível reprocessamento
-                print(f"🔄 Arquivo processado: {file.filename}")
-                        
-            except Exception as e:
-                print(f"❌ Erro ao processar {file.filename}: {str(e)}")
-                traceback.print_exc()
-                
-                error_result = {
-                    'filename': file.filename,
-                    'error': f'Erro no processamento: {str(e)}',
-                    'success': False,
-                    'total_value': 0.0,
-                    'month': None,
-                    'year': None,
-                    'emission_date': None,
-                    'due_date': None,
-                    'warnings': [f'Erro no processamento: {str(e)}'],
-                    'data_quality': 'error'
-                }
-                results.append(error_result)
-                save_processed_file(session_id, error_result, '')
-        
+
+        # Coleta resultados (o processamento já foi iniciado durante a transferência)
+        results, successful_files, total_value = collect_upload_results(session_id, pending)
+
         # Salva sessão no banco
         save_session(session_id, session_title, session_description, successful_files, total_value)
-        
-        # Feedback para o usuário
-        if successful_files == len(valid_files):
-            flash(f'✅ Todos os {successful_files} arquivo(s) foram processados com sucesso!', 'success')
-        elif successful_files > 0:
-            flash(f'⚠️ {successful_files} de {len(valid_files)} arquivo(s) processados com sucesso.', 'warning')
-        else:
-            flash(f'❌ Nenhum arquivo foi processado com sucesso.', 'error')
-        
+
+        flash_upload_summary(successful_files, len(results))
+
         return redirect(url_for('dashboard', session_id=session_id))
-        
+
+    except RequestEntityTooLarge:
+        print("⛔ Upload recusado: requisição excede o limite de tamanho")
+        flash(f"O envio excede o limite de {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB por requisição.", 'error')
+        return redirect(url_for('upload_page'))
+
     except Exception as e:
         print(f"💥 Erro crítico no upload: {str(e)}")
         traceback.print_exc()
         flash(f'Erro durante o upload: {str(e)}', 'error')
         return redirect(url_for('upload_page'))
 
+@app.route('/session/<session_id>/add_files', methods=['POST'])
+def add_files(session_id):
+    """Acrescenta arquivos a uma sessão existente
+
+    Só os arquivos novos são processados; os agregados da sessão são somados
+    e as estatísticas por período são atualizadas pelos triggers na inserção.
+    """
+    try:
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("SELECT title FROM sessions WHERE id = ? AND status = 'active'", (session_id,))
+        session_row = cursor.fetchone()
+        conn.close()
+
+        if not session_row:
+            flash('Sessão não encontrada.', 'error')
+            return redirect(url_for('home'))
+
+        boundary = request.mimetype_params.get('boundary')
+        if request.mimetype != 'multipart/form-data' or not boundary:
+            flash('Nenhum arquivo válido foi selecionado.', 'warning')
+            return redirect(url_for('dashboard', session_id=session_id))
+
+        print(f"📤 Adicionando arquivos à sessão: {session_row[0]}")
+        _, pending = receive_uploads(boundary)
+
+        if not pending:
+            flash('Nenhum arquivo válido foi selecionado.', 'warning')
+            return redirect(url_for('dashboard', session_id=session_id))
+
+        results, successful_files, total_value = collect_upload_results(session_id, pending)
+        add_to_session_totals(session_id, successful_files, total_value)
+
+        flash_upload_summary(successful_files, len(results))
+        return redirect(url_for('dashboard', session_id=session_id))
+
+    except RequestEntityTooLarge:
+        print("⛔ Upload recusado: requisição excede o limite de tamanho")
+        flash(f"O envio excede o limite de {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB por requisição.", 'error')
+        return redirect(url_for('dashboard', session_id=session_id))
+
+    except Exception as e:
+        print(f"💥 Erro ao adicionar arquivos: {str(e)}")
+        traceback.print_exc()
+        flash(f'Erro durante o upload: {str(e)}', 'error')
+        return redirect(url_for('dashboard', session_id=session_id))
+
 def save_session(session_id, title, description, file_count, total_value):
     """Salva sessão no banco de dados"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
+        conn = connect_db()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -359,20 +1172,37 @@ def save_session(session_id, title, description, file_count, total_value):
     except Exception as e:
         print(f"Erro ao salvar sessão: {e}")
 
+def add_to_session_totals(session_id, added_files, added_value):
+    """Soma arquivos novos aos agregados da sessão sem recalcular os já existentes"""
+    try:
+        conn = connect_db()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            UPDATE sessions
+            SET file_count = file_count + ?, total_value = total_value + ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (added_files, added_value, session_id))
+        
+        conn.commit()
+        conn.close()
+        print(f"💾 Sessão atualizada: {session_id} (+{added_files} arquivo(s))")
+        
+    except Exception as e:
+        print(f"Erro ao atualizar sessão: {e}")
+
 def save_processed_file(session_id, result, stored_filename=''):
     """Salva arquivo processado no banco de dados"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
+        conn = connect_db()
         cursor = conn.cursor()
         
-        warnings_json = json.dumps(result.get('warnings', []))
-        
         cursor.execute('''
             INSERT INTO processed_files (
                 session_id, filename, original_filename, sheet_name, total_value,
                 emission_date, due_date, month_ref, year_ref, success,
-                error_message, warnings, data_quality
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                error_message, data_quality, file_hash, file_size
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             session_id,
             stored_filename,  # Nome do arquivo salvo no disco
@@ -385,9 +1215,13 @@ def save_processed_file(session_id, result, stored_filename=''):
             result.get('year'),
             result.get('success', False),
             result.get('error', ''),
-            warnings_json,
-            result.get('data_quality', 'unknown')
+            result.get('data_quality', 'unknown'),
+            result.get('file_hash'),
+            result.get('file_size')
         ))
+        file_id = cursor.lastrowid
+        store_file_warnings(cursor, file_id, result.get('warnings') or [])
+        store_file_telemetry(cursor, file_id, result.get('telemetry'))
         
         conn.commit()
         conn.close()
@@ -395,42 +1229,145 @@ def save_processed_file(session_id, result, stored_filename=''):
     except Exception as e:
         print(f"Erro ao salvar arquivo processado: {e}")
 
-def cleanup_session_files(session_id):
-    """Remove arquivos físicos da sessão"""
+# Coleta de lixo dos arquivos em uploads/
+GC_INTERVAL_SECONDS = 60
+GC_BATCH_SIZE = 200
+GC_ORPHAN_SWEEP_INTERVAL_SECONDS = 60 * 60
+GC_ORPHAN_GRACE_SECONDS = 24 * 60 * 60  # não toca em arquivos recentes (uploads em andamento)
+
+file_gc_wakeup = threading.Event()
+file_gc_thread = None
+
+def schedule_session_files_cleanup(cursor, session_id):
+    """Agenda os arquivos físicos da sessão para o coletor de lixo.
+
+    Um mesmo arquivo pode ser referenciado por várias sessões (ex.: sessões
+    duplicadas), por isso nada é removido aqui: o coletor só apaga o arquivo
+    quando nenhuma linha de processed_files o referencia mais.
+    """
+    cursor.execute('''
+        INSERT OR IGNORE INTO file_gc_queue (filename)
+        SELECT DISTINCT filename FROM processed_files
+        WHERE session_id = ? AND filename IS NOT NULL AND filename != ''
+    ''', (session_id,))
+    return cursor.rowcount
+
+def remove_upload_file(filename):
+    """Remove um arquivo de uploads/ ignorando arquivos já inexistentes"""
+    filepath = os.path.join(UPLOAD_FOLDER, filename)
+    shutil.rmtree(filepath + PREVIEW_CACHE_SUFFIX, ignore_errors=True)
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        # Busca todos os arquivos da sessão
-        cursor.execute('SELECT filename FROM processed_files WHERE session_id = ?', (session_id,))
-        files = cursor.fetchall()
-        
-        # Remove arquivos físicos
-        for (filename,) in files:
-            if filename and filename.strip():
-                filepath = os.path.join(UPLOAD_FOLDER, filename)
-                try:
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
-                        print(f"🗑️ Arquivo removido: {filepath}")
-                except Exception as e:
-                    print(f"Erro ao remover arquivo {filepath}: {e}")
-        
-        conn.close()
-        
-    except Exception as e:
-        print(f"Erro na limpeza de arquivos: {e}")
+        os.remove(filepath)
+        print(f"🗑️ Arquivo removido: {filepath}")
+        return True
+    except FileNotFoundError:
+        return False
 
-def load_session_data(session_id):
-    """Carrega dados da sessão do banco de dados"""
+def collect_queued_files(batch_size=GC_BATCH_SIZE):
+    """Remove os arquivos da fila de coleta que não têm mais referências"""
+    removed = 0
+    conn = connect_db()
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
         cursor = conn.cursor()
-        
-        # Carrega dados da sessão
-        cursor.execute('SELECT * FROM sessions WHERE id = ?', (session_id,))
-        session_row = cursor.fetchone()
-        
+        while True:
+            # Trava de escrita: nenhuma nova referência surge entre a contagem e a remoção
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT filename FROM file_gc_queue ORDER BY queued_at LIMIT ?', (batch_size,))
+            batch = [row[0] for row in cursor.fetchall()]
+            if not batch:
+                conn.rollback()
+                break
+
+            placeholders = ','.join('?' * len(batch))
+            cursor.execute(f'''
+                SELECT DISTINCT filename FROM processed_files WHERE filename IN ({placeholders})
+            ''', batch)
+            referenced = {row[0] for row in cursor.fetchall()}
+
+            for filename in batch:
+                if filename not in referenced and remove_upload_file(filename):
+                    removed += 1
+
+            cursor.execute(f'DELETE FROM file_gc_queue WHERE filename IN ({placeholders})', batch)
+            conn.commit()
+    finally:
+        conn.close()
+    return removed
+
+def collect_orphan_files(batch_size=GC_BATCH_SIZE, grace_seconds=GC_ORPHAN_GRACE_SECONDS):
+    """Varre uploads/ em lotes e remove arquivos que nenhuma sessão referencia"""
+    removed = 0
+    cutoff = datetime.now().timestamp() - grace_seconds
+
+    def sweep(batch):
+        conn = connect_db()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            placeholders = ','.join('?' * len(batch))
+            cursor.execute(f'''
+                SELECT DISTINCT filename FROM processed_files WHERE filename IN ({placeholders})
+            ''', batch)
+            referenced = {row[0] for row in cursor.fetchall()}
+            count = sum(1 for filename in batch if filename not in referenced and remove_upload_file(filename))
+            conn.commit()
+            return count
+        finally:
+            conn.close()
+
+    batch = []
+    with os.scandir(UPLOAD_FOLDER) as entries:
+        for entry in entries:
+            if entry.is_dir() and entry.name.endswith(PREVIEW_CACHE_SUFFIX):
+                # Cache de pré-visualização cujo arquivo já foi removido
+                if not os.path.exists(entry.path[:-len(PREVIEW_CACHE_SUFFIX)]):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                continue
+            if not entry.is_file() or entry.stat().st_mtime > cutoff:
+                continue
+            batch.append(entry.name)
+            if len(batch) >= batch_size:
+                removed += sweep(batch)
+                batch = []
+    if batch:
+        removed += sweep(batch)
+
+    return removed
+
+def file_gc_loop():
+    """Laço do coletor: processa a fila quando acordado e varre órfãos periodicamente"""
+    last_sweep = 0.0
+    while True:
+        file_gc_wakeup.wait(GC_INTERVAL_SECONDS)
+        file_gc_wakeup.clear()
+        try:
+            removed = collect_queued_files()
+            if datetime.now().timestamp() - last_sweep >= GC_ORPHAN_SWEEP_INTERVAL_SECONDS:
+                removed += collect_orphan_files()
+                last_sweep = datetime.now().timestamp()
+            if removed:
+                print(f"🧹 Coletor de arquivos removeu {removed} arquivo(s)")
+        except Exception as e:
+            print(f"Erro no coletor de arquivos: {e}")
+            traceback.print_exc()
+
+def start_file_gc():
+    """Inicia o coletor de arquivos em segundo plano (uma vez por processo)"""
+    global file_gc_thread
+    if file_gc_thread is None or not file_gc_thread.is_alive():
+        file_gc_thread = threading.Thread(target=file_gc_loop, name='file-gc', daemon=True)
+        file_gc_thread.start()
+
+def load_session_data(session_id):
+    """Carrega dados da sessão do banco de dados"""
+    try:
+        conn = connect_db()
+        cursor = conn.cursor()
+        
+        # Carrega dados da sessão
+        cursor.execute('SELECT * FROM sessions WHERE id = ?', (session_id,))
+        session_row = cursor.fetchone()
+        
         if not session_row:
             return None, []
         
@@ -445,11 +1382,13 @@ def load_session_data(session_id):
         # Carrega arquivos processados
         cursor.execute('SELECT * FROM processed_files WHERE session_id = ? ORDER BY processed_at', (session_id,))
         files_rows = cursor.fetchall()
+        warnings_by_file = load_file_warnings(cursor, session_id)
         
         results = []
         for row in files_rows:
-            warnings = json.loads(row[12]) if row[12] else []
+            warnings = warnings_by_file.get(row[0], [])
             result = {
+                'id': row[0],
                 'filename': row[3],  # original_filename
                 'stored_filename': row[2],  # filename no disco
                 'sheet_name': row[4],
@@ -556,65 +1495,124 @@ def calculate_metrics(results, year_filter=None, month_filter=None):
             'quality_stats': {'good': 0, 'warning': 0, 'poor': 0, 'error': 0}
         }
 
-def get_chart_data(results, year_filter=None, month_filter=None):
-    """Gera dados do gráfico com filtros"""
+# Séries do gráfico por granularidade: (índice contínuo do período, média móvel em períodos)
+CHART_GRANULARITIES = {
+    'month': ('year_ref * 12 + month_ref - 1', 3),
+    'quarter': ('year_ref * 4 + (month_ref - 1) / 3', 4),
+    'year': ('year_ref', 3)
+}
+
+def format_chart_label(granularity, year, period_index):
+    """Rótulo do ponto: mm/aaaa, 1º tri/aaaa ou aaaa"""
+    if granularity == 'month':
+        return format_date_period_br(period_index % 12 + 1, year)
+    if granularity == 'quarter':
+        return f"{period_index % 4 + 1}º tri/{year}"
+    return str(year)
+
+def get_chart_data(session_id, year_filter=None, month_filter=None, granularity='month'):
+    """Série do gráfico agregada por mês, trimestre ou ano
+
+    Lê os totais mensais pré-computados de session_period_totals (um ponto por
+    período, mesmo com vários arquivos no mesmo mês). A média móvel (janela de
+    CHART_GRANULARITIES, em períodos do calendário) e o acumulado são
+    calculados sobre todo o histórico da sessão antes do filtro de ano; o
+    filtro de mês, em trimestre/ano, limita os meses somados em cada período.
+    """
     try:
-        # Filtra resultados válidos
-        successful_results = []
-        for r in results:
-            if not r.get('success', False) or not r.get('total_value', 0) > 0:
-                continue
-            
-            if year_filter and r.get('year') != int(year_filter):
-                continue
-                
-            if month_filter and r.get('month') != int(month_filter):
-                continue
-                
-            successful_results.append(r)
-        
-        # Dados para gráfico ordenados por data
-        chart_data = []
-        for r in successful_results:
-            month = r.get('month')
-            year = r.get('year')
-            total = r.get('total_value', 0)
-            
-            if month and year and total > 0:
-                chart_data.append({
-                    'Label': format_date_period_br(month, year),
-                    'Total': total,
-                    'sort_key': f"{year:04d}{month:02d}"
-                })
-        
-        # Ordena por data
-        chart_data.sort(key=lambda x: x['sort_key'])
-        return chart_data
-        
+        period_expression, window = CHART_GRANULARITIES[granularity]
+        where_filters, where_params = [], []
+        outer_filters, outer_params = [], []
+        if year_filter:
+            outer_filters.append('year_ref = ?')
+            outer_params.append(int(year_filter))
+        if month_filter:
+            if granularity == 'month':
+                outer_filters.append('month_ref = ?')
+                outer_params.append(int(month_filter))
+            else:
+                # Trimestre/ano: o filtro de mês restringe os meses somados em cada período
+                where_filters.append('month_ref = ?')
+                where_params.append(int(month_filter))
+
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT year_ref, period, file_count, total, rolling_average, cumulative FROM (
+                SELECT year_ref, month_ref, {period_expression} AS period,
+                       SUM(file_count) AS file_count,
+                       SUM(total) AS total,
+                       AVG(SUM(total)) OVER (ORDER BY {period_expression}
+                                             RANGE BETWEEN {window - 1} PRECEDING AND CURRENT ROW) AS rolling_average,
+                       SUM(SUM(total)) OVER (ORDER BY {period_expression}
+                                             ROWS UNBOUNDED PRECEDING) AS cumulative
+                FROM session_period_totals
+                WHERE session_id = ? AND file_count > 0 {''.join(' AND ' + c for c in where_filters)}
+                GROUP BY {period_expression}
+            )
+            {'WHERE ' + ' AND '.join(outer_filters) if outer_filters else ''}
+            ORDER BY period
+        ''', [session_id] + where_params + outer_params)
+        rows = cursor.fetchall()
+        conn.close()
+
+        return [
+            {
+                'Label': format_chart_label(granularity, year, period),
+                'Year': year,
+                'Total': total,
+                'Files': file_count,
+                'RollingAverage': rolling_average,
+                'Cumulative': cumulative
+            }
+            for year, period, file_count, total, rolling_average, cumulative in rows
+        ]
+
     except Exception as e:
         print(f"Erro na geração de dados do gráfico: {e}")
         return []
 
+# Requests simultâneos do mesmo dashboard (mesma sessão e filtros) compartilham
+# uma única leitura do banco e um único cálculo das métricas
+dashboard_flight = SingleFlight()
+
+def build_dashboard_view(session_id, year_filter=None, month_filter=None, granularity='month'):
+    """Carrega a sessão e calcula métricas e gráfico; (None, [], None, None) se não existir"""
+    session_data, results = load_session_data(session_id)
+    if not session_data:
+        return None, [], None, None
+    metrics = calculate_metrics(results, year_filter, month_filter)
+    chart_data = get_chart_data(session_id, year_filter, month_filter, granularity)
+    return session_data, results, metrics, chart_data
+
+def load_dashboard_view(session_id, year_filter=None, month_filter=None, granularity='month'):
+    """build_dashboard_view coalescido por (sessão, filtros); o resultado é compartilhado e não deve ser alterado"""
+    year_filter = year_filter or None
+    month_filter = month_filter or None
+    return dashboard_flight.do((session_id, year_filter, month_filter, granularity),
+                               build_dashboard_view, session_id, year_filter, month_filter, granularity)
+
 @app.route('/dashboard/<session_id>')
 def dashboard(session_id):
     try:
-        # Carrega dados da sessão
-        session_data, results = load_session_data(session_id)
+        granularity = request.args.get('granularity', 'month')
+        if granularity not in CHART_GRANULARITIES:
+            granularity = 'month'
+        
+        # Carrega dados da sessão e calcula métricas sem filtros (dados iniciais)
+        session_data, results, metrics, chart_data = load_dashboard_view(session_id, granularity=granularity)
         
         if not session_data:
             flash('Sessão não encontrada.', 'error')
             return redirect(url_for('home'))
         
-        # Calcula métricas sem filtros (dados iniciais)
-        metrics = calculate_metrics(results)
-        chart_data = get_chart_data(results)
-        
         return render_template('dashboard.html', 
                              session_id=session_id,
                              session_data=session_data,
                              results=results,
                              metrics=metrics,
-                             chart_data=chart_data)
+                             chart_data=chart_data,
+                             granularity=granularity)
                              
     except Exception as e:
         print(f"Erro no dashboard: {str(e)}")
@@ -628,19 +1626,19 @@ def api_dashboard_data(session_id):
     try:
         year_filter = request.args.get('year')
         month_filter = request.args.get('month')
+        granularity = request.args.get('granularity', 'month')
         
-        print(f"🔍 Filtros recebidos - Ano: {year_filter}, Mês: {month_filter}")
+        print(f"🔍 Filtros recebidos - Ano: {year_filter}, Mês: {month_filter}, Agrupamento: {granularity}")
         
-        # Carrega dados da sessão
-        session_data, results = load_session_data(session_id)
+        if granularity not in CHART_GRANULARITIES:
+            return jsonify({'error': f"Agrupamento inválido: use {', '.join(CHART_GRANULARITIES)}"}), 400
+        
+        # Carrega dados da sessão e calcula métricas com filtros
+        session_data, results, metrics, chart_data = load_dashboard_view(session_id, year_filter, month_filter, granularity)
         
         if not session_data:
             return jsonify({'error': 'Sessão não encontrada'}), 404
         
-        # Calcula métricas com filtros
-        metrics = calculate_metrics(results, year_filter, month_filter)
-        chart_data = get_chart_data(results, year_filter, month_filter)
-        
         print(f"📊 Dados filtrados - Total: {metrics['formatted_total']}, Arquivos: {metrics['file_count']}")
         
         return jsonify({
@@ -654,49 +1652,85 @@ def api_dashboard_data(session_id):
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+def load_common_issues(session_id, limit=10):
+    """Avisos e erros mais frequentes da sessão: [(mensagem, ocorrências)]"""
+    conn = connect_db()
+    cursor = conn.cursor()
+    # Avisos contados por código (índice de file_warnings) e erros por mensagem
+    cursor.execute('''
+        SELECT message, SUM(occurrences) AS total
+        FROM (
+            SELECT wc.message AS message, counted.occurrences AS occurrences
+            FROM (
+                SELECT fw.code, COUNT(*) AS occurrences
+                FROM processed_files pf
+                JOIN file_warnings fw ON fw.file_id = pf.id
+                WHERE pf.session_id = ?
+                GROUP BY fw.code
+            ) counted
+            JOIN warning_codes wc ON wc.code = counted.code
+            UNION ALL
+            SELECT error_message, COUNT(*)
+            FROM processed_files
+            WHERE session_id = ? AND error_message != ''
+            GROUP BY error_message
+        )
+        GROUP BY message
+        ORDER BY total DESC, message
+        LIMIT ?
+    ''', (session_id, session_id, limit))
+    common_issues = cursor.fetchall()
+    conn.close()
+    return common_issues
+
 @app.route('/api/quality_report/<session_id>')
 def api_quality_report(session_id):
     """API para relatório de qualidade"""
+    import numpy as np
+    from value_statistics import analyze_values
     try:
         session_data, results = load_session_data(session_id)
         
         if not session_data:
             return jsonify({'error': 'Sessão não encontrada'}), 404
         
-        # Análise de qualidade
+        # Análise de qualidade em uma única passada pelos resultados
         total_files = len(results)
-        successful_files = len([r for r in results if r.get('success', False)])
-        files_with_warnings = len([r for r in results if r.get('warnings') and len(r.get('warnings', [])) > 0])
-        
-        # Estatísticas dos valores
-        successful_results = [r for r in results if r.get('success', False) and r.get('total_value', 0) > 0]
-        values = [r.get('total_value', 0) for r in successful_results]
-        
-        value_statistics = {}
-        if values:
-            values_sorted = sorted(values)
-            value_statistics = {
-                'count': len(values),
-                'total': sum(values),
-                'average': sum(values) / len(values),
-                'median': values_sorted[len(values_sorted) // 2] if values_sorted else 0,
-                'max': max(values),
-                'min': min(values)
-            }
+        successful_files = 0
+        files_with_warnings = 0
+        warned_files = []
+        failed_files = []
+        years = []
+        values = []
+        value_months = []
+        value_files = []
         
-        # Problemas mais comuns
-        all_warnings = []
         for r in results:
-            if r.get('warnings'):
-                all_warnings.extend(r.get('warnings', []))
-        
-        if r.get('error'):
-            all_warnings.append(r.get('error'))
+            warnings = r.get('warnings') or []
+            if warnings:
+                files_with_warnings += 1
+                warned_files.append(r.get('filename'))
+            
+            if r.get('year'):
+                years.append(r.get('year'))
+            
+            if r.get('success', False):
+                successful_files += 1
+                if (r.get('total_value') or 0) > 0:
+                    values.append(r.get('total_value'))
+                    value_months.append(r.get('month'))
+                    value_files.append(r.get('filename'))
+            else:
+                failed_files.append(r.get('filename'))
+        
+        # Estatísticas dos valores (vetorizadas)
+        analysis = analyze_values(values, value_months)
+        value_statistics = analysis['statistics'] if analysis else {}
         
-        common_issues = Counter(all_warnings).most_common(10)
+        # Problemas mais comuns
+        common_issues = load_common_issues(session_id)
         
         # Distribuição por anos
-        years = [r.get('year') for r in results if r.get('year')]
         years_distribution = Counter(years).most_common()
         
         # Recomendações
@@ -707,7 +1741,7 @@ def api_quality_report(session_id):
                 'type': 'warning',
                 'title': 'Muitos Arquivos com Alertas',
                 'description': f'{files_with_warnings} de {total_files} arquivos têm alertas. Verifique a nomeação e estrutura dos arquivos.',
-                'files': [r.get('filename') for r in results if r.get('warnings')][:5]
+                'files': warned_files[:5]
             })
         
         if successful_files < total_files * 0.8:
@@ -715,18 +1749,28 @@ def api_quality_report(session_id):
                 'type': 'error',
                 'title': 'Taxa de Sucesso Baixa',
                 'description': f'Apenas {successful_files} de {total_files} arquivos foram processados com sucesso.',
-                'files': [r.get('filename') for r in results if not r.get('success', False)][:5]
+                'files': failed_files[:5]
             })
         
-        if value_statistics and value_statistics.get('count', 0) > 0:
-            avg_value = value_statistics['average']
-            outliers = [r for r in successful_results if abs(r.get('total_value', 0) - avg_value) > avg_value * 2]
-            if outliers:
+        if analysis:
+            outlier_idx = np.flatnonzero(analysis['outliers'] | analysis['iqr_outliers'])
+            if outlier_idx.size:
+                # Mais distantes da mediana primeiro
+                outlier_idx = outlier_idx[np.argsort(-np.abs(analysis['robust_z'][outlier_idx]))]
                 recommendations.append({
                     'type': 'info',
                     'title': 'Valores Atípicos Detectados',
-                    'description': f'{len(outliers)} arquivo(s) com valores muito diferentes da média.',
-                    'files': [r.get('filename') for r in outliers][:3]
+                    'description': f'{outlier_idx.size} arquivo(s) com valores muito diferentes da mediana da sessão.',
+                    'files': [value_files[i] for i in outlier_idx[:3]]
+                })
+            
+            seasonal_idx = np.flatnonzero(analysis['seasonal_outliers'] & ~analysis['outliers'])
+            if seasonal_idx.size:
+                recommendations.append({
+                    'type': 'info',
+                    'title': 'Valores Fora do Padrão do Mês',
+                    'description': f'{seasonal_idx.size} arquivo(s) com valores muito diferentes de outros arquivos do mesmo mês.',
+                    'files': [value_files[i] for i in seasonal_idx[:3]]
                 })
         
         return jsonify({
@@ -749,6 +1793,468 @@ def api_quality_report(session_id):
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+# Relatório de arquivos lentos
+SLOW_FILES_DEFAULT_LIMIT = 20
+SLOW_FILES_MAX_LIMIT = 200
+
+@app.route('/api/slow_files')
+def api_slow_files():
+    """Arquivos mais lentos de processar, com engine, dimensões, tempo por etapa e memória
+
+    Inclui os que falharam (erro, tempo limite, memória), com a última etapa
+    alcançada e o tipo da falha. ?limit=N (padrão 20) e ?session_id= para limitar a uma sessão. Inclui também
+    o tempo médio e máximo de cada etapa e de cada engine no mesmo recorte.
+    """
+    try:
+        limit = min(max(request.args.get('limit', SLOW_FILES_DEFAULT_LIMIT, type=int), 1), SLOW_FILES_MAX_LIMIT)
+        session_id = request.args.get('session_id')
+        session_filter = 'AND pf.session_id = ?' if session_id else ''
+        params = [session_id] if session_id else []
+
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT pf.id, pf.session_id, pf.original_filename, pf.sheet_name, pf.file_size, pf.data_quality,
+                   pf.processed_at, ft.engine, ft.sheet_rows, ft.sheet_cols, ft.total_ms, ft.peak_rss_kb, ft.rss_growth_kb,
+                   ft.last_stage, ft.failure
+            FROM file_telemetry ft
+            JOIN processed_files pf ON pf.id = ft.file_id
+            WHERE 1 = 1 {session_filter}
+            ORDER BY ft.total_ms DESC
+            LIMIT ?
+        ''', params + [limit])
+        rows = cursor.fetchall()
+
+        stages_by_file = {}
+        if rows:
+            placeholders = ','.join('?' * len(rows))
+            cursor.execute(f'''
+                SELECT file_id, stage, duration_ms FROM file_stage_timings WHERE file_id IN ({placeholders})
+            ''', [row[0] for row in rows])
+            for file_id, stage, duration_ms in cursor.fetchall():
+                stages_by_file.setdefault(file_id, {})[stage] = round(duration_ms, 2)
+
+        cursor.execute(f'''
+            SELECT st.stage, COUNT(*), AVG(st.duration_ms), MAX(st.duration_ms)
+            FROM file_stage_timings st
+            JOIN processed_files pf ON pf.id = st.file_id
+            WHERE 1 = 1 {session_filter}
+            GROUP BY st.stage
+            ORDER BY AVG(st.duration_ms) DESC
+        ''', params)
+        stage_summary = [
+            {'stage': row[0], 'files': row[1], 'avg_ms': round(row[2], 2), 'max_ms': round(row[3], 2)}
+            for row in cursor.fetchall()
+        ]
+
+        cursor.execute(f'''
+            SELECT ft.engine, COUNT(*), AVG(ft.total_ms), MAX(ft.total_ms)
+            FROM file_telemetry ft
+            JOIN processed_files pf ON pf.id = ft.file_id
+            WHERE 1 = 1 {session_filter}
+            GROUP BY ft.engine
+            ORDER BY AVG(ft.total_ms) DESC
+        ''', params)
+        engine_summary = [
+            {'engine': row[0], 'files': row[1], 'avg_ms': round(row[2], 2), 'max_ms': round(row[3], 2)}
+            for row in cursor.fetchall()
+        ]
+        conn.close()
+
+        slow_files = []
+        for row in rows:
+            file_size = row[4]
+            total_ms = row[10] or 0
+            slow_files.append({
+                'file_id': row[0],
+                'session_id': row[1],
+                'filename': row[2],
+                'sheet_name': row[3],
+                'file_size': file_size,
+                'data_quality': row[5],
+                'processed_at': row[6],
+                'engine': row[7],
+                'sheet_rows': row[8],
+                'sheet_cols': row[9],
+                'total_ms': round(total_ms, 2),
+                'ms_per_mb': round(total_ms / (file_size / (1024 * 1024)), 2) if file_size else None,
+                'peak_rss_kb': row[11],
+                'rss_growth_kb': row[12],
+                'last_stage': row[13],
+                'failure': row[14],
+                'stages': stages_by_file.get(row[0], {})
+            })
+
+        return jsonify({
+            'slow_files': slow_files,
+            'stages': stage_summary,
+            'engines': engine_summary
+        })
+
+    except Exception as e:
+        print(f"Erro no relatório de arquivos lentos: {e}")
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+# API JSON versionada
+API_VERSION = 1
+# Campo da API -> coluna de processed_files
+API_FILE_FIELDS = {
+    'id': 'id',
+    'filename': 'original_filename',
+    'sheet_name': 'sheet_name',
+    'total_value': 'total_value',
+    'emission_date': 'emission_date',
+    'due_date': 'due_date',
+    'month': 'month_ref',
+    'year': 'year_ref',
+    'success': 'success',
+    'error': 'error_message',
+    'warnings': 'warnings',
+    'data_quality': 'data_quality'
+}
+API_MIN_COMPRESS_SIZE = 1024
+
+def parse_api_fields(raw_fields):
+    """Lista de campos pedida em ?fields=a,b (padrão: todos); None se houver campo desconhecido"""
+    if not raw_fields:
+        return list(API_FILE_FIELDS)
+    fields = []
+    for field in raw_fields.split(','):
+        field = field.strip()
+        if field not in API_FILE_FIELDS:
+            return None
+        if field not in fields:
+            fields.append(field)
+    return fields
+
+def compressed_json_response(payload):
+    """Serializa de forma compacta e comprime conforme o Accept-Encoding (br > gzip)"""
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    response = app.response_class(body, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if len(body) < API_MIN_COMPRESS_SIZE:
+        return response
+
+    encodings = request.accept_encodings
+    if brotli is not None and encodings['br']:
+        response.set_data(brotli.compress(body, quality=5))
+        response.content_encoding = 'br'
+    elif encodings['gzip']:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.content_encoding = 'gzip'
+    return response
+
+@app.route('/api/v1/sessions/<session_id>/files')
+def api_v1_session_files(session_id):
+    """Arquivos da sessão em formato colunar (um array por campo)
+
+    ?fields=id,total_value,... limita os campos retornados. As linhas de
+    processed_files não mudam depois de gravadas, então o ETag sai da sessão
+    (updated_at) e da contagem/maior id dos arquivos: um If-None-Match que
+    confere responde 304 sem carregar as linhas.
+    """
+    try:
+        fields = parse_api_fields(request.args.get('fields'))
+        if fields is None:
+            return jsonify({'error': f"Campo inválido. Disponíveis: {', '.join(API_FILE_FIELDS)}"}), 400
+
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT s.title, s.description, s.created_at, s.updated_at,
+                   (SELECT COUNT(*) FROM processed_files WHERE session_id = s.id),
+                   (SELECT MAX(id) FROM processed_files WHERE session_id = s.id)
+            FROM sessions s
+            WHERE s.id = ?
+        ''', (session_id,))
+        session_row = cursor.fetchone()
+        if not session_row:
+            conn.close()
+            return jsonify({'error': 'Sessão não encontrada'}), 404
+
+        validator = json.dumps([API_VERSION, session_id, list(session_row), fields])
+        etag = hashlib.sha1(validator.encode('utf-8')).hexdigest()
+        if request.if_none_match.contains_weak(etag):
+            conn.close()
+            response = app.response_class(status=304)
+            response.set_etag(etag, weak=True)
+            response.vary.add('Accept-Encoding')
+            return response
+
+        # O id vem sempre primeiro (chave dos avisos); warnings sai de file_warnings
+        columns = ', '.join(['id'] + [API_FILE_FIELDS[field] for field in fields if field != 'warnings'])
+        cursor.execute(f'''
+            SELECT {columns} FROM processed_files
+            WHERE session_id = ?
+            ORDER BY
+                CASE WHEN year_ref IS NULL THEN 1 ELSE 0 END,
+                year_ref ASC,
+                CASE WHEN month_ref IS NULL THEN 1 ELSE 0 END,
+                month_ref ASC,
+                processed_at ASC
+        ''', (session_id,))
+        rows = cursor.fetchall()
+        warnings_by_file = load_file_warnings(cursor, session_id) if 'warnings' in fields else {}
+        conn.close()
+
+        stored_fields = ['id'] + [field for field in fields if field != 'warnings']
+        values = dict(zip(stored_fields, zip(*rows))) if rows else {field: () for field in stored_fields}
+        data = {}
+        for field in fields:
+            if field == 'warnings':
+                column = [warnings_by_file.get(file_id, []) for file_id in values['id']]
+            elif field == 'success':
+                column = [bool(v) for v in values[field]]
+            else:
+                column = values[field]
+            data[field] = list(column)
+
+        response = compressed_json_response({
+            'version': API_VERSION,
+            'session': {
+                'id': session_id,
+                'title': session_row[0],
+                'description': session_row[1],
+                'created_at': session_row[2],
+                'updated_at': session_row[3]
+            },
+            'count': len(rows),
+            'fields': fields,
+            'columns': data
+        })
+        response.set_etag(etag, weak=True)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+    except Exception as e:
+        print(f"Erro na API de arquivos da sessão: {e}")
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+# Limites da janela de pré-visualização
+PREVIEW_DEFAULT_ROWS = 50
+PREVIEW_MAX_ROWS = 500
+PREVIEW_DEFAULT_COLS = 20
+PREVIEW_MAX_COLS = 100
+
+def column_letter(col_idx):
+    """Converte índice de coluna (1-based) para letra do Excel: 1 -> A, 28 -> AB"""
+    letters = ''
+    while col_idx > 0:
+        col_idx, remainder = divmod(col_idx - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def preview_cell_value(value):
+    """Converte valor de célula para formato serializável em JSON"""
+    if value is None:
+        return None
+    if hasattr(value, 'strftime'):
+        return value.strftime('%d/%m/%Y')
+    if isinstance(value, float) and value != value:  # NaN
+        return None
+    if isinstance(value, (int, float, str, bool)):
+        return value
+    return str(value)
+
+# Cache da pré-visualização: cada aba é lida uma única vez e gravada ao lado do
+# upload em blocos de linhas (JSON); cada janela pedida depois lê só os blocos
+# que a cobrem. Os uploads nunca mudam (nome único), então o cache não expira;
+# ele é removido junto com o arquivo.
+PREVIEW_CACHE_SUFFIX = '.preview'
+PREVIEW_CACHE_BLOCK_ROWS = 1000
+
+preview_cache_flight = SingleFlight()
+
+def preview_cache_dir(filepath, sheet_name):
+    """Pasta do cache de uma aba: uploads/<arquivo>.preview/<hash da aba>"""
+    sheet_key = hashlib.sha1((sheet_name or '').encode('utf-8')).hexdigest()[:16]
+    return os.path.join(filepath + PREVIEW_CACHE_SUFFIX, sheet_key)
+
+def iter_sheet_rows(filepath, sheet_name):
+    """Todas as linhas da aba, em ordem (linha 1 do CSV é o cabeçalho)"""
+    import numpy as np
+    import pandas as pd
+    if filepath.endswith(('.csv', '.xls')):
+        if filepath.endswith('.csv'):
+            df = pd.read_csv(filepath, encoding=detect_csv_encoding(filepath), header=None)
+        else:
+            df = pd.read_excel(filepath, sheet_name=sheet_name or 0, header=None)
+        for values in df.itertuples(index=False):
+            yield [value.item() if isinstance(value, np.generic) else value for value in values]
+        return
+
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        if sheet_name and sheet_name in workbook.sheetnames:
+            worksheet = workbook[sheet_name]
+        else:
+            worksheet = workbook.worksheets[0]
+        for values in worksheet.iter_rows(values_only=True):
+            yield list(values)
+    finally:
+        workbook.close()
+
+def build_preview_cache(filepath, sheet_name, cache_dir):
+    """Lê a aba inteira uma vez e grava os blocos e o meta.json do cache"""
+    staging_dir = f"{cache_dir}.{uuid.uuid4().hex[:8]}.tmp"
+    os.makedirs(staging_dir)
+    try:
+        block, block_index, row_count, col_count = [], 0, 0, 0
+
+        def flush():
+            with open(os.path.join(staging_dir, f'{block_index:06d}.json'), 'w', encoding='utf-8') as f:
+                json.dump(block, f, ensure_ascii=False)
+
+        for values in iter_sheet_rows(filepath, sheet_name):
+            block.append([preview_cell_value(value) for value in values])
+            row_count += 1
+            col_count = max(col_count, len(values))
+            if len(block) == PREVIEW_CACHE_BLOCK_ROWS:
+                flush()
+                block, block_index = [], block_index + 1
+        if block:
+            flush()
+
+        with open(os.path.join(staging_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'rows': row_count, 'cols': col_count, 'block_rows': PREVIEW_CACHE_BLOCK_ROWS}, f)
+        try:
+            # Troca atômica; se outro processo terminou antes, vale o dele
+            os.replace(staging_dir, cache_dir)
+        except OSError:
+            pass
+    finally:
+        if os.path.isdir(staging_dir):
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+def load_preview_cache_meta(filepath, sheet_name):
+    """meta.json do cache da aba, construindo o cache na primeira consulta"""
+    cache_dir = preview_cache_dir(filepath, sheet_name)
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    if not os.path.isfile(meta_path):
+        os.makedirs(os.path.dirname(cache_dir), exist_ok=True)
+        preview_cache_flight.do(cache_dir, build_preview_cache, filepath, sheet_name, cache_dir)
+    with open(meta_path, encoding='utf-8') as f:
+        return cache_dir, json.load(f)
+
+def read_sheet_window(filepath, sheet_name, min_row, max_row, min_col, max_col):
+    """Lê apenas a janela de células pedida da planilha (linhas/colunas 1-based, inclusivas).
+
+    A primeira leitura de uma aba percorre o arquivo uma vez e grava o cache
+    em blocos; as seguintes só abrem os blocos da janela, então o custo não
+    depende da posição da janela na planilha.
+    Retorna (linhas, total_de_linhas, total_de_colunas).
+    """
+    cache_dir, meta = load_preview_cache_meta(filepath, sheet_name)
+    block_rows = meta['block_rows']
+    last_row = min(max_row, meta['rows'])
+    width = max_col - min_col + 1
+
+    rows = []
+    # Janela além do fim da aba: last_row < min_row e nenhum bloco é lido
+    for block_index in range((min_row - 1) // block_rows, (last_row - 1) // block_rows + 1):
+        with open(os.path.join(cache_dir, f'{block_index:06d}.json'), encoding='utf-8') as f:
+            block = json.load(f)
+        first_row = block_index * block_rows + 1
+        for values in block[max(min_row - first_row, 0):last_row - first_row + 1]:
+            window = values[min_col - 1:max_col]
+            rows.append(window + [None] * (width - len(window)))
+    return rows, meta['rows'], meta['cols']
+
+@app.route('/api/file/<int:file_id>/preview')
+def api_file_preview(file_id):
+    """API de pré-visualização: retorna uma janela de linhas/colunas do arquivo original
+    destacando a célula do total e as datas detectadas"""
+    try:
+        row_start = max(request.args.get('row_start', 1, type=int) or 1, 1)
+        row_count = min(max(request.args.get('rows', PREVIEW_DEFAULT_ROWS, type=int) or 1, 1), PREVIEW_MAX_ROWS)
+        col_start = max(request.args.get('col_start', 1, type=int) or 1, 1)
+        col_count = min(max(request.args.get('cols', PREVIEW_DEFAULT_COLS, type=int) or 1, 1), PREVIEW_MAX_COLS)
+
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT filename, original_filename, sheet_name, total_value, emission_date, due_date
+            FROM processed_files WHERE id = ?
+        ''', (file_id,))
+        row = cursor.fetchone()
+        conn.close()
+
+        if not row:
+            return jsonify({'error': 'Arquivo não encontrado'}), 404
+
+        stored_filename, original_filename, sheet_name, total_value, emission_date, due_date = row
+        filepath = os.path.join(UPLOAD_FOLDER, stored_filename or '')
+        if not stored_filename or not os.path.isfile(filepath):
+            return jsonify({'error': 'Arquivo original não está mais disponível'}), 404
+
+        row_end = row_start + row_count - 1
+        col_end = col_start + col_count - 1
+        rows, total_rows, total_cols = read_sheet_window(
+            filepath, sheet_name, row_start, row_end, col_start, col_end
+        )
+
+        # Datas detectadas normalizadas para dd/mm/aaaa
+        date_labels = {}
+        if emission_date:
+            date_labels[format_date_br(emission_date)] = 'emission_date'
+        if due_date and format_date_br(due_date) not in date_labels:
+            date_labels[format_date_br(due_date)] = 'due_date'
+
+        cells = []
+        highlights = []
+        total_rows_found = []
+        for row_offset, values in enumerate(rows):
+            row_number = row_start + row_offset
+            row_cells = []
+            for col_offset, value in enumerate(values):
+                value = preview_cell_value(value)
+                row_cells.append(value)
+                if value is None:
+                    continue
+
+                coordinate = f"{column_letter(col_start + col_offset)}{row_number}"
+                # Comparação exata: células vizinhas com valor quase igual não são o total extraído
+                if (total_value and isinstance(value, (int, float)) and not isinstance(value, bool)
+                        and float(value) == total_value):
+                    highlights.append({'cell': coordinate, 'row': row_number, 'type': 'total_value'})
+                    total_rows_found.append(row_number)
+                elif isinstance(value, str) and value.strip() in date_labels:
+                    highlights.append({'cell': coordinate, 'row': row_number, 'type': date_labels[value.strip()]})
+            cells.append(row_cells)
+
+        return jsonify({
+            'success': True,
+            'file_id': file_id,
+            'filename': original_filename,
+            'sheet_name': sheet_name,
+            'window': {
+                'row_start': row_start,
+                'row_end': row_start + len(rows) - 1,
+                'col_start': col_start,
+                'col_end': col_end,
+                'columns': [column_letter(c) for c in range(col_start, col_end + 1)]
+            },
+            'sheet_dimensions': {'rows': total_rows, 'cols': total_cols},
+            'rows': cells,
+            'highlights': highlights,
+            'total_rows': sorted(set(total_rows_found)),
+            'detected': {
+                'total_value': total_value,
+                'emission_date': format_date_br(emission_date) if emission_date else None,
+                'due_date': format_date_br(due_date) if due_date else None
+            }
+        })
+
+    except Exception as e:
+        print(f"Erro na pré-visualização do arquivo {file_id}: {e}")
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/edit_session/<session_id>', methods=['GET', 'POST'])
 def edit_session(session_id):
     """Edita informações da sessão"""
@@ -761,7 +2267,7 @@ def edit_session(session_id):
                 flash('Título é obrigatório.', 'error')
                 return redirect(url_for('edit_session', session_id=session_id))
             
-            conn = sqlite3.connect(DATABASE_PATH)
+            conn = connect_db()
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -790,14 +2296,14 @@ def edit_session(session_id):
 
 @app.route('/delete_session/<session_id>', methods=['POST'])
 def delete_session(session_id):
-    """Deleta uma sessão E remove os arquivos físicos"""
+    """Deleta uma sessão; os arquivos físicos são removidos em segundo plano"""
     try:
-        # Remove arquivos físicos primeiro
-        cleanup_session_files(session_id)
-        
-        conn = sqlite3.connect(DATABASE_PATH)
+        conn = connect_db()
         cursor = conn.cursor()
         
+        # Agenda arquivos físicos para o coletor (só remove os sem outras referências)
+        schedule_session_files_cleanup(cursor, session_id)
+        
         # Remove registros dos arquivos processados
         cursor.execute('DELETE FROM processed_files WHERE session_id = ?', (session_id,))
         
@@ -807,6 +2313,8 @@ def delete_session(session_id):
         conn.commit()
         conn.close()
         
+        file_gc_wakeup.set()
+        
         flash('Sessão e arquivos deletados com sucesso.', 'success')
         return redirect(url_for('home'))
         
@@ -817,28 +2325,64 @@ def delete_session(session_id):
 
 @app.route('/duplicate_session/<session_id>')
 def duplicate_session(session_id):
-    """Duplica uma sessão existente"""
+    """Duplica uma sessão existente copiando as linhas direto no banco (sem reprocessar nem reformatar)"""
     try:
-        session_data, results = load_session_data(session_id)
+        conn = connect_db()
+        cursor = conn.cursor()
         
-        if not session_data:
+        cursor.execute('SELECT title, description FROM sessions WHERE id = ?', (session_id,))
+        session_row = cursor.fetchone()
+        
+        if not session_row:
+            conn.close()
             flash('Sessão não encontrada.', 'error')
             return redirect(url_for('home'))
         
         # Cria nova sessão
         new_session_id = str(uuid.uuid4())
-        new_title = f"Cópia de {session_data['title']}"
+        new_title = f"Cópia de {session_row[0]}"
         
-        # Salva nova sessão
-        successful_files = len([r for r in results if r.get('success', False)])
-        total_value = sum([r.get('total_value', 0) for r in results if r.get('success', False)])
+        # Todas as colunas de processed_files exceto a chave, a sessão e a origem são copiadas como estão
+        cursor.execute('PRAGMA table_info(processed_files)')
+        copy_columns = ', '.join(row[1] for row in cursor.fetchall()
+                                 if row[1] not in ('id', 'session_id', 'duplicated_from'))
         
-        save_session(new_session_id, new_title, session_data.get('description', ''), successful_files, total_value)
-        
-        # Copia arquivos
-        for result in results:
-            save_processed_file(new_session_id, result, result.get('stored_filename', ''))
+        try:
+            cursor.execute('BEGIN')
+            
+            cursor.execute('''
+                INSERT INTO sessions (id, title, description, file_count, total_value)
+                SELECT ?, ?, ?,
+                       COUNT(CASE WHEN success = 1 THEN 1 END),
+                       COALESCE(SUM(CASE WHEN success = 1 THEN total_value END), 0)
+                FROM processed_files WHERE session_id = ?
+            ''', (new_session_id, new_title, session_row[1] or '', session_id))
+            
+            cursor.execute(f'''
+                INSERT INTO processed_files (session_id, duplicated_from, {copy_columns})
+                SELECT ?, COALESCE(duplicated_from, id), {copy_columns} FROM processed_files
+                WHERE session_id = ? ORDER BY id
+            ''', (new_session_id, session_id))
+            
+            # As cópias recebem ids na mesma ordem dos originais: pareia pela posição
+            cursor.execute('''
+                INSERT INTO file_warnings (file_id, position, code)
+                SELECT copy.id, fw.position, fw.code
+                FROM (SELECT id, ROW_NUMBER() OVER (ORDER BY id) AS rn
+                      FROM processed_files WHERE session_id = ?) original
+                JOIN (SELECT id, ROW_NUMBER() OVER (ORDER BY id) AS rn
+                      FROM processed_files WHERE session_id = ?) copy ON copy.rn = original.rn
+                JOIN file_warnings fw ON fw.file_id = original.id
+            ''', (session_id, new_session_id))
+            
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
         
+        print(f"💾 Sessão duplicada: {session_id} -> {new_session_id}")
         flash(f'Sessão duplicada com sucesso: {new_title}', 'success')
         return redirect(url_for('dashboard', session_id=new_session_id))
         
@@ -847,6 +2391,64 @@ def duplicate_session(session_id):
         flash('Erro ao duplicar sessão.', 'error')
         return redirect(url_for('home'))
 
+EXPORT_COLUMNS = ['Arquivo', 'Período', 'Data Emissão', 'Data Vencimento', 'Valor Total', 'Qualidade', 'Avisos']
+
+def export_period_key(period):
+    """Ordem cronológica de 'mm/aaaa' (o texto ordenaria por mês); '-' vai para o fim"""
+    month, _, year = period.partition('/')
+    if not (month.isdigit() and year.isdigit()):
+        return (1, 0, 0)
+    return (0, int(year), int(month))
+
+def build_export_dataframe(results):
+    """Monta o DataFrame de exportação (uma linha por arquivo processado)
+
+    As colunas são fixas, inclusive para uma sessão sem arquivos.
+    """
+    import pandas as pd
+    rows = []
+    for r in results:
+        rows.append({
+            'Arquivo': r.get('filename'),
+            'Período': f"{r.get('month'):02d}/{r.get('year')}" if r.get('month') and r.get('year') else '-',
+            'Data Emissão': r.get('emission_date') or '-',
+            'Data Vencimento': r.get('due_date') or '-',
+            'Valor Total': r.get('total_value', 0.0),
+            'Qualidade': r.get('data_quality'),
+            'Avisos': '; '.join(r.get('warnings', []) if isinstance(r.get('warnings'), list) else [])
+        })
+    return pd.DataFrame(rows, columns=EXPORT_COLUMNS)
+
+def write_export(results, target, export_format='xlsx'):
+    """Escreve a exportação em CSV ou XLSX num caminho ou buffer binário"""
+    import pandas as pd
+    df = build_export_dataframe(results)
+
+    if export_format == 'csv':
+        # Use utf-8-sig para abrir direto no Excel com acentuação correta
+        csv_bytes = df.to_csv(index=False).encode('utf-8-sig')
+        if hasattr(target, 'write'):
+            target.write(csv_bytes)
+        else:
+            with open(target, 'wb') as f:
+                f.write(csv_bytes)
+        return df
+
+    with pd.ExcelWriter(target, engine='openpyxl') as writer:
+        df.to_excel(writer, sheet_name='Dados', index=False)
+
+        # (Opcional) cria um pequeno resumo por mês/ano
+        try:
+            resumo = (df.assign(Valor=df['Valor Total'].fillna(0.0))
+                        .groupby(['Período'], dropna=False)['Valor'].sum()
+                        .reset_index()
+                        .sort_values(by='Período', key=lambda periods: periods.map(export_period_key)))
+            resumo.to_excel(writer, sheet_name='Resumo', index=False)
+        except Exception:
+            # se algo der errado no resumo, seguimos apenas com a aba Dados
+            pass
+    return df
+
 @app.route('/download')
 def download():
     """Exporta os dados da sessão em CSV ou XLSX."""
@@ -860,32 +2462,11 @@ def download():
             flash('Sessão não encontrada.', 'error')
             return redirect(url_for('home'))
 
-        # Monte o DataFrame com os resultados válidos (ou todos, se preferir)
-        rows = []
-        for r in results:
-            rows.append({
-                'Arquivo': r.get('filename'),
-                'Período': f"{r.get('month'):02d}/{r.get('year')}" if r.get('month') and r.get('year') else '-',
-                'Data Emissão': r.get('emission_date') or '-',
-                'Data Vencimento': r.get('due_date') or '-',
-                'Valor Total': r.get('total_value', 0.0),
-                'Qualidade': r.get('data_quality'),
-                'Avisos': '; '.join(r.get('warnings', []) if isinstance(r.get('warnings'), list) else [])
-            })
-
-        import pandas as pd
-        import io
-        from flask import send_file
-
-        df = pd.DataFrame(rows)
-
         # Nome do arquivo
-        safe_title = re.sub(r'[^a-zA-Z0-9_-]+', '_', session_data.get('title', f'sessao_{session_id}'))
+        safe_title = safe_export_name(session_data.get('title', f'sessao_{session_id}'))
+        buf = io.BytesIO()
         if export_format == 'csv':
-            buf = io.BytesIO()
-            # Use utf-8-sig para abrir direto no Excel com acentuação correta
-            csv_bytes = df.to_csv(index=False, encoding='utf-8-sig').encode('utf-8-sig')
-            buf.write(csv_bytes)
+            write_export(results, buf, 'csv')
             buf.seek(0)
             return send_file(
                 buf,
@@ -895,21 +2476,7 @@ def download():
             )
 
         # Padrão: XLSX
-        buf = io.BytesIO()
-        with pd.ExcelWriter(buf, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Dados', index=False)
-
-            # (Opcional) cria um pequeno resumo por mês/ano
-            try:
-                resumo = (df.assign(Valor=df['Valor Total'].fillna(0.0))
-                            .groupby(['Período'], dropna=False)['Valor'].sum()
-                            .reset_index()
-                            .sort_values(by=['Período']))
-                resumo.to_excel(writer, sheet_name='Resumo', index=False)
-            except Exception:
-                # se algo der errado no resumo, seguimos apenas com a aba Dados
-                pass
-
+        write_export(results, buf, 'xlsx')
         buf.seek(0)
         return send_file(
             buf,
@@ -924,6 +2491,172 @@ def download():
         flash('Falha ao gerar o arquivo de exportação.', 'error')
         return redirect(url_for('dashboard', session_id=session_id))
 
+def safe_export_name(title):
+    """Título da sessão em um nome de arquivo seguro"""
+    return re.sub(r'[^a-zA-Z0-9_-]+', '_', title or 'sessao')
+
+BULK_EXPORT_MAX_SESSIONS = 500
+ZIP_STREAM_CHUNK_SIZE = 256 * 1024
+
+class ZipStreamBuffer:
+    """Destino sem seek para o zipfile: acumula o que foi escrito até ser drenado pelo gerador"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def select_bulk_export_sessions(session_ids, start_date=None, end_date=None):
+    """Sessões ativas a exportar: os ids informados e/ou as criadas entre as datas (inclusivas)"""
+    conditions, params = ["status = 'active'"], []
+    if session_ids:
+        conditions.append(f"id IN ({','.join('?' * len(session_ids))})")
+        params.extend(session_ids)
+    if start_date:
+        conditions.append('date(created_at) >= ?')
+        params.append(start_date)
+    if end_date:
+        conditions.append('date(created_at) <= ?')
+        params.append(end_date)
+
+    conn = connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT id, title FROM sessions
+            WHERE {' AND '.join(conditions)}
+            ORDER BY created_at, id
+            LIMIT ?
+        ''', params + [BULK_EXPORT_MAX_SESSIONS])
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+def stream_bulk_export(sessions, export_format='xlsx'):
+    """Gera o ZIP em blocos: um arquivo por sessão e, por último, a planilha consolidada
+
+    Cada sessão é lida do banco, exportada e gravada no ZIP antes da próxima;
+    as linhas da consolidada vão para um arquivo temporário. A memória fica
+    limitada à maior sessão, não ao total exportado.
+    """
+    extension = 'csv' if export_format == 'csv' else 'xlsx'
+    buffer = ZipStreamBuffer()
+    used_names = set()
+    period_totals = {}
+    header_written = False
+
+    with tempfile.TemporaryFile() as consolidated_file:
+        if extension == 'csv':
+            consolidated_file.write(codecs.BOM_UTF8)  # mesmo utf-8-sig do write_export
+        else:
+            from openpyxl import Workbook
+            # write_only: as linhas vão para disco à medida que são acrescentadas
+            consolidated_book = Workbook(write_only=True)
+            consolidated_sheet = consolidated_book.create_sheet('Dados')
+
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for session_id, title in sessions:
+                session_data, results = load_session_data(session_id)
+                if not session_data:
+                    continue
+
+                name = f"{safe_export_name(title)}.{extension}"
+                if name in used_names:
+                    name = f"{safe_export_name(title)}_{session_id[:8]}.{extension}"
+                used_names.add(name)
+
+                member_buffer = io.BytesIO()
+                df = write_export(results, member_buffer, extension)
+                with archive.open(name, 'w') as member:
+                    member.write(member_buffer.getbuffer())
+                member_buffer.close()
+                yield buffer.drain()
+
+                df.insert(0, 'Sessão', title)
+                if extension == 'csv':
+                    consolidated_file.write(df.to_csv(index=False, header=not header_written).encode('utf-8'))
+                else:
+                    if not header_written:
+                        consolidated_sheet.append(list(df.columns))
+                    for row in df.itertuples(index=False):
+                        consolidated_sheet.append(list(row))
+                header_written = True
+                for period, value in zip(df['Período'], df['Valor Total'].fillna(0.0)):
+                    period_totals[period] = period_totals.get(period, 0.0) + value
+
+            if extension == 'xlsx':
+                summary_sheet = consolidated_book.create_sheet('Resumo')
+                summary_sheet.append(['Período', 'Valor'])
+                for period in sorted(period_totals, key=export_period_key):
+                    summary_sheet.append([period, period_totals[period]])
+                consolidated_book.save(consolidated_file)
+
+            consolidated_file.seek(0)
+            with archive.open(f'consolidado.{extension}', 'w') as member:
+                while True:
+                    chunk = consolidated_file.read(ZIP_STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    member.write(chunk)
+                    yield buffer.drain()
+
+    # Diretório central do ZIP, escrito ao fechar o arquivo
+    yield buffer.drain()
+
+@app.route('/export/bulk')
+def bulk_export():
+    """Exporta várias sessões em um ZIP transmitido em streaming
+
+    Parâmetros: session_id (repetido ou separado por vírgulas) e/ou start/end
+    (AAAA-MM-DD, data de criação da sessão) e format (xlsx ou csv).
+    """
+    try:
+        session_ids = [
+            value.strip()
+            for raw in request.args.getlist('session_id')
+            for value in raw.split(',') if value.strip()
+        ]
+        start_date = request.args.get('start') or None
+        end_date = request.args.get('end') or None
+        export_format = (request.args.get('format') or 'xlsx').lower()
+
+        for value in (start_date, end_date):
+            if value and not re.fullmatch(r'\d{4}-\d{2}-\d{2}', value):
+                flash('Datas da exportação devem estar no formato AAAA-MM-DD.', 'error')
+                return redirect(url_for('home'))
+        if not session_ids and not start_date and not end_date:
+            flash('Informe as sessões ou o período a exportar.', 'error')
+            return redirect(url_for('home'))
+
+        sessions = select_bulk_export_sessions(session_ids, start_date, end_date)
+        if not sessions:
+            flash('Nenhuma sessão encontrada para exportar.', 'error')
+            return redirect(url_for('home'))
+
+        print(f"📦 Exportação em lote: {len(sessions)} sessão(ões) em {export_format}")
+        download_name = f"exportacao_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+        return Response(
+            stream_with_context(stream_bulk_export(sessions, export_format)),
+            mimetype='application/zip',
+            headers={'Content-Disposition': f'attachment; filename="{download_name}"'}
+        )
+
+    except Exception as e:
+        print(f'Erro na exportação em lote: {e}')
+        traceback.print_exc()
+        flash('Falha ao gerar a exportação em lote.', 'error')
+        return redirect(url_for('home'))
+
 # Funções de processamento melhoradas
 
 def safe_float(value):
@@ -1031,7 +2764,7 @@ def validate_extracted_data(result):
                 pass
         
         result['warnings'] = warnings
-        result['data_quality'] = 'good' if len(warnings) == 0 else 'warning' if len(warnings) <= 2 else 'poor'
+        result['data_quality'] = classify_data_quality(warnings)
         
         return result
         
@@ -1041,48 +2774,816 @@ def validate_extracted_data(result):
         result['data_quality'] = 'error'
         return result
 
-def process_file(filepath, original_name):
-    """Processa um único arquivo com extração melhorada de datas"""
+def classify_data_quality(warnings):
+    """Classifica a qualidade do resultado pelo número de alertas"""
+    return 'good' if len(warnings) == 0 else 'warning' if len(warnings) <= 2 else 'poor'
+
+# Histórico por período (mês/ano) usado na detecção de anomalias entre sessões
+HISTORY_WINDOW_MONTHS = 12
+HISTORY_MIN_FILES = 3
+HISTORY_Z_THRESHOLD = 3.0
+HISTORY_MAX_RELATIVE_DEVIATION = 0.5
+SAME_PERIOD_MAX_RELATIVE_DEVIATION = 0.1
+
+def load_period_history():
+    """Carrega as estatísticas pré-computadas por período: {(ano, mês): (arquivos, soma, soma_quadrados)}
+
+    A tabela period_statistics é mantida por triggers em processed_files e tem
+    uma linha por período, então o carregamento é barato e feito uma vez por upload.
+    """
     try:
-        print(f"📊 Processando: {original_name}")
-        
-        if filepath.endswith('.csv'):
-            df = pd.read_csv(filepath, encoding='utf-8')
-            sheet_name = 'CSV'
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute('SELECT year_ref, month_ref, file_count, total, total_sq FROM period_statistics WHERE file_count > 0')
+        history = {(row[0], row[1]): (row[2], row[3], row[4]) for row in cursor.fetchall()}
+        conn.close()
+        return history
+    except Exception as e:
+        print(f"Erro ao carregar histórico por período: {e}")
+        return {}
+
+def previous_periods(month, year, count):
+    """Lista os `count` períodos (ano, mês) imediatamente anteriores a mês/ano"""
+    periods = []
+    for _ in range(count):
+        month -= 1
+        if month == 0:
+            month, year = 12, year - 1
+        periods.append((year, month))
+    return periods
+
+def validate_against_history(result, history):
+    """Compara o total extraído com o histórico do mesmo período e dos meses anteriores
+
+    Usa apenas agregados (quantidade, soma e soma dos quadrados) de
+    `history`, sem consultar processed_files. Os alertas são acrescentados
+    ao resultado e a qualidade é reclassificada.
+    """
+    try:
+        value = result.get('total_value') or 0
+        month = result.get('month')
+        year = result.get('year')
+        if not result.get('success', False) or value <= 0 or not month or not year or not history:
+            return result
+
+        warnings = list(result.get('warnings') or [])
+        
+        # Mesmo período já importado em sessões anteriores
+        same_period = history.get((year, month))
+        if same_period:
+            period_mean = same_period[1] / same_period[0]
+            deviation = abs(value - period_mean) / period_mean if period_mean else 0
+            if deviation > SAME_PERIOD_MAX_RELATIVE_DEVIATION:
+                warnings.append(
+                    f"⚠️ Valor difere {deviation * 100:.0f}% de outros relatórios de "
+                    f"{format_date_period_br(month, year)} ({format_currency_br(period_mean)})"
+                )
+
+        # Série dos meses anteriores
+        file_count, total, total_sq = 0, 0.0, 0.0
+        for period in previous_periods(month, year, HISTORY_WINDOW_MONTHS):
+            stats = history.get(period)
+            if stats:
+                file_count += stats[0]
+                total += stats[1]
+                total_sq += stats[2]
+
+        if file_count >= HISTORY_MIN_FILES:
+            mean = total / file_count
+            std = max(total_sq / file_count - mean * mean, 0.0) ** 0.5
+            if std > 0:
+                is_anomaly = abs(value - mean) / std > HISTORY_Z_THRESHOLD
+            else:
+                is_anomaly = mean > 0 and abs(value - mean) / mean > HISTORY_MAX_RELATIVE_DEVIATION
+            if is_anomaly:
+                warnings.append(
+                    f"⚠️ Valor fora do padrão dos últimos {HISTORY_WINDOW_MONTHS} meses "
+                    f"(média {format_currency_br(mean)})"
+                )
+
+        if len(warnings) != len(result.get('warnings') or []):
+            result['warnings'] = warnings
+            result['data_quality'] = classify_data_quality(warnings)
+
+        return result
+
+    except Exception as e:
+        print(f"Erro na validação histórica: {e}")
+        return result
+
+# Pipeline de extração
+#
+# Cada etapa recebe um ExtractionContext e preenche context.result. A planilha é
+# lida e pré-processada (scan_sheet) uma única vez, sob demanda, e compartilhada
+# por todas as etapas. Uma etapa pode retornar STOP_PIPELINE para encerrar a
+# extração; etapas registradas com final=True (validação) rodam mesmo assim.
+
+STOP_PIPELINE = object()
+EXTRACTION_STAGES = {}
+
+DATE_FORMATS = ['%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%m/%d/%Y']
+
+# Engine de leitura por extensão (um loader pode informar outra em df.attrs['engine'])
+READER_ENGINES = {'.csv': 'pandas-csv', '.xlsx': 'openpyxl', '.xls': 'xlrd'}
+
+# Valores monetários em texto no padrão brasileiro (já em minúsculas e sem espaços nas pontas):
+# "r$ 1.234.567,89", "1.234,56", "-r$ 10,00", "r$ -10,00", "(1.234,56)", "1234,5"
+BR_NUMBER_PATTERN = (
+    r'^(?P<open>\()?\s*(?P<sign>-)?\s*(?:r\$)?\s*(?P<sign2>-)?\s*'
+    r'(?P<int>\d{1,3}(?:\.\d{3})+|\d+)(?:,(?P<dec>\d+))?\s*(?P<close>\))?$'
+)
+
+# Compactação do DataFrame carregado: o tipo de cada coluna é escolhido por uma
+# amostra das primeiras linhas e confirmado na coluna inteira
+DTYPE_SAMPLE_ROWS = 200
+CATEGORY_MIN_ROWS = 32
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+def compact_dataframe(df):
+    """Remove colunas vazias e linhas vazias das pontas e estreita os tipos das colunas
+
+    - colunas object só com números viram float64 (valores monetários: float32
+      perderia centavos acima de ~100 mil);
+    - colunas object só com datas viram datetime64;
+    - textos com muitos rótulos repetidos viram category, e as etapas seguintes
+      processam cada rótulo uma única vez.
+    Linhas vazias no meio da planilha são mantidas: a busca de datas usa as
+    células vizinhas como contexto.
+    """
+    import pandas as pd
+    df = df.loc[:, df.notna().any(axis=0).to_numpy()]
+
+    filled_rows = df.notna().any(axis=1).to_numpy().nonzero()[0]
+    if filled_rows.size:
+        df = df.iloc[filled_rows[0]:filled_rows[-1] + 1]
+    else:
+        df = df.iloc[0:0]
+    df = df.reset_index(drop=True)
+
+    for col_idx in range(df.shape[1]):
+        column = df.iloc[:, col_idx]
+        if pd.api.types.is_numeric_dtype(column) or pd.api.types.is_datetime64_any_dtype(column):
+            continue
+        sample_kind = pd.api.types.infer_dtype(column.iloc[:DTYPE_SAMPLE_ROWS], skipna=True)
+        present = column.notna()
+
+        if sample_kind in ('integer', 'floating', 'mixed-integer-float', 'decimal'):
+            converted = pd.to_numeric(column, errors='coerce').astype('float64')
+        elif sample_kind in ('datetime', 'datetime64', 'date'):
+            converted = pd.to_datetime(column, errors='coerce')
+        elif (sample_kind == 'string' and len(column) >= CATEGORY_MIN_ROWS
+              and pd.api.types.infer_dtype(column, skipna=True) == 'string'
+              and column.nunique() <= len(column) * CATEGORY_MAX_UNIQUE_RATIO):
+            converted = column.astype('category')
         else:
-            excel_file = pd.ExcelFile(filepath)
-            target_sheet = None
-            for sheet in excel_file.sheet_names:
-                if 'total' in sheet.lower() and ('mês' in sheet.lower() or 'mes' in sheet.lower()):
-                    target_sheet = sheet
-                    break
-            
-            if target_sheet is None:
-                target_sheet = excel_file.sheet_names[0]
-            
-            df = pd.read_excel(filepath, sheet_name=target_sheet)
-            sheet_name = target_sheet
-        
-        total_value = extract_total_value(df)
-        emission_date, due_date = extract_dates_improved(df)
-        month, year = extract_date_from_filename_improved(original_name)
-        
-        result = {
-            'filename': original_name,
+            continue
+
+        # Só troca o tipo se a coluna inteira confirmar a amostra (nenhum valor perdido)
+        if converted.notna().sum() == present.sum():
+            df.isetitem(col_idx, converted)
+
+    return df
+
+def extraction_stage(name, order, final=False):
+    """Registra uma etapa do pipeline de extração (executadas em ordem crescente de `order`)"""
+    def decorator(func):
+        EXTRACTION_STAGES[name] = {'name': name, 'order': order, 'final': final, 'func': func}
+        return func
+    return decorator
+
+def pick_target_sheet(sheet_names):
+    """Escolhe a aba de interesse: a primeira com 'total' e 'mês' no nome, senão a primeira"""
+    for sheet in sheet_names:
+        if 'total' in sheet.lower() and ('mês' in sheet.lower() or 'mes' in sheet.lower()):
+            return sheet
+    return sheet_names[0]
+
+# Exportações brasileiras costumam vir em cp1252/Latin-1 em vez de UTF-8
+CSV_ENCODING_SAMPLE_BYTES = 256 * 1024
+
+def detect_csv_encoding(filepath):
+    """Codificação provável do CSV pelo início do arquivo: utf-8(-sig), cp1252 ou latin-1"""
+    with open(filepath, 'rb') as source:
+        sample = source.read(CSV_ENCODING_SAMPLE_BYTES)
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        # Decodificador incremental: um caractere cortado no fim da amostra não é erro
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    try:
+        # cp1252 é o Latin-1 do Windows (aspas curvas, travessão, €); só não define 5 bytes
+        sample.decode('cp1252')
+        return 'cp1252'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+def load_pyarrow_csv():
+    """Módulo pyarrow.csv, ou None se o pyarrow não estiver instalado (opcional)"""
+    try:
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        return None
+    return pa_csv
+
+def read_csv_file(filepath):
+    """Lê um CSV inteiro detectando a codificação
+
+    Com o pyarrow instalado usa o leitor dele (arquivo mapeado em memória e
+    parsing em várias threads); sem ele, ou se o pyarrow recusar o arquivo,
+    usa o pd.read_csv. Se a amostra enganar a detecção e o arquivo não
+    decodificar, tenta de novo em cp1252 e por fim em Latin-1 (que aceita
+    qualquer byte). O leitor usado fica em df.attrs['engine'].
+    """
+    import pandas as pd
+    encoding = detect_csv_encoding(filepath)
+    pa_csv = load_pyarrow_csv()
+
+    if pa_csv is not None:
+        import pyarrow as pa
+        try:
+            with pa.memory_map(filepath, 'r') as source:
+                table = pa_csv.read_csv(
+                    source,
+                    read_options=pa_csv.ReadOptions(use_threads=True, encoding=encoding),
+                    convert_options=pa_csv.ConvertOptions(strings_can_be_null=True)
+                )
+            # Colunas que não decodificaram em UTF-8 chegam como binárias
+            binary = [field.name for field in table.schema if pa.types.is_binary(field.type)]
+            if not binary:
+                df = table.to_pandas()
+                df.attrs['engine'] = 'pyarrow-csv'
+                return df
+            print(f"⚠️ {os.path.basename(filepath)} tem texto fora de {encoding} ({', '.join(binary)}), usando pandas")
+        except (pa.ArrowInvalid, UnicodeDecodeError) as e:
+            print(f"⚠️ Leitor pyarrow recusou {os.path.basename(filepath)}, usando pandas: {e}")
+
+    for attempt in dict.fromkeys((encoding, 'cp1252', 'latin-1')):
+        try:
+            df = pd.read_csv(filepath, encoding=attempt)
+            break
+        except UnicodeDecodeError:
+            print(f"⚠️ {os.path.basename(filepath)} não está em {attempt}, tentando outra codificação")
+    df.attrs['engine'] = 'pandas-csv'
+    return df
+
+def load_target_sheet(filepath):
+    """Lê a aba de interesse do arquivo: a primeira com 'total' e 'mês' no nome, senão a primeira"""
+    import pandas as pd
+    if filepath.endswith('.csv'):
+        return read_csv_file(filepath), 'CSV'
+
+    excel_file = pd.ExcelFile(filepath)
+    target_sheet = pick_target_sheet(excel_file.sheet_names)
+    return excel_file.parse(target_sheet), target_sheet
+
+def parse_date_column(column):
+    """Série datetime64 (NaT nas células sem data) para uma coluna do DataFrame
+
+    Células datetime são usadas diretamente; textos com 8+ caracteres são
+    testados contra DATE_FORMATS, na ordem, de forma vetorizada. Colunas
+    category são convertidas uma vez por rótulo.
+    """
+    import numpy as np
+    import pandas as pd
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return column
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        parsed = parse_date_column(pd.Series(column.cat.categories)).to_numpy(dtype='datetime64[ns]')
+        codes = column.cat.codes.to_numpy()
+        return pd.Series(np.append(parsed, np.datetime64('NaT', 'ns'))[codes], index=column.index)
+
+    parsed = pd.Series(pd.NaT, index=column.index, dtype='datetime64[ns]')
+    if pd.api.types.is_numeric_dtype(column):
+        return parsed
+
+    is_date = column.map(lambda v: isinstance(v, (datetime, date)))
+    if is_date.any():
+        parsed[is_date] = pd.to_datetime(column[is_date], errors='coerce')
+
+    text = column.map(lambda v: v.strip() if isinstance(v, str) else '')
+    candidates = (text.map(len) >= 8) & parsed.isna()
+    for fmt in DATE_FORMATS:
+        if not candidates.any():
+            break
+        converted = pd.to_datetime(text[candidates], format=fmt, errors='coerce')
+        parsed[converted.index] = parsed[converted.index].fillna(converted)
+        candidates &= parsed.isna()
+    return parsed
+
+def parse_date_matrix(df):
+    """Matriz de datas (objeto datetime ou None) para cada célula do DataFrame"""
+    import numpy as np
+    dates = np.full(df.shape, None, dtype=object)
+
+    for col_idx in range(df.shape[1]):
+        parsed = parse_date_column(df.iloc[:, col_idx])
+        valid = parsed.notna().to_numpy()
+        if valid.any():
+            dates[valid, col_idx] = [ts.to_pydatetime() for ts in parsed[valid]]
+
+    return dates
+
+def parse_numeric_column(column):
+    """Converte uma coluna para float: padrão brasileiro (R$, milhar com ponto,
+    vírgula decimal e negativos com sinal ou entre parênteses) e pd.to_numeric
+
+    Tudo com operações de string do pandas sobre a coluna inteira. Texto no
+    formato de milhar ("1.234", "1.234.567", "1.234,56") é sempre lido como
+    milhar, mesmo quando o to_numeric o aceitaria como decimal; os demais
+    textos que o to_numeric entende ("1234.56") mantêm a interpretação dele.
+    """
+    import numpy as np
+    import pandas as pd
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # Cada rótulo é convertido uma única vez
+        parsed = parse_numeric_column(pd.Series(column.cat.categories)).to_numpy(dtype=np.float64, na_value=np.nan)
+        return pd.Series(np.append(parsed, np.nan)[column.cat.codes.to_numpy()], index=column.index)
+
+    numbers = pd.to_numeric(column, errors='coerce')
+    if pd.api.types.is_numeric_dtype(column) or pd.api.types.is_datetime64_any_dtype(column):
+        return numbers
+
+    # Só as células de texto (colunas object misturam datas e números)
+    if isinstance(column.dtype, pd.StringDtype):
+        is_text = column.notna()
+    else:
+        is_text = column.map(lambda value: isinstance(value, str)).astype(bool)
+    if not is_text.any():
+        return numbers
+    numbers = numbers.astype(np.float64)
+
+    text = column[is_text].str.strip().str.lower()
+    parts = text.str.extract(BR_NUMBER_PATTERN)
+    # Células que o to_numeric não converteu e as que estão no formato de milhar
+    brazilian = parts['int'].notna() & (numbers[is_text].isna() | parts['int'].str.contains('.', regex=False, na=False))
+    if not brazilian.any():
+        return numbers
+    parts = parts[brazilian]
+
+    values = pd.to_numeric(parts['int'].str.replace('.', '', regex=False) + '.' + parts['dec'].fillna('0'), errors='coerce')
+    negative = parts['open'].notna() | parts['sign'].notna() | parts['sign2'].notna()
+    balanced = parts['open'].notna() == parts['close'].notna()
+    values = values.where(balanced)
+    values = values.mask(negative, -values)
+
+    numbers.loc[values.index] = values
+    return numbers
+
+def column_text(column):
+    """Textos em minúsculas de uma coluna ('' nas células vazias); category uma vez por rótulo"""
+    import numpy as np
+    import pandas as pd
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        labels = np.char.lower(column.cat.categories.astype(object).to_numpy(dtype=str))
+        return np.append(labels, '')[column.cat.codes.to_numpy()]
+    return np.char.lower(column.astype(object).where(column.notna(), '').to_numpy(dtype=str))
+
+def scan_sheet(df):
+    """Pré-processa a planilha uma única vez para todas as etapas
+
+    Retorna um dicionário com:
+      text          - matriz de textos em minúsculas ('' para células vazias)
+      numeric       - matriz float com os valores numéricos, inclusive textos como
+                      "R$ 1.234,56" (NaN nos demais e nas datas)
+      dates         - matriz de objetos datetime (None nas demais células)
+      date_mask     - máscara das células com data
+      total_rows    - máscara das linhas que contêm 'total'
+      columns_lower - nomes das colunas em minúsculas
+    """
+    import numpy as np
+    import pandas as pd
+    text = np.column_stack([column_text(df.iloc[:, i]) for i in range(df.shape[1])]) if df.size else np.empty(df.shape, dtype=str)
+
+    dates = parse_date_matrix(df)
+    date_mask = dates != None  # noqa: E711 - comparação elemento a elemento
+
+    numeric = df.apply(parse_numeric_column).to_numpy(dtype=np.float64, na_value=np.nan, copy=True)
+    numeric[date_mask] = np.nan
+    for col_idx in range(df.shape[1]):
+        # Colunas datetime viram inteiros em to_numeric; não são valores monetários
+        if pd.api.types.is_datetime64_any_dtype(df.iloc[:, col_idx]):
+            numeric[:, col_idx] = np.nan
+
+    return {
+        'text': text,
+        'numeric': numeric,
+        'dates': dates,
+        'date_mask': date_mask,
+        'total_rows': np.char.find(text, 'total').max(axis=1) >= 0 if df.size else np.zeros(len(df), dtype=bool),
+        'columns_lower': [str(col).lower() for col in df.columns]
+    }
+
+class ExtractionContext:
+    """Estado de um arquivo ao longo do pipeline: DataFrame e scan carregados sob demanda"""
+
+    def __init__(self, filepath, original_name, loader=load_target_sheet, sheet_name=None):
+        self.filepath = filepath
+        self.original_name = original_name
+        # Aba fixada pelo chamador (modo multiabas); None usa a escolha automática
+        self.sheet_name = sheet_name
+        self.result = {'filename': original_name}
+        self._loader = loader
+        self._df = None
+        self._scan = None
+        # Telemetria: tempos em ms por etapa ('load' e 'scan' contados à parte)
+        self.timings = {}
+        self.engine = None
+        self.dimensions = (None, None)
+        # Etapa em execução (informada ao supervisor do pool e gravada nas falhas)
+        self.stage = None
+
+    def enter_stage(self, stage):
+        self.stage = stage
+        report_progress(stage)
+
+    @property
+    def df(self):
+        if self._df is None:
+            current = self.stage
+            self.enter_stage('load')
+            started = time.perf_counter()
+            df, self.result['sheet_name'] = self._loader(self.filepath)
+            self.engine = df.attrs.get('engine') or READER_ENGINES.get(os.path.splitext(self.filepath)[1].lower())
+            self.dimensions = df.shape
+            self._df = compact_dataframe(df)
+            self.timings['load'] = (time.perf_counter() - started) * 1000
+            self.enter_stage(current)
+        return self._df
+
+    @property
+    def scan(self):
+        if self._scan is None:
+            df = self.df
+            current = self.stage
+            self.enter_stage('scan')
+            started = time.perf_counter()
+            self._scan = scan_sheet(df)
+            self.timings['scan'] = (time.perf_counter() - started) * 1000
+            self.enter_stage(current)
+        return self._scan
+
+def memory_high_water_kb():
+    """Pico de memória residente do processo em KB (None onde não há o módulo resource)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def run_extraction_pipeline(context):
+    """Executa as etapas registradas em ordem; após STOP_PIPELINE só as etapas finais rodam
+
+    Registra em result['telemetry'] engine, dimensões da aba, tempo por etapa e
+    memória. A memória vem do pico de RSS do processo (barato, mas compartilhado
+    entre os arquivos processados em paralelo no mesmo processo): peak_rss_kb é
+    o pico ao fim do arquivo e rss_growth_kb quanto este arquivo elevou o pico.
+    Se uma etapa falha, a exceção sai com a telemetria até ali em e.telemetry
+    (com last_stage e failure).
+    """
+    started = time.perf_counter()
+    peak_before = memory_high_water_kb()
+
+    def telemetry(**extra):
+        peak_after = memory_high_water_kb()
+        return {
+            'engine': context.engine,
+            'sheet_rows': context.dimensions[0],
+            'sheet_cols': context.dimensions[1],
+            'total_ms': (time.perf_counter() - started) * 1000,
+            'stages': dict(context.timings),
+            'peak_rss_kb': peak_after,
+            'rss_growth_kb': peak_after - peak_before if peak_after is not None else None,
+            **extra
+        }
+
+    stopped = False
+    try:
+        for stage in sorted(EXTRACTION_STAGES.values(), key=lambda s: s['order']):
+            if stopped and not stage['final']:
+                continue
+            context.enter_stage(stage['name'])
+            # Leitura e varredura sob demanda são contadas nas próprias entradas
+            nested_before = context.timings.get('load', 0) + context.timings.get('scan', 0)
+            stage_started = time.perf_counter()
+            outcome = stage['func'](context)
+            nested = context.timings.get('load', 0) + context.timings.get('scan', 0) - nested_before
+            context.timings[stage['name']] = max((time.perf_counter() - stage_started) * 1000 - nested, 0.0)
+            if outcome is STOP_PIPELINE:
+                stopped = True
+    except Exception as e:
+        e.telemetry = telemetry(last_stage=context.stage, failure=type(e).__name__)
+        raise
+
+    context.result['telemetry'] = telemetry()
+    return context.result
+
+# Layouts conhecidos (exportações de ERP com células fixas)
+#
+# A impressão digital de um layout combina os nomes das abas, a aba de
+# interesse, o número de colunas e os textos das primeiras linhas (com dígitos
+# normalizados). Para layouts confirmados, o total e as datas são lidos direto
+# das células registradas, em modo read-only, sem a varredura heurística. A
+# impressão digital não depende do número de linhas: a célula do total só é
+# aceita se a linha dela ainda tiver o rótulo 'total'.
+LAYOUT_HEADER_ROWS = 5
+LAYOUT_MIN_CONFIRMATIONS = 2
+
+layout_templates_cache = None
+layout_templates_cache_version = None
+layout_templates_lock = threading.Lock()
+
+def layout_fingerprint(workbook):
+    """Calcula (impressão digital, aba de interesse) de uma pasta aberta com openpyxl"""
+    sheet_name = pick_target_sheet(workbook.sheetnames)
+    worksheet = workbook[sheet_name]
+
+    header_texts = []
+    for values in worksheet.iter_rows(min_row=1, max_row=LAYOUT_HEADER_ROWS, values_only=True):
+        for value in values:
+            if isinstance(value, str) and value.strip():
+                header_texts.append(re.sub(r'\d+', '#', value.strip().lower()))
+
+    signature = json.dumps({
+        'sheets': workbook.sheetnames,
+        'target': sheet_name,
+        'columns': worksheet.max_column,
+        'header': header_texts
+    }, ensure_ascii=False)
+    return hashlib.sha1(signature.encode('utf-8')).hexdigest(), sheet_name
+
+def layout_templates_version(cursor):
+    """Assinatura barata do conteúdo de layout_templates, para detectar mudanças de outros processos"""
+    cursor.execute('''
+        SELECT COUNT(*), COALESCE(MAX(updated_at), ''), COALESCE(SUM(confirmations), 0), COALESCE(SUM(conflicts), 0)
+        FROM layout_templates
+    ''')
+    return tuple(cursor.fetchone())
+
+def get_layout_templates():
+    """Layouts confirmados, recarregados quando a tabela muda (inclusive por learn_layouts.py)"""
+    global layout_templates_cache, layout_templates_cache_version
+    with layout_templates_lock:
+        conn = connect_db()
+        try:
+            cursor = conn.cursor()
+            version = layout_templates_version(cursor)
+            if layout_templates_cache is None or version != layout_templates_cache_version:
+                cursor.execute('''
+                    SELECT fingerprint, sheet_name, total_cell, emission_cell, due_cell
+                    FROM layout_templates
+                    WHERE confirmations >= ? AND conflicts = 0 AND exact_total = 1
+                ''', (LAYOUT_MIN_CONFIRMATIONS,))
+                layout_templates_cache = {
+                    row[0]: {'sheet_name': row[1], 'total_cell': row[2], 'emission_cell': row[3], 'due_cell': row[4]}
+                    for row in cursor.fetchall()
+                }
+                layout_templates_cache_version = version
+        finally:
+            conn.close()
+        return layout_templates_cache
+
+def split_cell_reference(reference):
+    """'B24' -> (24, 2)"""
+    match = re.fullmatch(r'([A-Z]+)(\d+)', reference)
+    col_idx = 0
+    for letter in match.group(1):
+        col_idx = col_idx * 26 + ord(letter) - 64
+    return int(match.group(2)), col_idx
+
+def has_total_label(values):
+    """Linha com algum texto contendo 'total' (mesmo critério de scan_sheet)"""
+    return any(isinstance(value, str) and 'total' in value.lower() for value in values)
+
+def read_template_cells(worksheet, references):
+    """Lê as células indicadas percorrendo a aba uma única vez até a última linha necessária
+
+    Retorna (valores por referência, {referência: linha tem rótulo 'total'}).
+    """
+    positions = {ref: split_cell_reference(ref) for ref in references if ref}
+    if not positions:
+        return {}, {}
+    max_row = max(row for row, _ in positions.values())
+
+    rows = list(worksheet.iter_rows(min_row=1, max_row=max_row, values_only=True))
+    values = {}
+    labelled = {}
+    for ref, (row, col) in positions.items():
+        row_values = rows[row - 1] if row - 1 < len(rows) else ()
+        values[ref] = row_values[col - 1] if col - 1 < len(row_values) else None
+        labelled[ref] = has_total_label(row_values)
+    return values, labelled
+
+def read_known_layout(filepath):
+    """Extrai total e datas de um .xlsx de layout conhecido; None se o layout não for conhecido,
+    se alguma célula registrada não tiver o tipo esperado ou se a linha do total
+    não tiver mais o rótulo 'total' (mais ou menos itens deslocam a linha)"""
+    templates = get_layout_templates()
+    if not templates:
+        return None
+
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        fingerprint, sheet_name = layout_fingerprint(workbook)
+        template = templates.get(fingerprint)
+        if not template or template['sheet_name'] != sheet_name:
+            return None
+
+        cells, labelled = read_template_cells(workbook[sheet_name], [
+            template['total_cell'], template['emission_cell'], template['due_cell']
+        ])
+
+        total_value = cells.get(template['total_cell'])
+        if isinstance(total_value, bool) or not isinstance(total_value, (int, float)) or total_value <= 0:
+            return None
+        if not labelled.get(template['total_cell']):
+            return None
+
+        extracted = {
             'sheet_name': sheet_name,
-            'total_value': safe_float(total_value),
-            'emission_date': emission_date,
-            'due_date': due_date,
-            'month': safe_int(month),
-            'year': safe_int(year),
-            'success': True,
-            'formatted_date': format_date_period_br(month, year),
-            'formatted_value': format_currency_br(safe_float(total_value))
+            'total_value': float(total_value),
+            'emission_date': None,
+            'due_date': None,
+            'layout_fingerprint': fingerprint
         }
+        for key, cell_key in (('emission_date', 'emission_cell'), ('due_date', 'due_cell')):
+            if template[cell_key]:
+                value = cells.get(template[cell_key])
+                if not hasattr(value, 'strftime'):
+                    return None
+                extracted[key] = value.strftime('%d/%m/%Y')
+
+        return extracted
+    finally:
+        workbook.close()
+
+def learn_layout_template(filepath, result):
+    """Registra (ou confirma) o layout de um arquivo processado com sucesso pela via genérica
+
+    Localiza as células que contêm o total (valor idêntico, na célula que a
+    extração genérica usou, numa linha com 'total') e as datas extraídas. Se um
+    layout já registrado apontar para outras células, ou se a célula do total
+    não puder ser identificada, ele é marcado como conflitante e deixa de ser usado.
+    Retorna a impressão digital ou None.
+    """
+    if not filepath.endswith('.xlsx') or not result.get('success') or not result.get('total_value'):
+        return None
+
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        fingerprint, sheet_name = layout_fingerprint(workbook)
+        if sheet_name != result.get('sheet_name'):
+            return None
+
+        total_value = result['total_value']
+        wanted_dates = {
+            'emission_cell': format_date_br(result['emission_date']) if result.get('emission_date') else None,
+            'due_cell': format_date_br(result['due_date']) if result.get('due_date') else None
+        }
+        found = {'total_cell': None, 'emission_cell': None, 'due_cell': None}
+        total_matches = []  # células da linha com 'total' com exatamente o total extraído
+
+        for row_idx, values in enumerate(workbook[sheet_name].iter_rows(values_only=True), start=1):
+            label_row = has_total_label(values)
+            for col_idx, value in enumerate(values, start=1):
+                reference = f"{column_letter(col_idx)}{row_idx}"
+                if (label_row and isinstance(value, (int, float)) and not isinstance(value, bool)
+                        and float(value) == total_value):
+                    total_matches.append(reference)
+                elif hasattr(value, 'strftime'):
+                    formatted = value.strftime('%d/%m/%Y')
+                    for key, wanted in wanted_dates.items():
+                        if wanted == formatted and found[key] is None:
+                            found[key] = reference
+                            break
+    finally:
+        workbook.close()
+
+    # Mesma célula que extract_total_value escolheu: a primeira, linha a linha, entre
+    # as linhas com 'total'. Sem linha de total a via rápida não teria como
+    # conferir a célula em outros arquivos, então o layout não é registrado
+    if total_matches:
+        found['total_cell'] = total_matches[0]
+
+    if any(wanted_dates[k] and not found[k] for k in wanted_dates):
+        return None
+
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT total_cell, emission_cell, due_cell, exact_total FROM layout_templates WHERE fingerprint = ?', (fingerprint,))
+    existing = cursor.fetchone()
+    if not found['total_cell']:
+        # O total veio de uma célula que a via rápida não reproduziria (texto, valor
+        # repetido): não registra e invalida o layout já conhecido
+        if existing is not None:
+            cursor.execute('''
+                UPDATE layout_templates SET conflicts = conflicts + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE fingerprint = ?
+            ''', (fingerprint,))
+            conn.commit()
+        conn.close()
+        reset_layout_templates_cache()
+        return None
+    if existing is None or not existing[3]:
+        cursor.execute('''
+            INSERT OR REPLACE INTO layout_templates
+                (fingerprint, sheet_name, total_cell, emission_cell, due_cell, confirmations, exact_total)
+            VALUES (?, ?, ?, ?, ?, 1, 1)
+        ''', (fingerprint, sheet_name, found['total_cell'], found['emission_cell'], found['due_cell']))
+    elif tuple(existing[:3]) == (found['total_cell'], found['emission_cell'], found['due_cell']):
+        cursor.execute('''
+            UPDATE layout_templates SET confirmations = confirmations + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE fingerprint = ?
+        ''', (fingerprint,))
+    # Data ausente de um dos lados não confirma nem contradiz o layout
+    elif existing[0] != found['total_cell'] or any(
+            old and new and old != new
+            for old, new in zip(existing[1:], (found['emission_cell'], found['due_cell']))):
+        cursor.execute('''
+            UPDATE layout_templates SET conflicts = conflicts + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE fingerprint = ?
+        ''', (fingerprint,))
+    conn.commit()
+    conn.close()
+
+    reset_layout_templates_cache()
+    return fingerprint
+
+def reset_layout_templates_cache():
+    """Força a releitura dos layouts na próxima consulta"""
+    global layout_templates_cache
+    with layout_templates_lock:
+        layout_templates_cache = None
+
+@extraction_stage('layout_template', order=10)
+def layout_template_stage(context):
+    """Via rápida: layout conhecido dispensa a leitura do DataFrame e a varredura genérica"""
+    if not context.filepath.endswith('.xlsx') or context.sheet_name:
+        return None
+    try:
+        extracted = read_known_layout(context.filepath)
+    except Exception as e:
+        print(f"Layout conhecido não pôde ser lido em {context.original_name}: {e}")
+        return None
+    if not extracted:
+        return None
+
+    print(f"⚡ Layout conhecido ({extracted['layout_fingerprint'][:8]}): leitura direta das células")
+    context.engine = 'openpyxl-layout'
+    context.result.update(extracted)
+    return STOP_PIPELINE
+
+@extraction_stage('total_value', order=20)
+def total_value_stage(context):
+    context.result['total_value'] = safe_float(extract_total_value(context.df, context.scan))
+
+@extraction_stage('dates', order=30)
+def dates_stage(context):
+    emission_date, due_date = extract_dates_improved(context.df, context.scan)
+    context.result['emission_date'] = emission_date
+    context.result['due_date'] = due_date
+
+@extraction_stage('filename_period', order=5)
+def filename_period_stage(context):
+    if context.sheet_name:
+        month, year = extract_period_from_sheet_name(context.sheet_name, context.original_name)
+    else:
+        month, year = extract_date_from_filename_improved(context.original_name)
+    context.result['month'] = safe_int(month)
+    context.result['year'] = safe_int(year)
+
+@extraction_stage('validation', order=100, final=True)
+def validation_stage(context):
+    result = context.result
+    result.setdefault('sheet_name', None)
+    result.setdefault('total_value', 0.0)
+    result.setdefault('emission_date', None)
+    result.setdefault('due_date', None)
+    result.setdefault('month', None)
+    result.setdefault('year', None)
+    result['success'] = True
+    result['formatted_date'] = format_date_period_br(result['month'], result['year'])
+    result['formatted_value'] = format_currency_br(result['total_value'])
+    context.result = validate_extracted_data(result)
+
+def process_file(filepath, original_name):
+    """Processa um único arquivo passando-o pelo pipeline de extração"""
+    try:
+        print(f"📊 Processando: {original_name}")
         
-        result = validate_extracted_data(result)
-        return result
+        context = ExtractionContext(filepath, original_name)
+        return run_extraction_pipeline(context)
         
+    except MemoryError:
+        # Tratado por quem chamou (o worker isolado é substituído)
+        raise
     except Exception as e:
         print(f"❌ Erro no processamento de {original_name}: {str(e)}")
         return {
@@ -1097,36 +3598,104 @@ def process_file(filepath, original_name):
             'warnings': [f'Erro no processamento: {str(e)}'],
             'data_quality': 'error',
             'formatted_date': '-',
-            'formatted_value': 'R$ 0,00'
+            'formatted_value': 'R$ 0,00',
+            'telemetry': getattr(e, 'telemetry', None)
         }
 
-def extract_total_value(df):
-    """Extrai o maior valor numérico do DataFrame"""
+MONTH_NAMES_BR = ['Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho', 'Julho',
+                  'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro']
+
+def pick_monthly_sheets(sheet_names):
+    """Abas processadas no modo multiabas: todas com 'total' e 'mês' no nome;
+    na falta delas, as que têm nome de mês; senão só a aba escolhida normalmente"""
+    matching = [
+        sheet for sheet in sheet_names
+        if 'total' in sheet.lower() and ('mês' in sheet.lower() or 'mes' in sheet.lower())
+    ]
+    if not matching:
+        matching = [
+            sheet for sheet in sheet_names
+            if any(month_name.lower() in sheet.lower() for month_name in MONTH_NAMES_BR)
+        ]
+    return matching or [pick_target_sheet(sheet_names)]
+
+def extract_period_from_sheet_name(sheet_name, filename):
+    """Mês e ano de uma aba: o que o nome da aba informar, completado pelo nome do arquivo"""
+    file_month, file_year = extract_date_from_filename_improved(filename)
+    sheet_month, _ = extract_date_from_filename_improved(sheet_name)
+    year_match = re.search(r'(20\d{2})', sheet_name)
+    return (
+        sheet_month or file_month,
+        int(year_match.group(1)) if year_match else file_year
+    )
+
+def process_workbook(filepath, original_name):
+    """Modo multiabas: processa todas as abas mensais de uma pasta, abrindo o arquivo uma única vez
+
+    Retorna uma lista de resultados, um por aba. CSVs e pastas sem abas
+    mensais caem no processamento normal de um único resultado.
+    """
+    import pandas as pd
+    if filepath.endswith('.csv'):
+        return [process_file(filepath, original_name)]
+
     try:
-        max_value = 0.0
-        
-        for idx, row in df.iterrows():
-            row_str = ' '.join([str(val).lower() for val in row.values if pd.notna(val)])
-            if 'total' in row_str:
-                for col in df.columns:
-                    try:
-                        value = pd.to_numeric(row[col], errors='coerce')
-                        if pd.notna(value) and abs(value) > abs(max_value):
-                            max_value = float(value)
-                    except:
-                        continue
-        
-        if max_value == 0.0:
-            for col in df.columns:
-                try:
-                    numeric_col = pd.to_numeric(df[col], errors='coerce')
-                    col_max = numeric_col.max()
-                    if pd.notna(col_max) and abs(col_max) > abs(max_value):
-                        max_value = float(col_max)
-                except:
-                    continue
+        print(f"📚 Processando todas as abas mensais: {original_name}")
+        excel_file = pd.ExcelFile(filepath)
+    except Exception:
+        return [process_file(filepath, original_name)]
+
+    try:
+        results = []
+        for sheet in pick_monthly_sheets(excel_file.sheet_names):
+            try:
+                # Cada aba é lida sob demanda do mesmo handle
+                context = ExtractionContext(
+                    filepath, original_name,
+                    loader=lambda _path, sheet=sheet: (excel_file.parse(sheet), sheet),
+                    sheet_name=sheet
+                )
+                results.append(run_extraction_pipeline(context))
+            except MemoryError:
+                raise
+            except Exception as e:
+                print(f"❌ Erro no processamento da aba {sheet} de {original_name}: {str(e)}")
+                error_result = build_error_result(original_name, f'Erro no processamento da aba {sheet}: {str(e)}')
+                error_result['sheet_name'] = sheet
+                error_result['telemetry'] = getattr(e, 'telemetry', None)
+                results.append(error_result)
+        return results
+    finally:
+        excel_file.close()
+
+def extract_total_value(df, scan=None):
+    """Extrai o valor total: o maior valor (em módulo) das linhas com 'total',
+    ou o maior valor das colunas numéricas quando não há linha de total"""
+    import numpy as np
+    try:
+        if scan is None:
+            scan = scan_sheet(df)
+        numeric = scan['numeric']
+        if numeric.size == 0:
+            return 0.0
         
-        return safe_float(max_value)
+        # Linhas com 'total': primeiro maior valor absoluto (ordem linha a linha)
+        total_block = numeric[scan['total_rows']]
+        if total_block.size:
+            magnitudes = np.nan_to_num(np.abs(total_block), nan=0.0)
+            best = magnitudes.argmax()
+            if magnitudes.flat[best] > 0:
+                return safe_float(total_block.flat[best])
+        
+        # Fallback: máximo de cada coluna, vence o de maior módulo
+        has_values = ~np.isnan(numeric).all(axis=0)
+        if not has_values.any():
+            return 0.0
+        column_max = np.full(numeric.shape[1], np.nan)
+        column_max[has_values] = np.nanmax(numeric[:, has_values], axis=0)
+        magnitudes = np.nan_to_num(np.abs(column_max), nan=0.0)
+        best = magnitudes.argmax()
+        return safe_float(column_max[best]) if magnitudes[best] > 0 else 0.0
         
     except Exception as e:
         print(f"Erro na extração de valor: {e}")
@@ -1137,7 +3706,7 @@ def extract_total_value(df):
 def load_session_data(session_id):
     """Carrega dados da sessão do banco de dados"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
+        conn = connect_db()
         cursor = conn.cursor()
         
         # Carrega dados da sessão
@@ -1167,11 +3736,13 @@ def load_session_data(session_id):
                 processed_at ASC
         ''', (session_id,))
         files_rows = cursor.fetchall()
+        warnings_by_file = load_file_warnings(cursor, session_id)
         
         results = []
         for row in files_rows:
-            warnings = json.loads(row[12]) if row[12] else []
+            warnings = warnings_by_file.get(row[0], [])
             result = {
+                'id': row[0],
                 'filename': row[3],  # original_filename
                 'stored_filename': row[2],  # filename no disco
                 'sheet_name': row[4],
@@ -1196,100 +3767,74 @@ def load_session_data(session_id):
         print(f"Erro ao carregar sessão: {e}")
         return None, []
 
-def extract_dates_improved(df):
+def extract_dates_improved(df, scan=None):
     """Extrai datas do DataFrame com melhor formatação"""
+    import numpy as np
     try:
         emission_date = None
         due_date = None
         
         print("🔍 Procurando datas na planilha...")
         
-        # Busca em todas as células por datas
-        for idx, row in df.iterrows():
-            for col in df.columns:
-                cell_value = row[col]
-                if pd.isna(cell_value):
-                    continue
-                    
-                cell_str = str(cell_value).lower()
-                
-                # Verifica se é uma data válida
-                date_obj = None
-                try:
-                    # Tenta converter diretamente se for datetime
-                    if hasattr(cell_value, 'strftime'):
-                        date_obj = cell_value
-                    else:
-                        # Tenta vários formatos de data
-                        date_str = str(cell_value).strip()
-                        if len(date_str) >= 8:  # Pelo menos 8 caracteres para uma data
-                            for fmt in ['%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%m/%d/%Y']:
-                                try:
-                                    date_obj = datetime.strptime(date_str, fmt)
-                                    break
-                                except:
-                                    continue
-                                    
-                    if date_obj:
-                        formatted_date = date_obj.strftime('%d/%m/%Y')
-                        
-                        # Busca contexto para identificar tipo de data
-                        context = []
-                        # Verifica célula anterior e posterior
-                        if idx > 0:
-                            prev_cell = str(df.iloc[idx-1, df.columns.get_loc(col)]).lower()
-                            context.append(prev_cell)
-                        if idx < len(df) - 1:
-                            next_cell = str(df.iloc[idx+1, df.columns.get_loc(col)]).lower()
-                            context.append(next_cell)
-                        # Verifica nome da coluna
-                        context.append(str(col).lower())
-                        
-                        context_str = ' '.join(context)
-                        
-                        # Identifica se é data de emissão
-                        if any(term in context_str for term in ['emissão', 'emissao', 'emitido', 'emission']):
-                            if not emission_date:
-                                emission_date = formatted_date
-                                print(f"📅 Data de emissão encontrada: {emission_date}")
-                        
-                        # Identifica se é data de vencimento
-                        elif any(term in context_str for term in ['vencimento', 'vence', 'due', 'expir']):
-                            if not due_date:
-                                due_date = formatted_date
-                                print(f"📅 Data de vencimento encontrada: {due_date}")
-                        
-                        # Se não tem contexto específico, usa a primeira como emissão e segunda como vencimento
-                        elif not emission_date and not due_date:
-                            emission_date = formatted_date
-                            print(f"📅 Primeira data encontrada (assumindo emissão): {emission_date}")
-                        elif emission_date and not due_date:
-                            due_date = formatted_date
-                            print(f"📅 Segunda data encontrada (assumindo vencimento): {due_date}")
-                            
-                except Exception as date_error:
-                    continue
+        if scan is None:
+            scan = scan_sheet(df)
+        text = scan['text']
+        dates = scan['dates']
+        n_rows = len(df)
+        
+        # Percorre só as células com data, linha a linha
+        for idx, col_idx in np.argwhere(scan['date_mask']):
+            formatted_date = dates[idx, col_idx].strftime('%d/%m/%Y')
+            
+            # Busca contexto para identificar tipo de data:
+            # célula anterior e posterior na coluna e nome da coluna
+            context = []
+            if idx > 0:
+                context.append(text[idx - 1, col_idx])
+            if idx < n_rows - 1:
+                context.append(text[idx + 1, col_idx])
+            context.append(scan['columns_lower'][col_idx])
+            
+            context_str = ' '.join(context)
+            
+            # Identifica se é data de emissão
+            if any(term in context_str for term in ['emissão', 'emissao', 'emitido', 'emission']):
+                if not emission_date:
+                    emission_date = formatted_date
+                    print(f"📅 Data de emissão encontrada: {emission_date}")
+            
+            # Identifica se é data de vencimento
+            elif any(term in context_str for term in ['vencimento', 'vence', 'due', 'expir']):
+                if not due_date:
+                    due_date = formatted_date
+                    print(f"📅 Data de vencimento encontrada: {due_date}")
+            
+            # Se não tem contexto específico, usa a primeira como emissão e segunda como vencimento
+            elif not emission_date and not due_date:
+                emission_date = formatted_date
+                print(f"📅 Primeira data encontrada (assumindo emissão): {emission_date}")
+            elif emission_date and not due_date:
+                due_date = formatted_date
+                print(f"📅 Segunda data encontrada (assumindo vencimento): {due_date}")
+            
+            # Saída antecipada: as duas datas já foram encontradas
+            if emission_date and due_date:
+                break
         
         # Busca em colunas específicas se não encontrou
         if not emission_date or not due_date:
-            for col in df.columns:
-                col_name = str(col).lower()
-                try:
-                    if any(term in col_name for term in ['emissão', 'emissao', 'emitido']) and not emission_date:
-                        date_series = pd.to_datetime(df[col], errors='coerce')
-                        valid_date = date_series.dropna().iloc[0] if not date_series.dropna().empty else None
-                        if valid_date:
-                            emission_date = valid_date.strftime('%d/%m/%Y')
-                            print(f"📅 Data de emissão da coluna {col}: {emission_date}")
-                    
-                    if any(term in col_name for term in ['vencimento', 'vence']) and not due_date:
-                        date_series = pd.to_datetime(df[col], errors='coerce')
-                        valid_date = date_series.dropna().iloc[0] if not date_series.dropna().empty else None
-                        if valid_date:
-                            due_date = valid_date.strftime('%d/%m/%Y')
-                            print(f"📅 Data de vencimento da coluna {col}: {due_date}")
-                except:
+            for col_idx, col_name in enumerate(scan['columns_lower']):
+                column_dates = [d for d in dates[:, col_idx] if d is not None]
+                if not column_dates:
                     continue
+                
+                if any(term in col_name for term in ['emissão', 'emissao', 'emitido']) and not emission_date:
+                    emission_date = column_dates[0].strftime('%d/%m/%Y')
+                    print(f"📅 Data de emissão da coluna {df.columns[col_idx]}: {emission_date}")
+                
+                if any(term in col_name for term in ['vencimento', 'vence']) and not due_date:
+                    due_date = column_dates[0].strftime('%d/%m/%Y')
+                    print(f"📅 Data de vencimento da coluna {df.columns[col_idx]}: {due_date}")
         
         print(f"✅ Extração de datas concluída - Emissão: {emission_date}, Vencimento: {due_date}")
         return emission_date, due_date
@@ -1298,9 +3843,28 @@ def extract_dates_improved(df):
         print(f"Erro na extração de datas: {e}")
         return None, None
 
+def create_app(start_background=True):
+    """Prepara e devolve a aplicação do módulo (usada pelo servidor de desenvolvimento, pelo wsgi.py e pelo app_debug.py)
+
+    Não é uma fábrica: as rotas são registradas no `app` global deste módulo,
+    então toda chamada devolve o mesmo objeto e a mesma configuração. Quem
+    precisa ajustar a configuração altera `app.config` diretamente. Inicializa
+    pastas e banco (uma vez por processo) e inicia o coletor de arquivos. Com
+    servidores que fazem fork depois de carregar a aplicação (gunicorn
+    --preload), o coletor é iniciado de novo no primeiro request de cada worker.
+    """
+    app.secret_key = os.environ.get('SECRET_KEY', app.secret_key)
+
+    init_storage()
+    if start_background:
+        start_file_gc()
+        if start_file_gc not in app.before_request_funcs.get(None, []):
+            app.before_request(start_file_gc)
+    return app
+
 if __name__ == '__main__':
     print("🚀 Iniciando Sistema Financeiro com Datas Melhoradas...")
     print("📍 Acesse: http://localhost:5000")
     print("💾 Banco de dados: financial_reports.db")
     print("📅 Formatação de datas: dd/mm/aaaa")
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    create_app().run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
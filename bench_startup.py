@@ -0,0 +1,87 @@
+"""Benchmark de inicialização: import, create_app e primeiros requests de um worker novo
+
+Cada rodada sobe um processo Python novo (como um worker recém-criado) que mede:
+  import app     - custo de importar o módulo (não deve carregar pandas/openpyxl)
+  create_app     - pastas + banco
+  GET <url>      - primeiro request de cada URL (padrão: a home)
+  process_file   - primeira planilha processada (--file), quando o pandas é carregado
+e informa quais módulos pesados já estavam carregados depois de cada etapa.
+
+Uso: python bench_startup.py [--runs N] [--url /dashboard/ID ...] [--file planilha.xlsx]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ('pandas', 'numpy', 'openpyxl')
+
+def heavy_modules_loaded():
+    return [name for name in HEAVY_MODULES if name in sys.modules]
+
+def measure_worker(urls, filepath=None):
+    """Executado no processo filho: mede cada etapa e imprime uma linha JSON"""
+    steps = []
+
+    def step(name, started):
+        steps.append({'step': name, 'seconds': time.perf_counter() - started, 'loaded': heavy_modules_loaded()})
+
+    started = time.perf_counter()
+    import app as application
+    step('import app', started)
+
+    started = time.perf_counter()
+    application.create_app(start_background=False)
+    step('create_app', started)
+
+    client = application.app.test_client()
+    for url in urls:
+        started = time.perf_counter()
+        response = client.get(url)
+        response.close()
+        step(f'GET {url} ({response.status_code})', started)
+
+    if filepath:
+        started = time.perf_counter()
+        application.process_file(filepath, os.path.basename(filepath))
+        step('process_file', started)
+
+    print(json.dumps(steps))
+
+def run_worker(urls, filepath):
+    """Sobe um processo novo medindo a inicialização e devolve as etapas"""
+    command = [sys.executable, os.path.abspath(__file__), '--child']
+    for url in urls:
+        command += ['--url', url]
+    if filepath:
+        command += ['--file', filepath]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    # As rotas imprimem logs; a medição é a última linha
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Mede o tempo de inicialização de um worker')
+    parser.add_argument('--runs', type=int, default=5, help='número de processos novos a medir')
+    parser.add_argument('--url', action='append', help='URL do primeiro request (pode repetir; padrão: /)')
+    parser.add_argument('--file', help='planilha para medir o primeiro processamento')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    urls = args.url or ['/']
+
+    if args.child:
+        measure_worker(urls, args.file)
+        return
+
+    runs = [run_worker(urls, args.file) for _ in range(args.runs)]
+
+    print(f"⏱️ Inicialização de worker ({args.runs} processo(s) novo(s), mediana)")
+    for index, first in enumerate(runs[0]):
+        seconds = [run[index]['seconds'] * 1000 for run in runs]
+        loaded = ', '.join(first['loaded']) or '-'
+        print(f"   {first['step']:<40} {statistics.median(seconds):8.1f} ms   (máx {max(seconds):.1f} ms)   carregados: {loaded}")
+
+if __name__ == '__main__':
+    main()
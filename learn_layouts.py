@@ -0,0 +1,73 @@
+"""Aprende layouts de planilha a partir de arquivos já processados com sucesso
+
+Percorre processed_files (qualidade 'good', arquivo original ainda em uploads/)
+e registra a posição do total e das datas de cada layout. Um layout passa a
+usar a via rápida depois de LAYOUT_MIN_CONFIRMATIONS arquivos concordantes.
+
+Uso: python learn_layouts.py [--session SESSION_ID] [--limit N]
+"""
+import argparse
+import os
+
+from app import (UPLOAD_FOLDER, LAYOUT_MIN_CONFIRMATIONS, connect_db, init_storage,
+                 learn_layout_template)
+
+def main():
+    parser = argparse.ArgumentParser(description='Aprende layouts de planilha de arquivos processados')
+    parser.add_argument('--session', help='limita a uma sessão')
+    parser.add_argument('--limit', type=int, default=None, help='número máximo de arquivos')
+    args = parser.parse_args()
+
+    init_storage()
+    conn = connect_db()
+    cursor = conn.cursor()
+    query = '''
+        SELECT filename, sheet_name, total_value, emission_date, due_date
+        FROM processed_files
+        WHERE success = 1 AND data_quality = 'good' AND filename LIKE '%.xlsx'
+    '''
+    params = []
+    if args.session:
+        query += ' AND session_id = ?'
+        params.append(args.session)
+    query += ' ORDER BY id DESC'
+    if args.limit:
+        query += ' LIMIT ?'
+        params.append(args.limit)
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+    conn.close()
+
+    learned = 0
+    seen = set()
+    for filename, sheet_name, total_value, emission_date, due_date in rows:
+        filepath = os.path.join(UPLOAD_FOLDER, filename)
+        # Sessões duplicadas compartilham o mesmo arquivo; conta cada um só uma vez
+        if filename in seen or not os.path.isfile(filepath):
+            continue
+        seen.add(filename)
+
+        fingerprint = learn_layout_template(filepath, {
+            'success': True,
+            'sheet_name': sheet_name,
+            'total_value': total_value,
+            'emission_date': emission_date,
+            'due_date': due_date
+        })
+        if fingerprint:
+            learned += 1
+            print(f"📐 {filename}: layout {fingerprint[:8]}")
+
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT COUNT(*), COALESCE(SUM(CASE WHEN confirmations >= ? AND conflicts = 0 THEN 1 ELSE 0 END), 0)
+        FROM layout_templates
+    ''', (LAYOUT_MIN_CONFIRMATIONS,))
+    total_layouts, active_layouts = cursor.fetchone()
+    conn.close()
+
+    print(f"✅ {learned} arquivo(s) analisados; {active_layouts} de {total_layouts} layout(s) ativos na via rápida")
+
+if __name__ == '__main__':
+    main()
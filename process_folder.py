@@ -0,0 +1,139 @@
+"""Processamento em lote de uma pasta de planilhas, sem servidor web
+
+Processa todos os arquivos aceitos de uma pasta em paralelo (pool de
+processos isolados), grava o resultado como uma nova sessão, exporta
+opcionalmente em CSV/XLSX e imprime um resumo de tempos. Com --dry-run nada é gravado no banco
+nem copiado para uploads/, o que permite usar o script como benchmark sobre
+dados reais.
+
+Uso: python process_folder.py PASTA [--workers N] [--export saida.xlsx] [--dry-run]
+"""
+import argparse
+import os
+import time
+import uuid
+from concurrent.futures import as_completed
+
+import numpy as np
+
+from app import (ALLOWED_EXTENSIONS, PARSE_MEMORY_LIMIT_MB, PARSE_TIMEOUT_SECONDS, PARSE_WORKER_MAX_TASKS,
+                 build_error_result, collect_upload_results, init_storage, preload_parsing_modules,
+                 process_upload, save_session, store_local_file, write_export)
+from worker_pool import IsolatedWorkerPool
+
+def list_spreadsheets(folder, recursive=False):
+    """Caminhos das planilhas aceitas na pasta, em ordem alfabética"""
+    paths = []
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.')) if recursive else []
+        for name in sorted(files):
+            if name.startswith(('.', '~$')) or not name.lower().endswith(ALLOWED_EXTENSIONS):
+                continue
+            paths.append(os.path.join(root, name))
+    return paths
+
+def timed_process_upload(filepath, filename, multi_sheet=False):
+    """process_upload medindo o tempo de processamento do arquivo no worker"""
+    started = time.perf_counter()
+    results = process_upload(filepath, filename, multi_sheet)
+    elapsed = time.perf_counter() - started
+    for result in results:
+        result['processing_time'] = elapsed
+        # Chave do resumo: o nome pode repetir (subpastas) e ganha " [aba]" com multi_sheet
+        result['source_path'] = filepath
+        result['source_filename'] = filename
+    return results
+
+def run_dry(paths, executor, multi_sheet):
+    """Processa os arquivos no lugar, sem gravar nada"""
+    futures = {
+        executor.submit(timed_process_upload, path, os.path.basename(path), multi_sheet): path
+        for path in paths
+    }
+    results = []
+    for future in as_completed(futures):
+        try:
+            results.extend(future.result())
+        except Exception as e:
+            results.append(build_error_result(os.path.basename(futures[future]), str(e)))
+    return results
+
+def run_session(paths, executor, multi_sheet, title, description):
+    """Copia os arquivos para uploads/ e grava uma nova sessão"""
+    session_id = str(uuid.uuid4())
+    pending = []
+    for path in paths:
+        upload_info = store_local_file(path)
+        future = executor.submit(timed_process_upload, upload_info['filepath'], upload_info['filename'], multi_sheet)
+        pending.append((upload_info, future))
+
+    results, successful_files, total_value = collect_upload_results(session_id, pending)
+    save_session(session_id, title, description, successful_files, total_value)
+    return session_id, results
+
+def print_timing_summary(results, file_count, wall_time, workers):
+    """Resumo de tempos: vazão, distribuição por arquivo e arquivos mais lentos"""
+    per_file = {}
+    for result in results:
+        if 'processing_time' in result:
+            per_file[result['source_path']] = (result['source_filename'], result['processing_time'])
+    times = np.array([elapsed for _, elapsed in per_file.values()], dtype=np.float64)
+    successful = sum(1 for r in results if r.get('success'))
+
+    print("\n⏱️ Resumo de tempos")
+    print(f"   Arquivos: {file_count} | Resultados: {len(results)} ({successful} com sucesso)")
+    print(f"   Tempo total: {wall_time:.2f}s com {workers} worker(s) | {file_count / wall_time if wall_time else 0:.1f} arquivos/s")
+    if times.size:
+        p50, p95 = np.percentile(times, [50, 95])
+        cpu_time = times.sum()
+        print(f"   Por arquivo: mín {times.min():.3f}s | mediana {p50:.3f}s | p95 {p95:.3f}s | máx {times.max():.3f}s")
+        print(f"   Soma dos tempos: {cpu_time:.2f}s | paralelismo efetivo {cpu_time / wall_time if wall_time else 0:.1f}x")
+        slowest = sorted(per_file.values(), key=lambda item: item[1], reverse=True)[:5]
+        print("   Mais lentos:")
+        for name, elapsed in slowest:
+            print(f"     {elapsed:.3f}s  {name}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Processa uma pasta de planilhas em lote')
+    parser.add_argument('folder', help='pasta com as planilhas')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='processos de processamento')
+    parser.add_argument('--title', help='título da sessão (padrão: nome da pasta)')
+    parser.add_argument('--description', default='', help='descrição da sessão')
+    parser.add_argument('--export', help='arquivo de saída .csv ou .xlsx')
+    parser.add_argument('--recursive', action='store_true', help='inclui subpastas')
+    parser.add_argument('--multi-sheet', action='store_true', help='processa todas as abas mensais de cada planilha')
+    parser.add_argument('--dry-run', action='store_true', help='não grava sessão nem copia arquivos (benchmark)')
+    args = parser.parse_args()
+
+    paths = list_spreadsheets(args.folder, args.recursive)
+    if not paths:
+        print(f"❌ Nenhuma planilha encontrada em {args.folder}")
+        return 1
+
+    init_storage()
+
+    title = args.title or os.path.basename(os.path.abspath(args.folder))
+    print(f"📂 {len(paths)} planilha(s) em {args.folder} | {args.workers} worker(s)")
+
+    started = time.perf_counter()
+    with IsolatedWorkerPool(args.workers, PARSE_TIMEOUT_SECONDS, PARSE_MEMORY_LIMIT_MB, PARSE_WORKER_MAX_TASKS,
+                            initializer=preload_parsing_modules,
+                            preload_modules=('app', 'pandas', 'openpyxl')) as executor:
+        if args.dry_run:
+            results = run_dry(paths, executor, args.multi_sheet)
+        else:
+            session_id, results = run_session(paths, executor, args.multi_sheet, title, args.description)
+            print(f"💾 Sessão {session_id}")
+    wall_time = time.perf_counter() - started
+
+    if args.export:
+        export_format = 'csv' if args.export.lower().endswith('.csv') else 'xlsx'
+        ordered = sorted(results, key=lambda r: (r.get('year') or 0, r.get('month') or 0, r.get('filename') or ''))
+        write_export(ordered, args.export, export_format)
+        print(f"📤 Exportado: {args.export}")
+
+    print_timing_summary(results, len(paths), wall_time, args.workers)
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
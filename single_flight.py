@@ -0,0 +1,59 @@
+"""Coalescência de trabalho concorrente idêntico (single-flight)
+
+Quando várias threads pedem o mesmo cálculo ao mesmo tempo (mesma chave),
+só a primeira executa; as demais esperam e recebem o mesmo resultado (ou a
+mesma exceção). Nada fica em cache: assim que o cálculo termina a chave é
+liberada e a próxima chamada executa de novo, com dados atualizados.
+
+O resultado é compartilhado entre os chamadores, que não devem alterá-lo.
+Vale dentro de um processo; workers diferentes do servidor não se enxergam.
+"""
+import threading
+from concurrent.futures import Future
+
+class SingleFlight:
+    """Grupo de chamadas em andamento, indexadas por uma chave hashable"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """Executa fn(*args, **kwargs), ou espera a execução já em andamento para a mesma chave"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+
+        if not leader:
+            return call.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def submit(self, key, start):
+        """Versão assíncrona: devolve o Future em andamento para a chave ou o criado por start()"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future
+            future = self._calls[key] = start()
+
+        # Fora do lock: se o future já terminou, o callback roda aqui mesmo
+        future.add_done_callback(lambda done: self._release(key, done))
+        return future
+
+    def _release(self, key, future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
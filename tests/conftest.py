@@ -0,0 +1,39 @@
+"""Fixtures compartilhadas: banco e pastas isolados em um diretório temporário"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as application
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """Banco e uploads/ novos em tmp_path (os caminhos do app são relativos ao diretório atual)"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(application, 'storage_initialized', False)
+    application.reset_layout_templates_cache()
+    application.init_storage()
+    yield tmp_path
+    application.reset_layout_templates_cache()
+
+
+@pytest.fixture
+def client(storage):
+    application.app.config['TESTING'] = True
+    return application.app.test_client()
+
+
+def write_workbook(path, rows, sheet_name='Relatório'):
+    """Grava um .xlsx com as linhas informadas na aba indicada"""
+    from openpyxl import Workbook
+
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.title = sheet_name
+    for row in rows:
+        worksheet.append(row)
+    workbook.save(path)
+    return str(path)
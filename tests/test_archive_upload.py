@@ -0,0 +1,80 @@
+"""Extração de ZIPs enviados (expand_archive_upload)"""
+import os
+import zipfile
+
+import app as application
+
+
+def make_archive(path, members):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+        for name, content in members:
+            archive.writestr(name, content)
+    return {'filename': os.path.basename(path), 'filepath': str(path)}
+
+
+def csv_members(count):
+    return [(f'mes_{i:04d}.csv', f'Item;Valor\nTotal;{i + 1}\n') for i in range(count)]
+
+
+def events(archive_info, budget=None):
+    collected = {'file': [], 'rejected': [], 'failed': []}
+    for kind, payload in application.expand_archive_upload(archive_info, budget):
+        collected[kind].append(payload)
+    return collected
+
+
+def test_large_archive_is_not_capped_by_files_per_request(storage):
+    archive = make_archive(storage / 'many.zip', csv_members(500))
+    budget = application.new_upload_budget()
+    budget['files'] = application.MAX_UPLOAD_FILES - 1  # outros arquivos do mesmo envio
+
+    result = events(archive, budget)
+    assert len(result['file']) == 500
+    assert result['rejected'] == []
+    assert not os.path.exists(archive['filepath'])
+
+
+def test_members_limit_is_per_archive(storage, monkeypatch):
+    monkeypatch.setattr(application, 'MAX_ARCHIVE_MEMBERS', 3)
+    budget = application.new_upload_budget()
+
+    first = events(make_archive(storage / 'a.zip', csv_members(5)), budget)
+    second = events(make_archive(storage / 'b.zip', csv_members(2)), budget)
+
+    assert len(first['file']) == 3
+    assert len(first['rejected']) == 1
+    assert '2 item(ns) restante(s)' in first['rejected'][0]['filename']
+    assert len(second['file']) == 2
+
+
+def test_byte_budget_is_shared_across_the_request(storage, monkeypatch):
+    member_size = len(csv_members(1)[0][1])
+    monkeypatch.setattr(application, 'MAX_UPLOAD_REQUEST_SIZE', member_size * 3)
+    budget = application.new_upload_budget()
+
+    first = events(make_archive(storage / 'a.zip', csv_members(2)), budget)
+    second = events(make_archive(storage / 'b.zip', csv_members(2)), budget)
+
+    assert len(first['file']) + len(second['file']) == 3
+    assert 'MB por envio' in second['rejected'][-1]['reason']
+
+
+def test_corrupted_member_fails_without_leaving_partial_file(storage):
+    path = storage / 'broken.zip'
+    make_archive(path, [('ok.csv', 'Item;Valor\nTotal;10\n'), ('bad.csv', 'Item;Valor\nTotal;20\n' * 50)])
+    # Corrompe os dados do segundo membro (CRC não confere na leitura)
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo('bad.csv')
+    data = bytearray(path.read_bytes())
+    data_start = info.header_offset + 30 + len(info.filename) + len(info.extra)
+    data[data_start + 5] ^= 0xFF
+    path.write_bytes(bytes(data))
+    before = set(os.listdir(application.UPLOAD_FOLDER))
+
+    result = events({'filename': 'broken.zip', 'filepath': str(path)})
+
+    assert [member['filename'] for member in result['file']] == ['ok.csv']
+    assert [member['filename'] for member in result['failed']] == ['bad.csv']
+    assert 'corrompido' in result['failed'][0]['error']
+    created = set(os.listdir(application.UPLOAD_FOLDER)) - before
+    assert created == {result['file'][0]['stored_filename']}
@@ -0,0 +1,60 @@
+"""Exportação em ZIP de várias sessões (stream_bulk_export)"""
+import csv
+import io
+import zipfile
+
+from openpyxl import load_workbook
+
+import app as application
+
+
+def create_session(session_id, title, periods):
+    """Sessão com um arquivo processado por (mês, ano, valor)"""
+    for month, year, value in periods:
+        application.save_processed_file(session_id, {
+            'filename': f'{month:02d}-{year}.xlsx', 'sheet_name': 'Relatório', 'total_value': value,
+            'month': month, 'year': year, 'success': True, 'warnings': [], 'data_quality': 'good'
+        })
+    application.save_session(session_id, title, '', len(periods), sum(value for _, _, value in periods))
+
+
+def bulk_export(client, session_ids, export_format):
+    response = client.get(f"/export/bulk?session_id={','.join(session_ids)}&format={export_format}")
+    assert response.status_code == 200
+    return zipfile.ZipFile(io.BytesIO(response.data))
+
+
+def test_empty_session_does_not_truncate_archive(client):
+    create_session('s-empty', 'Vazia', [])
+    create_session('s-full', 'Cheia', [(2, 2024, 100.0)])
+
+    archive = bulk_export(client, ['s-empty', 's-full'], 'csv')
+    assert archive.testzip() is None
+    assert sorted(archive.namelist()) == ['Cheia.csv', 'Vazia.csv', 'consolidado.csv']
+
+    empty_rows = list(csv.reader(io.StringIO(archive.read('Vazia.csv').decode('utf-8-sig'))))
+    assert empty_rows == [application.EXPORT_COLUMNS]
+    consolidated = list(csv.reader(io.StringIO(archive.read('consolidado.csv').decode('utf-8-sig'))))
+    assert consolidated[0] == ['Sessão'] + application.EXPORT_COLUMNS
+    assert [row[0] for row in consolidated[1:]] == ['Cheia']
+
+
+def test_summary_is_in_date_order(client):
+    create_session('s-a', 'A', [(11, 2023, 1.0), (2, 2024, 2.0)])
+    create_session('s-b', 'B', [(10, 2024, 3.0), (1, 2024, 4.0)])
+    create_session('s-empty', 'Vazia', [])
+
+    archive = bulk_export(client, ['s-a', 's-empty', 's-b'], 'xlsx')
+    expected = ['11/2023', '01/2024', '02/2024', '10/2024']
+
+    consolidated = load_workbook(io.BytesIO(archive.read('consolidado.xlsx')), read_only=True)
+    summary = [row[0] for row in consolidated['Resumo'].iter_rows(min_row=2, values_only=True)]
+    assert summary == expected
+
+    session = load_workbook(io.BytesIO(archive.read('B.xlsx')), read_only=True)
+    assert [row[0] for row in session['Resumo'].iter_rows(min_row=2, values_only=True)] == ['01/2024', '10/2024']
+
+
+def test_export_period_key_puts_unknown_last():
+    periods = ['-', '12/2023', '01/2024', '02/2023']
+    assert sorted(periods, key=application.export_period_key) == ['02/2023', '12/2023', '01/2024', '-']
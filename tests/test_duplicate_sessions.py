@@ -0,0 +1,57 @@
+"""Sessões duplicadas fora do histórico por período (period_statistics)"""
+import app as application
+
+
+def create_session(session_id, title, stored_filename, total_value=1000.0):
+    application.save_processed_file(session_id, {
+        'filename': 'Relatório Março 2024.xlsx', 'sheet_name': 'Total Mês', 'total_value': total_value,
+        'month': 3, 'year': 2024, 'success': True, 'warnings': [], 'data_quality': 'good'
+    }, stored_filename)
+    application.save_session(session_id, title, '', 1, total_value)
+
+
+def history_count():
+    return application.load_period_history().get((2024, 3), (0, 0, 0))[0]
+
+
+def duplicate(client, session_id):
+    response = client.get(f'/duplicate_session/{session_id}')
+    return response.headers['Location'].rsplit('/', 1)[1]
+
+
+def test_duplicated_session_is_counted_once(client):
+    create_session('s1', 'Março', 'a.xlsx')
+    copy_id = duplicate(client, 's1')
+    duplicate(client, copy_id)
+
+    assert history_count() == 1
+    # O gráfico da própria cópia continua com os arquivos dela
+    conn = application.connect_db()
+    assert conn.execute('SELECT file_count FROM session_period_totals WHERE session_id = ?',
+                        (copy_id,)).fetchone() == (1,)
+    conn.close()
+
+
+def test_deleting_the_original_keeps_the_copy_in_history(client):
+    create_session('s1', 'Março', 'a.xlsx')
+    copy_id = duplicate(client, 's1')
+
+    client.post('/delete_session/s1')
+    assert history_count() == 1
+
+    client.post(f'/delete_session/{copy_id}')
+    assert history_count() == 0
+
+
+def test_renamed_legacy_copy_is_backfilled(storage):
+    create_session('s1', 'Março', 'a.xlsx')
+    # Cópia feita antes de duplicated_from existir (mesmo arquivo e aba) e depois renomeada
+    create_session('s2', 'Março revisado', 'a.xlsx')
+    assert history_count() == 2
+
+    application.init_database()
+    assert history_count() == 1
+
+    create_session('s3', 'Abril', 'b.xlsx')
+    application.init_database()
+    assert history_count() == 2
@@ -0,0 +1,51 @@
+"""Telemetria dos arquivos que falham: erro na extração e tempo limite do worker"""
+import time
+
+import pytest
+
+import app as application
+from worker_pool import IsolatedWorkerPool, WorkerTimeout, report_progress
+
+
+def slow_task():
+    report_progress('load')
+    time.sleep(30)
+
+
+def test_timeout_carries_elapsed_time_and_last_stage():
+    with IsolatedWorkerPool(1, timeout=1) as pool:
+        future = pool.submit(slow_task)
+        with pytest.raises(WorkerTimeout) as raised:
+            future.result()
+    assert raised.value.last_stage == 'load'
+    assert raised.value.elapsed_ms >= 1000
+
+
+def test_extraction_error_records_telemetry(storage):
+    path = storage / 'quebrado.xlsx'
+    path.write_bytes(b'nao e uma planilha')
+
+    result = application.process_file(str(path), 'quebrado.xlsx')
+    assert not result['success']
+    assert result['telemetry']['last_stage'] == 'load'
+    assert result['telemetry']['failure']
+    assert result['telemetry']['total_ms'] >= 0
+
+
+def test_failed_files_reach_slow_files(client):
+    timed_out = application.Future()
+    error = WorkerTimeout('tempo limite de 120s excedido')
+    error.elapsed_ms, error.last_stage = 120000.0, 'load'
+    timed_out.set_exception(error)
+
+    application.collect_upload_results('s1', [
+        ({'filename': 'enorme.xlsx', 'stored_filename': 'x.xlsx', 'file_hash': 'h', 'file_size': 50 * 1024 * 1024},
+         timed_out)
+    ])
+
+    slow = client.get('/api/slow_files').get_json()['slow_files']
+    assert len(slow) == 1
+    assert slow[0]['filename'] == 'enorme.xlsx'
+    assert slow[0]['total_ms'] == 120000.0
+    assert slow[0]['file_size'] == 50 * 1024 * 1024
+    assert (slow[0]['last_stage'], slow[0]['failure']) == ('load', 'WorkerTimeout')
@@ -0,0 +1,61 @@
+"""Via rápida de layouts conhecidos (layout_templates)"""
+from datetime import datetime
+
+import app as application
+from conftest import write_workbook
+
+
+def report_rows(items):
+    """Exportação de ERP: cabeçalho fixo, itens e a linha de total"""
+    rows = [
+        ['Relatório de Cobrança', None, None, None, None],
+        ['Emissão', datetime(2024, 3, 8), None, None, None],
+        ['Vencimento', datetime(2024, 4, 8), None, None, None],
+        [None, None, None, None, None],
+        ['Item', 'Descrição', 'Qtd', 'Unitário', 'Valor'],
+    ]
+    rows += [[f'{i}', 'Serviço', 1, value, value] for i, value in enumerate(items, start=1)]
+    rows.append(['Total', None, None, None, float(sum(items))])
+    return rows
+
+
+def learn_from(tmp_path, name, items):
+    path = write_workbook(tmp_path / name, report_rows(items))
+    result = application.process_file(path, 'Cobrança Março 2024.xlsx')
+    assert result['success'] and result['telemetry']['engine'] != 'openpyxl-layout'
+    return path, application.learn_layout_template(path, result)
+
+
+def test_learns_cell_of_labelled_total_row(storage):
+    path, fingerprint = learn_from(storage, 'a.xlsx', [1000.0, 2000.0, 3000.0])
+    assert fingerprint
+    learn_from(storage, 'b.xlsx', [1500.0, 2500.0, 3500.0])
+
+    templates = application.get_layout_templates()
+    assert templates[fingerprint]['total_cell'] == 'E9'
+
+    result = application.process_file(path, 'Cobrança Março 2024.xlsx')
+    assert result['telemetry']['engine'] == 'openpyxl-layout'
+    assert result['total_value'] == 6000.0
+
+
+def test_more_line_items_fall_back_to_generic_scan(storage):
+    learn_from(storage, 'a.xlsx', [1000.0, 2000.0, 3000.0])
+    learn_from(storage, 'b.xlsx', [1500.0, 2500.0, 3500.0])
+
+    # Mesmo cabeçalho, mais itens: a célula registrada (E9) agora é um item
+    longer = write_workbook(storage / 'c.xlsx', report_rows([1000.0, 2000.0, 3000.0, 4000.0, 5000.0]))
+    assert application.read_known_layout(longer) is None
+
+    result = application.process_file(longer, 'Cobrança Março 2024.xlsx')
+    assert result['telemetry']['engine'] != 'openpyxl-layout'
+    assert result['total_value'] == 15000.0
+
+
+def test_total_without_label_row_is_not_learned(storage):
+    rows = report_rows([1000.0, 2000.0, 3000.0])
+    rows[-1][0] = 'Soma'
+    path = write_workbook(storage / 'a.xlsx', rows)
+    result = application.process_file(path, 'Cobrança Março 2024.xlsx')
+    assert result['success']
+    assert application.learn_layout_template(path, result) is None
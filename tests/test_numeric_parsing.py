@@ -0,0 +1,42 @@
+"""Conversão de colunas numéricas no formato brasileiro (parse_numeric_column)"""
+import math
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import app as application
+
+
+def parse(values, dtype=None):
+    return list(application.parse_numeric_column(pd.Series(values, dtype=dtype)))
+
+
+def test_thousands_notation_has_the_same_magnitude_with_or_without_prefix():
+    assert parse(['1.234', 'R$ 1.234', '1.234.567']) == [1234.0, 1234.0, 1234567.0]
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('1.234,56', 1234.56),
+    ('R$ 12.345,00', 12345.0),
+    ('(1.234,50)', -1234.5),
+    ('- R$ 1.234', -1234.0),
+    ('12,5', 12.5),
+    ('1234.56', 1234.56),
+    ('0.5', 0.5),
+])
+def test_single_values(text, expected):
+    assert parse([text]) == [expected]
+
+
+def test_text_and_other_types_in_the_same_column():
+    values = parse(['1.234', 'Total', None, 1.5, datetime(2024, 3, 1)])
+    assert values[0] == 1234.0
+    assert math.isnan(values[1]) and math.isnan(values[2])
+    assert values[3] == 1.5
+    assert math.isnan(values[4])
+
+
+def test_string_and_category_columns():
+    assert parse(['1.234', '2.000'], dtype='str') == [1234.0, 2000.0]
+    assert parse(['1.234', '1.234', '9,5'], dtype='category') == [1234.0, 1234.0, 9.5]
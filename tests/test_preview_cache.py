@@ -0,0 +1,76 @@
+"""Janela de pré-visualização servida pelo cache de linhas (read_sheet_window)"""
+import os
+
+import pytest
+
+import app as application
+from conftest import write_workbook
+
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    monkeypatch.setattr(application, 'PREVIEW_CACHE_BLOCK_ROWS', 100)
+
+
+@pytest.fixture
+def sheet(storage, small_blocks):
+    rows = [['Item', 'Valor', 'Obs']] + [[i, i * 1.5, f'linha {i + 1}'] for i in range(1, 249)]
+    rows.append(['Total', 999.0, None])
+    path = write_workbook(storage / application.UPLOAD_FOLDER / 'big.xlsx', rows, sheet_name='Dados')
+    return path, rows
+
+
+@pytest.mark.parametrize('min_row, max_row', [(1, 5), (95, 105), (246, 300), (400, 450)])
+def test_window_matches_sheet(sheet, min_row, max_row):
+    path, rows = sheet
+    window, total_rows, total_cols = application.read_sheet_window(path, 'Dados', min_row, max_row, 2, 4)
+
+    expected = [row[1:3] + [None] for row in rows[min_row - 1:max_row]]
+    assert window == expected
+    assert (total_rows, total_cols) == (250, 3)
+
+
+def test_sheet_is_parsed_only_once(sheet, monkeypatch):
+    path, rows = sheet
+    application.read_sheet_window(path, 'Dados', 1, 10, 1, 3)
+
+    def fail(*args):
+        raise AssertionError('a planilha foi lida de novo')
+    monkeypatch.setattr(application, 'iter_sheet_rows', fail)
+
+    window, _, _ = application.read_sheet_window(path, 'Dados', 250, 260, 1, 2)
+    assert window == [['Total', 999.0]]
+
+
+def test_csv_window(storage, small_blocks):
+    path = storage / application.UPLOAD_FOLDER / 'dados.csv'
+    path.write_text('Item;Valor\n' + ''.join(f'{i};{i * 2}\n' for i in range(1, 150)), encoding='utf-8')
+
+    window, total_rows, _ = application.read_sheet_window(str(path), None, 100, 102, 1, 1)
+    assert window == [['99;198'], ['100;200'], ['101;202']]
+    assert total_rows == 150
+
+
+def test_cache_is_removed_with_the_upload(sheet):
+    path, _ = sheet
+    application.read_sheet_window(path, 'Dados', 1, 1, 1, 1)
+    assert os.path.isdir(path + application.PREVIEW_CACHE_SUFFIX)
+
+    application.remove_upload_file(os.path.basename(path))
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + application.PREVIEW_CACHE_SUFFIX)
+
+
+def test_preview_api_highlights_total_at_the_bottom(client, sheet):
+    path, _ = sheet
+    application.save_processed_file('s1', {
+        'filename': 'Relatório Março 2024.xlsx', 'sheet_name': 'Dados', 'total_value': 999.0,
+        'month': 3, 'year': 2024, 'success': True, 'warnings': [], 'data_quality': 'good'
+    }, os.path.basename(path))
+    application.save_session('s1', 'Sessão', '', 1, 999.0)
+    file_id = application.connect_db().execute('SELECT id FROM processed_files').fetchone()[0]
+
+    response = client.get(f'/api/file/{file_id}/preview?row_start=241&rows=20')
+    data = response.get_json()
+    assert response.status_code == 200
+    assert {'cell': 'B250', 'row': 250, 'type': 'total_value'} in data['highlights']
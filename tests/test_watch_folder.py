@@ -0,0 +1,39 @@
+"""Destino dos arquivos da pasta monitorada (ingest_batch)"""
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import watch_folder
+
+
+def make_zip(path, members):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+        for name, content in members:
+            archive.writestr(name, content)
+    return str(path)
+
+
+def test_partially_imported_archive_goes_to_processed(storage, tmp_path):
+    folder = tmp_path / 'entrada'
+    folder.mkdir()
+    archive = make_zip(folder / 'lote.zip', [('mes_01.csv', 'Item;Valor\nTotal;100\n'),
+                                             ('quebrado.xlsx', b'isto nao e uma planilha')])
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        session_id = watch_folder.ingest_batch(str(folder), [archive], executor)
+
+    assert session_id is not None
+    assert os.listdir(folder / watch_folder.PROCESSED_SUBFOLDER) == ['lote.zip']
+    assert not os.path.exists(folder / watch_folder.ERROR_SUBFOLDER)
+
+
+def test_archive_without_imported_members_goes_to_errors(storage, tmp_path):
+    folder = tmp_path / 'entrada'
+    folder.mkdir()
+    archive = make_zip(folder / 'ruim.zip', [('quebrado.xlsx', b'isto nao e uma planilha')])
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        watch_folder.ingest_batch(str(folder), [archive], executor)
+
+    assert os.listdir(folder / watch_folder.ERROR_SUBFOLDER) == ['ruim.zip']
+    assert not os.path.exists(folder / watch_folder.PROCESSED_SUBFOLDER)
@@ -0,0 +1,123 @@
+"""Estatísticas vetorizadas dos valores extraídos (NumPy)
+
+Usado pelo relatório de qualidade para descrever os valores de uma sessão e
+detectar valores atípicos de forma robusta: quartis/IQR, z-score baseado em
+MAD e linha de base sazonal por mês de referência.
+"""
+import numpy as np
+
+# Torna o MAD comparável ao desvio padrão em dados normais (Iglewicz & Hoaglin)
+MAD_SCALE = 0.6745
+# Equivalente para o desvio absoluto médio, usado quando o MAD é zero
+MEAN_AD_SCALE = 0.7979
+ROBUST_Z_THRESHOLD = 3.5
+IQR_FENCE = 1.5
+MIN_SAMPLES = 4
+MIN_SEASONAL_SAMPLES = 3
+
+def robust_z_scores(values, center=None):
+    """Z-score robusto: 0,6745 * (x - mediana) / MAD
+
+    Quando mais da metade dos valores é igual (MAD = 0) usa o desvio
+    absoluto médio; se também for zero, todos os scores são zero.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        return values
+    if center is None:
+        center = np.median(values)
+
+    deviations = np.abs(values - center)
+    mad = np.median(deviations)
+    if mad > 0:
+        return MAD_SCALE * (values - center) / mad
+
+    mean_ad = deviations.mean()
+    if mean_ad > 0:
+        return MEAN_AD_SCALE * (values - center) / mean_ad
+
+    return np.zeros_like(values)
+
+def seasonal_baselines(values, months):
+    """Mediana e MAD por mês de referência
+
+    Retorna ({mês: {'count', 'median', 'mad'}}, z-scores de cada valor em
+    relação à linha de base do seu mês). Meses com menos de
+    MIN_SEASONAL_SAMPLES valores ficam com z-score zero.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    months = np.asarray(months, dtype=np.int64)
+    seasonal_z = np.zeros_like(values)
+    baselines = {}
+
+    for month in np.unique(months[months > 0]):
+        mask = months == month
+        month_values = values[mask]
+        median = float(np.median(month_values))
+        mad = float(np.median(np.abs(month_values - median)))
+        baselines[int(month)] = {'count': int(mask.sum()), 'median': median, 'mad': mad}
+        if month_values.size >= MIN_SEASONAL_SAMPLES:
+            seasonal_z[mask] = robust_z_scores(month_values, median)
+
+    return baselines, seasonal_z
+
+def analyze_values(values, months=None):
+    """Descreve um conjunto de valores e marca os atípicos
+
+    `values` são os totais extraídos e `months` (opcional) o mês de referência
+    de cada valor (0 ou None quando desconhecido). Retorna None para entrada
+    vazia ou um dicionário com:
+      statistics        - count, total, average, median, q1, q3, iqr, mad, std, min, max
+      robust_z          - z-score robusto de cada valor
+      outliers          - máscara de valores com |z robusto| > ROBUST_Z_THRESHOLD
+      iqr_outliers      - máscara de valores fora de [Q1 - 1,5·IQR, Q3 + 1,5·IQR]
+      seasonal          - linha de base por mês (ver seasonal_baselines)
+      seasonal_outliers - máscara de valores atípicos para o próprio mês
+    """
+    values = np.asarray(values, dtype=np.float64)
+    count = values.size
+    if count == 0:
+        return None
+
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    total = values.sum()
+
+    statistics = {
+        'count': int(count),
+        'total': float(total),
+        'average': float(total / count),
+        'median': float(median),
+        'q1': float(q1),
+        'q3': float(q3),
+        'iqr': float(iqr),
+        'mad': float(np.median(np.abs(values - median))),
+        'std': float(values.std()),
+        'max': float(values.max()),
+        'min': float(values.min())
+    }
+
+    robust_z = robust_z_scores(values, median)
+    if count >= MIN_SAMPLES:
+        outliers = np.abs(robust_z) > ROBUST_Z_THRESHOLD
+        iqr_outliers = (values < q1 - IQR_FENCE * iqr) | (values > q3 + IQR_FENCE * iqr)
+    else:
+        outliers = np.zeros(count, dtype=bool)
+        iqr_outliers = np.zeros(count, dtype=bool)
+
+    if months is not None:
+        months = np.array([m or 0 for m in months], dtype=np.int64)
+        seasonal, seasonal_z = seasonal_baselines(values, months)
+        seasonal_outliers = np.abs(seasonal_z) > ROBUST_Z_THRESHOLD
+    else:
+        seasonal = {}
+        seasonal_outliers = np.zeros(count, dtype=bool)
+
+    return {
+        'statistics': statistics,
+        'robust_z': robust_z,
+        'outliers': outliers,
+        'iqr_outliers': iqr_outliers,
+        'seasonal': seasonal,
+        'seasonal_outliers': seasonal_outliers
+    }
@@ -0,0 +1,213 @@
+"""Ingestão contínua de uma pasta monitorada
+
+Observa uma pasta (inotify quando o pacote inotify_simple está instalado,
+senão varredura periódica), espera cada arquivo parar de crescer antes de
+considerá-lo completo e agrupa os arquivos que chegam juntos em uma sessão.
+Os arquivos passam pelo mesmo caminho do upload (process_file +
+save_processed_file) no pool de processos isolados, com tempo e memória
+limitados. Depois que a sessão é gravada, cada arquivo vai para a subpasta
+'processados' ou, se alguma planilha falhou, para 'erros'. Um ZIP com ao
+menos uma planilha importada vai para 'processados' (recolocá-lo na pasta
+importaria essas planilhas de novo) e os itens com falha ficam no log.
+
+Uso: python watch_folder.py PASTA [--workers N] [--debounce S] [--batch-window S]
+"""
+import argparse
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:  # sem inotify: varredura periódica
+    INotify = None
+
+from app import (ALLOWED_EXTENSIONS, ARCHIVE_EXTENSIONS, MAX_UPLOAD_FILE_SIZE, MAX_UPLOAD_ARCHIVE_SIZE,
+                 PARSE_MEMORY_LIMIT_MB, PARSE_TIMEOUT_SECONDS, PARSE_WORKER_MAX_TASKS,
+                 collect_upload_results, expand_archive_upload, failed_upload_future, init_storage, preload_parsing_modules,
+                 process_upload, save_session, store_local_file)
+from worker_pool import IsolatedWorkerPool
+
+PROCESSED_SUBFOLDER = 'processados'
+REJECTED_SUBFOLDER = 'rejeitados'
+ERROR_SUBFOLDER = 'erros'
+# Arquivos temporários de cópias/downloads em andamento
+TEMPORARY_SUFFIXES = ('.part', '.tmp', '.crdownload', '.partial')
+
+def list_candidates(folder):
+    """Arquivos aceitos na raiz da pasta: {caminho: (tamanho, mtime)}"""
+    candidates = {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            name = entry.name
+            if not entry.is_file() or name.startswith(('.', '~$')) or name.lower().endswith(TEMPORARY_SUFFIXES):
+                continue
+            if not name.lower().endswith(ALLOWED_EXTENSIONS + ARCHIVE_EXTENSIONS):
+                continue
+            stat = entry.stat()
+            candidates[entry.path] = (stat.st_size, stat.st_mtime)
+    return candidates
+
+def move_to(folder, subfolder, path):
+    """Move o arquivo para uma subpasta, sem sobrescrever arquivos de mesmo nome"""
+    target_dir = os.path.join(folder, subfolder)
+    os.makedirs(target_dir, exist_ok=True)
+    name = os.path.basename(path)
+    target = os.path.join(target_dir, name)
+    if os.path.exists(target):
+        stem, extension = os.path.splitext(name)
+        target = os.path.join(target_dir, f"{stem}_{uuid.uuid4().hex[:8]}{extension}")
+    shutil.move(path, target)
+
+def upload_failures(future):
+    """Mensagens de erro das planilhas de um arquivo já processado (vazia se tudo deu certo)"""
+    if future.exception() is not None:
+        return [str(future.exception())]
+    return [result.get('error') or 'falha no processamento' for result in future.result() if not result.get('success', False)]
+
+def upload_imported(future):
+    """True quando ao menos uma planilha do arquivo foi importada com sucesso"""
+    return future.exception() is None and any(result.get('success', False) for result in future.result())
+
+def ingest_batch(folder, paths, executor, multi_sheet=False):
+    """Cria uma sessão com os arquivos do lote e processa todos pelo pool
+
+    Os arquivos só saem da pasta depois que os resultados estão gravados: se o
+    processo cair no meio do lote, eles continuam lá e são importados de novo.
+    """
+    session_id = str(uuid.uuid4())
+    pending = []
+    sources = []  # (caminho original, é ZIP, [(nome, future)] das planilhas que saíram dele)
+
+    for path in paths:
+        name = os.path.basename(path)
+        is_archive = name.lower().endswith(ARCHIVE_EXTENSIONS)
+        limit = MAX_UPLOAD_ARCHIVE_SIZE if is_archive else MAX_UPLOAD_FILE_SIZE
+        if os.path.getsize(path) > limit:
+            print(f"⛔ {name} excede o limite de {limit // (1024 * 1024)} MB")
+            move_to(folder, REJECTED_SUBFOLDER, path)
+            continue
+
+        upload_info = store_local_file(path, name)
+        members = []
+
+        if is_archive:
+            for kind, member in expand_archive_upload(upload_info):
+                if kind == 'rejected':
+                    print(f"⚠️ {member['filename']} {member['reason']}")
+                    members.append((member['filename'], failed_upload_future(member['reason'])))
+                    continue
+                if kind == 'failed':
+                    future = failed_upload_future(member['error'])
+                else:
+                    future = executor.submit(process_upload, member['filepath'], member['filename'], multi_sheet)
+                pending.append((member, future))
+                members.append((member['filename'], future))
+        else:
+            future = executor.submit(process_upload, upload_info['filepath'], name, multi_sheet)
+            pending.append((upload_info, future))
+            members.append((name, future))
+        sources.append((path, is_archive, members))
+
+    if pending:
+        title = f"Pasta monitorada {datetime.now().strftime('%d/%m/%Y %H:%M')}"
+        results, successful_files, total_value = collect_upload_results(session_id, pending)
+        save_session(session_id, title, f'Importado automaticamente de {os.path.abspath(folder)}', successful_files, total_value)
+        print(f"📥 Lote importado: {successful_files} de {len(results)} arquivo(s) com sucesso na sessão {session_id}")
+
+    # Sessão gravada: agora é seguro tirar os arquivos da pasta monitorada
+    for path, is_archive, members in sources:
+        name = os.path.basename(path)
+        failures = [(member_name, message) for member_name, future in members for message in upload_failures(future)]
+        if is_archive:
+            succeeded = any(upload_imported(future) for _, future in members)
+        else:
+            succeeded = bool(members) and not failures
+        if not succeeded:
+            print(f"⚠️ {name} teve falhas; movido para '{ERROR_SUBFOLDER}'")
+        elif failures:
+            print(f"⚠️ {name} importado parcialmente; {len(failures)} item(ns) com falha:")
+            for member_name, message in failures:
+                print(f"   - {member_name}: {message}")
+        move_to(folder, PROCESSED_SUBFOLDER if succeeded else ERROR_SUBFOLDER, path)
+    return session_id if pending else None
+
+def wait_for_changes(notifier, timeout):
+    """Bloqueia até haver eventos na pasta (inotify) ou até o timeout"""
+    if notifier is None:
+        time.sleep(timeout)
+    else:
+        notifier.read(timeout=int(timeout * 1000))
+
+def watch(folder, workers=2, debounce=3.0, batch_window=10.0, batch_max=100, poll_interval=2.0, multi_sheet=False):
+    """Laço principal: detecta arquivos estáveis e importa em lotes"""
+    notifier = None
+    if INotify is not None:
+        notifier = INotify()
+        notifier.add_watch(folder, flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.MODIFY)
+    print(f"👀 Monitorando {os.path.abspath(folder)} ({'inotify' if notifier else 'varredura periódica'})")
+
+    observed = {}  # caminho -> ((tamanho, mtime), instante da última mudança)
+    batch = []
+    last_ready = 0.0
+
+    with IsolatedWorkerPool(workers, PARSE_TIMEOUT_SECONDS, PARSE_MEMORY_LIMIT_MB, PARSE_WORKER_MAX_TASKS,
+                            initializer=preload_parsing_modules,
+                            preload_modules=('app', 'pandas', 'openpyxl')) as executor:
+        while True:
+            # Sem inotify a espera é o próprio intervalo de varredura; com inotify,
+            # acorda a cada evento e ao menos a cada poll_interval para o debounce
+            wait_for_changes(notifier, poll_interval)
+            now = time.monotonic()
+
+            candidates = list_candidates(folder)
+            for path in list(observed):
+                if path not in candidates:
+                    del observed[path]
+
+            for path, signature in candidates.items():
+                if path in batch:
+                    continue
+                previous = observed.get(path)
+                if previous is None or previous[0] != signature:
+                    observed[path] = (signature, now)
+                elif now - previous[1] >= debounce:
+                    # Tamanho e mtime estáveis: a escrita terminou
+                    batch.append(path)
+                    del observed[path]
+                    last_ready = now
+
+            if batch and (len(batch) >= batch_max or now - last_ready >= batch_window):
+                try:
+                    ingest_batch(folder, batch, executor, multi_sheet)
+                except Exception as e:
+                    print(f"❌ Erro ao importar lote: {e}")
+                    # Sem isso o lote voltaria na próxima varredura e falharia de novo
+                    for path in batch:
+                        if os.path.exists(path):
+                            move_to(folder, ERROR_SUBFOLDER, path)
+                batch = []
+
+def main():
+    parser = argparse.ArgumentParser(description='Importa continuamente planilhas de uma pasta monitorada')
+    parser.add_argument('folder', help='pasta monitorada')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='processos de processamento')
+    parser.add_argument('--debounce', type=float, default=3.0, help='segundos sem mudança para considerar o arquivo completo')
+    parser.add_argument('--batch-window', type=float, default=10.0, help='segundos sem novos arquivos para fechar o lote')
+    parser.add_argument('--batch-max', type=int, default=100, help='máximo de arquivos por sessão')
+    parser.add_argument('--poll-interval', type=float, default=2.0, help='intervalo de varredura em segundos')
+    parser.add_argument('--multi-sheet', action='store_true', help='processa todas as abas mensais de cada planilha')
+    args = parser.parse_args()
+
+    os.makedirs(args.folder, exist_ok=True)
+    init_storage()
+    try:
+        watch(args.folder, args.workers, args.debounce, args.batch_window, args.batch_max,
+              args.poll_interval, args.multi_sheet)
+    except KeyboardInterrupt:
+        print("👋 Monitoramento encerrado")
+
+if __name__ == '__main__':
+    main()
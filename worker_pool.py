@@ -0,0 +1,300 @@
+"""Pool de processos isolados para o processamento de planilhas
+
+Cada tarefa roda em um processo separado do servidor, com:
+  - tempo limite de parede: o processo que estoura o tempo é encerrado e substituído;
+  - limite de memória (RLIMIT_AS, onde o módulo resource existe), contado a
+    partir do espaço de endereçamento do worker já com os módulos carregados;
+  - reciclagem do processo depois de max_tasks_per_worker tarefas, devolvendo
+    ao sistema a memória que o openpyxl/pandas acumulam.
+Falhas chegam ao chamador como exceções no Future (WorkerTimeout,
+WorkerMemoryExceeded, WorkerCrashed ou WorkerTaskError), sem derrubar o
+processo principal, com o tempo decorrido e a última etapa informada pela
+tarefa via report_progress(). A interface (submit/shutdown/with) é a do
+concurrent.futures.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+# BLAS/OpenMP com uma thread por worker: cada thread reserva arenas e pilha, o
+# que em máquinas com muitos núcleos consome o limite de memória antes da leitura
+WORKER_ENVIRONMENT = {'OPENBLAS_NUM_THREADS': '1', 'OMP_NUM_THREADS': '1', 'MKL_NUM_THREADS': '1'}
+environment_lock = threading.Lock()
+
+class WorkerError(Exception):
+    """Falha de uma tarefa no pool isolado
+
+    elapsed_ms e last_stage (a última etapa que a tarefa informou antes de
+    falhar) são preenchidos pelo supervisor quando a tarefa chegou a rodar.
+    """
+    elapsed_ms = None
+    last_stage = None
+
+class WorkerTimeout(WorkerError):
+    pass
+
+class WorkerMemoryExceeded(WorkerError):
+    pass
+
+class WorkerCrashed(WorkerError):
+    pass
+
+class WorkerTaskError(WorkerError):
+    pass
+
+# Pipe do processo atual com o supervisor; None fora de um worker
+progress_connection = None
+
+def report_progress(stage):
+    """Informa ao supervisor a etapa em que a tarefa está (sem efeito fora de um worker)"""
+    if progress_connection is not None:
+        progress_connection.send(('progress', stage))
+
+def virtual_memory_mb():
+    """Espaço de endereçamento atual do processo em MB (VmSize); None onde /proc não existe"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmSize:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+def apply_memory_limit(memory_limit_mb):
+    """Limita o espaço de endereçamento do processo atual a memory_limit_mb além do que ele já usa
+
+    O RLIMIT_AS conta memória virtual (bibliotecas mapeadas, arenas e pilhas de
+    threads), não a residente; por isso o limite é somado ao VmSize medido
+    depois do preload. Sem efeito onde não há o módulo resource.
+    """
+    try:
+        import resource
+    except ImportError:
+        return
+    baseline_mb = virtual_memory_mb() or 0
+    limit = (baseline_mb + memory_limit_mb) * 1024 * 1024
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError) as e:
+        print(f"⚠️ Não foi possível limitar a memória do worker: {e}")
+
+def worker_main(connection, memory_limit_mb, max_tasks, initializer=None):
+    """Laço do processo filho: executa até max_tasks tarefas recebidas pelo pipe e termina"""
+    global progress_connection
+    progress_connection = connection
+    for name, value in WORKER_ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+    if initializer is not None:
+        initializer()
+    # Depois do preload: o limite vale para o processamento, não para as bibliotecas
+    if memory_limit_mb:
+        apply_memory_limit(memory_limit_mb)
+
+    for _ in range(max_tasks):
+        try:
+            task = connection.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+
+        fn, args, kwargs = task
+        try:
+            connection.send(('ok', fn(*args, **kwargs)))
+        except MemoryError:
+            # Memória do processo comprometida: responde e sai para ser substituído
+            connection.send(('memory', None))
+            break
+        except Exception as e:
+            connection.send(('error', f'{type(e).__name__}: {e}'))
+
+    connection.close()
+
+class IsolatedWorkerPool:
+    """Pool de até max_workers processos isolados, iniciados sob demanda"""
+
+    def __init__(self, max_workers, timeout=None, memory_limit_mb=None, max_tasks_per_worker=50,
+                 initializer=None, preload_modules=(), start_method=None):
+        self.max_workers = max_workers
+        self.initializer = initializer
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.max_tasks_per_worker = max_tasks_per_worker
+        # forkserver (Unix) cria cada worker a partir de um processo limpo, com os
+        # módulos de preload_modules já importados; spawn nos demais sistemas
+        if start_method is None:
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        self._context = multiprocessing.get_context(start_method)
+        if start_method == 'forkserver' and preload_modules:
+            self._context.set_forkserver_preload(list(preload_modules))
+        self._tasks = deque()
+        self._condition = threading.Condition()
+        self._slots = []
+        self._shutdown = False
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError('Pool encerrado')
+            self._tasks.append((future, fn, args, kwargs))
+            # Um supervisor (thread) por processo, criados conforme a demanda
+            if len(self._slots) < self.max_workers and len(self._tasks) > self._idle_slots():
+                slot = {'busy': False}
+                slot['thread'] = threading.Thread(target=self._supervise, args=(slot,),
+                                                  name=f'isolated-worker-{len(self._slots)}', daemon=True)
+                self._slots.append(slot)
+                slot['thread'].start()
+            self._condition.notify()
+        return future
+
+    def _idle_slots(self):
+        return sum(1 for slot in self._slots if not slot['busy'])
+
+    def _start_process(self):
+        parent_connection, child_connection = self._context.Pipe()
+        process = self._context.Process(
+            target=worker_main,
+            args=(child_connection, self.memory_limit_mb, self.max_tasks_per_worker, self.initializer),
+            daemon=True
+        )
+        # O forkserver (que já importa numpy no preload) e o spawn herdam o ambiente
+        # do momento em que são criados: as variáveis valem só durante o start
+        with environment_lock:
+            previous = {name: os.environ.get(name) for name in WORKER_ENVIRONMENT}
+            for name, value in WORKER_ENVIRONMENT.items():
+                os.environ.setdefault(name, value)
+            try:
+                process.start()
+            finally:
+                for name, value in previous.items():
+                    if value is None:
+                        os.environ.pop(name, None)
+                    else:
+                        os.environ[name] = value
+        child_connection.close()
+        return process, parent_connection
+
+    @staticmethod
+    def _stop_process(process, connection, kill=False):
+        if kill:
+            process.kill()
+        else:
+            try:
+                connection.send(None)
+            except (OSError, EOFError):
+                pass
+        connection.close()
+        process.join(5)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+    def _supervise(self, slot):
+        """Entrega tarefas a um processo filho, aplicando o tempo limite e a reciclagem"""
+        process, connection, completed = None, None, 0
+        while True:
+            with self._condition:
+                slot['busy'] = False
+                while not self._tasks and not self._shutdown:
+                    self._condition.wait()
+                if not self._tasks:
+                    break
+                future, fn, args, kwargs = self._tasks.popleft()
+                slot['busy'] = True
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            if process is not None and (completed >= self.max_tasks_per_worker or not process.is_alive()):
+                self._stop_process(process, connection)
+                process = None
+            if process is None:
+                try:
+                    process, connection = self._start_process()
+                except Exception as e:
+                    future.set_exception(WorkerCrashed(f'não foi possível iniciar o processo de leitura: {e}'))
+                    continue
+                completed = 0
+
+            try:
+                connection.send((fn, args, kwargs))
+            except Exception as e:
+                # Tarefa não serializável ou pipe quebrado
+                future.set_exception(WorkerTaskError(f'Não foi possível enviar a tarefa ao worker: {e}'))
+                self._stop_process(process, connection, kill=True)
+                process = None
+                continue
+
+            started = time.monotonic()
+            progress = {'started': started, 'stage': None}
+            # Mensagens de progresso até a resposta final, dentro do mesmo tempo limite
+            while True:
+                remaining = None if self.timeout is None else max(started + self.timeout - time.monotonic(), 0)
+                if not connection.poll(remaining):
+                    status = None
+                    break
+                try:
+                    status, value = connection.recv()
+                except (EOFError, OSError):
+                    status = 'lost'
+                    break
+                if status != 'progress':
+                    break
+                progress['stage'] = value
+
+            if status is None:
+                self._stop_process(process, connection, kill=True)
+                process = None
+                self._fail(future, WorkerTimeout(f'tempo limite de {self.timeout:g}s excedido'), progress)
+                continue
+
+            if status == 'lost':
+                process.join(5)
+                exitcode = process.exitcode
+                self._stop_process(process, connection, kill=True)
+                process = None
+                if exitcode == -9:
+                    # SIGKILL sem termos pedido: normalmente o OOM killer do sistema
+                    self._fail(future, WorkerMemoryExceeded('processo encerrado pelo sistema por falta de memória'), progress)
+                else:
+                    self._fail(future, WorkerCrashed(f'o processo de leitura terminou inesperadamente (código {exitcode})'), progress)
+                continue
+
+            completed += 1
+            if status == 'ok':
+                future.set_result(value)
+            elif status == 'memory':
+                self._stop_process(process, connection)
+                process = None
+                self._fail(future, WorkerMemoryExceeded(f'limite de memória de {self.memory_limit_mb} MB excedido'), progress)
+            else:
+                self._fail(future, WorkerTaskError(value), progress)
+
+        if process is not None:
+            self._stop_process(process, connection)
+
+    @staticmethod
+    def _fail(future, error, progress):
+        error.elapsed_ms = (time.monotonic() - progress['started']) * 1000
+        error.last_stage = progress['stage']
+        future.set_exception(error)
+
+    def shutdown(self, wait=True):
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        if wait:
+            for slot in list(self._slots):
+                slot['thread'].join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown(wait=True)
+        return False
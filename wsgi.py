@@ -0,0 +1,15 @@
+"""Ponto de entrada WSGI para servidores de produção multi-processo
+
+Cada worker chama create_app(); a inicialização do banco é idempotente e
+serializada entre processos pelo próprio SQLite, então vários workers podem
+subir ao mesmo tempo. Exemplos:
+
+    gunicorn -w 4 -b 0.0.0.0:5000 wsgi:app             (Linux)
+    waitress-serve --threads 8 --port 5000 wsgi:app     (Windows)
+
+Defina SECRET_KEY no ambiente para que todos os workers assinem as mensagens
+de sessão (flash) com a mesma chave.
+"""
+from app import create_app
+
+app = create_app()